@@ -6,7 +6,7 @@ from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.hashers import check_password
 from django.urls import reverse
-from store.utils import paginate_queryset
+from store.utils import paginate_queryset, set_nav_count
 from store import models as store_models
 from customer import models as customer_models
 
@@ -125,9 +125,11 @@ def toggle_wishlist(request, id):
         )
         if not created:
             wishlist_item.delete()
-            total_wishlist_items = customer_models.Wishlist.objects.filter(
-                user=request.user
-            ).count()
+            total_wishlist_items = set_nav_count(
+                "wishlist",
+                customer_models.Wishlist.objects.filter(user=request.user).count(),
+                user_id=request.user.pk,
+            )
             return JsonResponse(
                 {
                     "status": "removed",
@@ -139,9 +141,11 @@ def toggle_wishlist(request, id):
             # Optionally mark current session id for consistency (useful for header count if session is used elsewhere)
             wishlist_item.wishlist_id = cart_id
             wishlist_item.save(update_fields=["wishlist_id"])
-            total_wishlist_items = customer_models.Wishlist.objects.filter(
-                user=request.user
-            ).count()
+            total_wishlist_items = set_nav_count(
+                "wishlist",
+                customer_models.Wishlist.objects.filter(user=request.user).count(),
+                user_id=request.user.pk,
+            )
             return JsonResponse(
                 {
                     "status": "added",
@@ -155,9 +159,11 @@ def toggle_wishlist(request, id):
         )
         if not created:
             wishlist_item.delete()
-            total_wishlist_items = customer_models.Wishlist.objects.filter(
-                wishlist_id=cart_id
-            ).count()
+            total_wishlist_items = set_nav_count(
+                "wishlist",
+                customer_models.Wishlist.objects.filter(wishlist_id=cart_id).count(),
+                cart_id=cart_id,
+            )
             return JsonResponse(
                 {
                     "status": "removed",
@@ -166,9 +172,11 @@ def toggle_wishlist(request, id):
                 }
             )
         else:
-            total_wishlist_items = customer_models.Wishlist.objects.filter(
-                wishlist_id=cart_id
-            ).count()
+            total_wishlist_items = set_nav_count(
+                "wishlist",
+                customer_models.Wishlist.objects.filter(wishlist_id=cart_id).count(),
+                cart_id=cart_id,
+            )
             return JsonResponse(
                 {
                     "status": "added",
@@ -1,33 +1,109 @@
+import atexit
+import threading
+import time
+from datetime import timedelta
+
 from django.core.cache import cache
+from django.utils import timezone
+
 
 class RequestCounterMiddleware:
     """
     Middleware for counting requests and unique IP addresses for users and bots,
     using Redis for persistence across restarts and multiple processes.
+
+    Hits are buffered per worker and written in a single pipelined round trip
+    every FLUSH_INTERVAL seconds (or once MAX_PENDING hits are queued). Unique
+    IPs are tracked with HyperLogLog, so memory stays bounded regardless of
+    traffic. Per-day rollups are kept for ROLLUP_DAYS days.
     """
 
+    FLUSH_INTERVAL = 5  # seconds
+    MAX_PENDING = 500
+    ROLLUP_DAYS = 35
+    KINDS = ("user", "bot")
+
     def __init__(self, get_response):
         self.get_response = get_response
-        # Access the raw Redis client for set operations
+        # Access the raw Redis client for pipelined operations
         self.redis = cache.client.get_client(write=True)
+        self._lock = threading.Lock()
+        self._reset_buffer()
+        self._last_flush = time.monotonic()
+        # Don't lose the tail of the buffer when the worker shuts down
+        atexit.register(self.flush)
 
-    def safe_incr(self, key, amount=1):
-        if cache.get(key) is None:
-            cache.set(key, 0, timeout=None)
-        cache.incr(key, amount)
+    def _reset_buffer(self):
+        self._pending = 0
+        self._counts = {kind: 0 for kind in self.KINDS}
+        self._ips = {kind: set() for kind in self.KINDS}
+        self._day = timezone.localdate()
 
     def __call__(self, request):
         ip = self.get_client_ip(request)
-        is_bot = self.is_bot_request(request)
+        kind = "bot" if self.is_bot_request(request) else "user"
+        self.record(kind, ip)
+        return self.get_response(request)
 
-        if is_bot:
-            self.safe_incr("bot_request_count")
-            self.redis.sadd("bot_ips", ip)
-        else:
-            self.safe_incr("user_request_count")
-            self.redis.sadd("user_ips", ip)
+    def record(self, kind, ip):
+        with self._lock:
+            # Never mix two days in one buffer
+            if timezone.localdate() != self._day and self._pending:
+                self._flush_locked()
+            self._counts[kind] += 1
+            if ip:
+                self._ips[kind].add(ip)
+            self._pending += 1
+            due = (
+                self._pending >= self.MAX_PENDING
+                or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL
+            )
+            if due:
+                self._flush_locked()
 
-        return self.get_response(request)
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            self._day = timezone.localdate()
+            return
+        counts, ips, day = self._counts, self._ips, self._day
+        self._reset_buffer()
+        try:
+            expire = self.ROLLUP_DAYS * 86400
+            pipe = self.redis.pipeline(transaction=False)
+            for kind in self.KINDS:
+                if not counts[kind]:
+                    continue
+                day_count, day_ips = self.daily_keys(kind, day)
+                pipe.incrby(self.total_count_key(kind), counts[kind])
+                pipe.incrby(day_count, counts[kind])
+                pipe.expire(day_count, expire)
+                if ips[kind]:
+                    pipe.pfadd(self.total_ips_key(kind), *ips[kind])
+                    pipe.pfadd(day_ips, *ips[kind])
+                    pipe.expire(day_ips, expire)
+            pipe.execute()
+        except Exception:
+            # Stats are best-effort; never break the request on Redis errors
+            pass
+
+    @staticmethod
+    def total_count_key(kind):
+        # Same key the cache API reads, so cache.get keeps working
+        return cache.make_key(f"{kind}_request_count")
+
+    @staticmethod
+    def total_ips_key(kind):
+        return f"{kind}_ips_hll"
+
+    @staticmethod
+    def daily_keys(kind, day):
+        stamp = day.strftime("%Y%m%d")
+        return f"request_stats:{kind}:{stamp}:count", f"request_stats:{kind}:{stamp}:ips"
 
     @staticmethod
     def get_bot_request_count():
@@ -39,14 +115,35 @@ class RequestCounterMiddleware:
 
     @staticmethod
     def get_bot_request_unique_count():
-        # Use the Redis SCARD command for set cardinality
         redis = cache.client.get_client(write=True)
-        return redis.scard("bot_ips") or 0
+        return redis.pfcount(RequestCounterMiddleware.total_ips_key("bot")) or 0
 
     @staticmethod
     def get_user_request_unique_count():
         redis = cache.client.get_client(write=True)
-        return redis.scard("user_ips") or 0
+        return redis.pfcount(RequestCounterMiddleware.total_ips_key("user")) or 0
+
+    @staticmethod
+    def get_daily_stats(days=7):
+        """Return [{date, user, user_unique, bot, bot_unique}, ...] newest first."""
+        redis = cache.client.get_client(write=True)
+        today = timezone.localdate()
+        dates = [today - timedelta(days=offset) for offset in range(days)]
+        pipe = redis.pipeline(transaction=False)
+        for day in dates:
+            for kind in RequestCounterMiddleware.KINDS:
+                count_key, ips_key = RequestCounterMiddleware.daily_keys(kind, day)
+                pipe.get(count_key)
+                pipe.pfcount(ips_key)
+        results = iter(pipe.execute())
+        rows = []
+        for day in dates:
+            row = {"date": day}
+            for kind in RequestCounterMiddleware.KINDS:
+                row[kind] = int(next(results) or 0)
+                row[f"{kind}_unique"] = int(next(results) or 0)
+            rows.append(row)
+        return rows
 
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -59,4 +156,4 @@ class RequestCounterMiddleware:
     def is_bot_request(self, request):
         user_agent = request.META.get('HTTP_USER_AGENT', '').lower()
         bot_signatures = ['bot', 'crawl', 'spider', 'slurp']
-        return any(bot_sig in user_agent for bot_sig in bot_signatures)
\ No newline at end of file
+        return any(bot_sig in user_agent for bot_sig in bot_signatures)
@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     "django.contrib.humanize",
     "django.contrib.staticfiles",
     "django.contrib.sitemaps",
+    "django.contrib.postgres",
     "userauths",
     "store",
     "customer",
@@ -146,6 +147,11 @@ RECAPTCHA_PRIVATE_KEY = env("DJANGO_RECAPTCHA_PRIVATE_KEY")
 FACEBOOK_PIXEL_ID = env("FACEBOOK_PIXEL_ID")
 FACEBOOK_CAPI_ACCESS_TOKEN = env("FACEBOOK_CAPI_ACCESS_TOKEN")
 FACEBOOK_CAPI_TEST_CODE = env("FACEBOOK_CAPI_TEST_CODE", default=None)
+META_GRAPH_BASE = env("META_GRAPH_BASE", default="https://graph.facebook.com")
+
+# Per-provider overrides for store.integrations (timeout, retries, backoff,
+# pool_size, failure_threshold, reset_after), e.g. {"speedy": {"retries": 1}}
+INTEGRATION_HTTP = {}
 
 # --- Miscellaneous ---
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -160,6 +166,10 @@ ECONT_SHOP_ID = env("ECONT_SHOP_ID")
 ECONT_SHIPPMENT_CALC_URL = env("ECONT_SHIPPMENT_CALC_URL", default="https://delivery.econt.com/customer_info.php")
 ECONT_UPDATE_ORDER_ENDPOINT = env("ECONT_UPDATE_ORDER_ENDPOINT", default="https://delivery.econt.com/services/OrdersService.updateOrder.json")
 ECONT_PRIVATE_KEY = env("ECONT_PRIVATE_KEY")
+# Shipment tracking uses the Econt customer account, not the shop key
+ECONT_TRACKING_ENDPOINT = env("ECONT_TRACKING_ENDPOINT", default="https://ee.econt.com/services/Shipments/ShipmentService.getShipmentStatuses.json")
+ECONT_USERNAME = env("ECONT_USERNAME", default="")
+ECONT_PASSWORD = env("ECONT_PASSWORD", default="")
 
 # --- Speedy Integration ---
 SPEEDY_USERNAME = env("SPEEDY_USERNAME")
@@ -21,6 +21,13 @@ $(document).ready(function () {
         const bgnText = bgn.toLocaleString("bg-BG", fmt) + " лв.";
         return eurText + " / " + bgnText;
     }
+    function updateCartLineSubTotals(subTotalsByItem) {
+        // Promo allocation can change sibling lines, so refresh every line sub total
+        if (!subTotalsByItem) return;
+        Object.keys(subTotalsByItem).forEach(function (key) {
+            $(".item_sub_total_" + key).text(formatDualCurrency(subTotalsByItem[key]));
+        });
+    }
     function generateCartId() {
         // Retrieve the value of "cartId" from local storage and assign it to the variable 'ls_cartId'
         const ls_cartId = localStorage.getItem("cartId");
@@ -101,7 +108,11 @@ $(document).ready(function () {
                             quantity: parseInt(qty)
                         }]
                     };
-                    fbq('track', 'AddToCart', fbqData);
+                    if (response.meta_event_id) {
+                        fbq('track', 'AddToCart', fbqData, { eventID: response.meta_event_id });
+                    } else {
+                        fbq('track', 'AddToCart', fbqData);
+                    }
                 }
                 $(".total_cart_items").text(response.total_cart_items);
             },
@@ -161,6 +172,7 @@ $(document).ready(function () {
                 }
                 $(".item-qty-" + item_id).val(response.current_qty);
                 $(".item_sub_total_" + item_id).text(formatDualCurrency(response.item_sub_total));
+                updateCartLineSubTotals(response.item_sub_totals_by_item);
                 $(".cart_sub_total").text(formatDualCurrency(response.cart_sub_total));
                 var hiddenSub = document.getElementById('cart-order-subtotal');
                 if (hiddenSub) {
@@ -242,6 +254,7 @@ $(document).ready(function () {
                     title: response.message,
                 });
                 $(".total_cart_items").text(response.total_cart_items);
+                updateCartLineSubTotals(response.item_sub_totals_by_item);
                 $(".cart_sub_total").text(formatDualCurrency(response.cart_sub_total));
                 var hiddenSub = document.getElementById('cart-order-subtotal');
                 if (hiddenSub) {
@@ -266,6 +279,17 @@ $(document).ready(function () {
         });
     });
 
+    // Show how many products each category/colour option would match
+    function updateFacetCounts(facets) {
+        if (!facets) {
+            return;
+        }
+        $(".facet-count").each(function () {
+            let counts = facets[$(this).data("facet")] || {};
+            $(this).text("(" + (counts[$(this).data("value")] || 0) + ")");
+        });
+    }
+
     // Function to gather all current filter values
     function getFilters() {
         let filters = {
@@ -302,7 +326,9 @@ $(document).ready(function () {
                     $(".product_count").html(response.product_count);
                     if (response.pagination_html !== undefined) {
                         $("#pagination-block").html(response.pagination_html);
+                        observeLoadMore();
                     }
+                    updateFacetCounts(response.facets);
                 },
                 error: function (error) {
                     console.log("Error fetching filtered products:", error);
@@ -311,6 +337,25 @@ $(document).ready(function () {
         }
     );
 
+    // Autocomplete for the shop search box (served from an in-memory index)
+    let suggestTimer = null;
+    $(document).on("input", ".search-filter", function () {
+        let query = $(this).val();
+        clearTimeout(suggestTimer);
+        if (query.trim().length < 2) {
+            $("#search-suggestions").empty();
+            return;
+        }
+        suggestTimer = setTimeout(function () {
+            $.getJSON("/search/suggest/", { q: query }, function (response) {
+                let list = $("#search-suggestions").empty();
+                response.suggestions.forEach(function (suggestion) {
+                    list.append($("<option>").attr("value", suggestion.label));
+                });
+            });
+        }, 120);
+    });
+
     $(document).on("click", ".reset_shop_filter_btn", function () {
         let filters = {
             categories: [],
@@ -354,6 +399,7 @@ $(document).ready(function () {
                 $(".product_count").html(response.product_count);
                 if (response.pagination_html !== undefined) {
                     $("#pagination-block").html(response.pagination_html);
+                    observeLoadMore();
                 }
             },
             error: function (error) {
@@ -370,49 +416,54 @@ $(document).ready(function () {
         }
     });
 
-    // Pagination click handler for AJAX (only on shop/filtered pages)
-    $(document).on("click", ".shop-pagination .page-link", function (e) {
-        e.preventDefault();
-        var page = null;
-        // If the link is disabled or active, do nothing
-        if (
-            $(this).closest("li").hasClass("disabled") ||
-            $(this).closest("li").hasClass("active")
-        ) {
+    // Infinite scroll: fetch the next keyset page when "load more" comes into view
+    function loadMore(block) {
+        if (block.data("loading")) {
             return;
         }
-        // Try to extract page number from href or data attribute
-        var href = $(this).attr("href");
-        if (href) {
-            var match = href.match(/page=(\d+)/);
-            if (match) {
-                page = match[1];
-            }
-        }
-        if (!page) {
-            // fallback: try data-page attribute
-            page = $(this).data("page");
-        }
-        if (!page) {
-            return;
+        block.data("loading", true);
+        let request;
+        if (block.hasClass("shop-listing-more")) {
+            let filters = getFilters();
+            filters.cursor = block.data("cursor");
+            request = $.ajax({ url: "/filter-products/", method: "GET", data: filters });
+        } else {
+            request = $.ajax({ url: block.find(".listing-more-link").attr("href"), method: "GET" });
         }
-        var filters = getFilters();
-        filters.page = page;
-        $.ajax({
-            url: "/filter-products/",
-            method: "GET",
-            data: filters,
-            success: function (response) {
-                $("#products-list").html(response.html);
-                $(".product_count").html(response.product_count);
-                if (response.pagination_html !== undefined) {
-                    $("#pagination-block").html(response.pagination_html);
+        request
+            .done(function (response) {
+                $("#products-list").append(response.html);
+                block.replaceWith(response.pagination_html || "");
+                observeLoadMore();
+            })
+            .fail(function (error) {
+                block.data("loading", false);
+                console.log("Error fetching more products:", error);
+            });
+    }
+
+    const loadMoreObserver = "IntersectionObserver" in window
+        ? new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    loadMore($(entry.target));
                 }
-            },
-            error: function (error) {
-                console.log("Error fetching paginated products:", error);
-            },
-        });
+            });
+        }, { rootMargin: "400px" })
+        : null;
+
+    function observeLoadMore() {
+        if (loadMoreObserver) {
+            $(".listing-more").each(function () {
+                loadMoreObserver.observe(this);
+            });
+        }
+    }
+    observeLoadMore();
+
+    $(document).on("click", ".listing-more-link", function (e) {
+        e.preventDefault();
+        loadMore($(this).closest(".listing-more"));
     });
 
     $(document).on("click", ".add_to_wishlist", function () {
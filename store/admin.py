@@ -1,7 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db import models
 from django.http import HttpResponseRedirect
 from django.utils.html import format_html
+from django.utils import timezone
 from ibands_site.admin import iBandsModelAdmin
 from store import models as store_models
 from store.admin_forms import DuplicateProductForm
@@ -247,6 +248,7 @@ class OrderAdmin(iBandsModelAdmin):
 
     inlines = [OrderItemInline]
     readonly_fields = ["address_display",]
+    actions = ["create_shipping_labels"]
     fields = [
         "customer",
         "address_display",
@@ -294,6 +296,20 @@ class OrderAdmin(iBandsModelAdmin):
         return "-"
     address_display.short_description = "Address"
 
+    @admin.action(description="Създай товарителници за избраните поръчки")
+    def create_shipping_labels(self, request, queryset):
+        from store.fulfilment import create_shipments
+
+        result = create_shipments(queryset)
+        level = messages.WARNING if result["failed"] else messages.SUCCESS
+        self.message_user(
+            request,
+            f"Създадени: {len(result['created'])}, пропуснати: {len(result['skipped'])}, "
+            f"неуспешни: {len(result['failed'])}"
+            + (f" ({', '.join(result['failed'])})" if result["failed"] else ""),
+            level,
+        )
+
 
 @admin.register(store_models.OrderItem)
 class OrderItemAdmin(iBandsModelAdmin):
@@ -307,6 +323,51 @@ class OrderItemAdmin(iBandsModelAdmin):
         return product_path_label(obj.product, link=True)
 
 
+@admin.register(store_models.FulfilmentJob)
+class FulfilmentJobAdmin(iBandsModelAdmin):
+    list_display = ["order", "kind", "status", "attempts", "run_after", "last_error", "updated_at"]
+    list_filter = ["status", "kind"]
+    search_fields = ["order__order_id"]
+    list_select_related = ["order"]
+    readonly_fields = ["created_at", "updated_at", "locked_at"]
+    actions = ["retry_jobs"]
+
+    @admin.action(description="Retry selected jobs now")
+    def retry_jobs(self, request, queryset):
+        updated = queryset.exclude(status="done").update(
+            status="pending", attempts=0, run_after=timezone.now(), locked_at=None
+        )
+        self.message_user(request, f"Queued {updated} job(s) for retry.")
+
+
+@admin.register(store_models.OutboxEmail)
+class OutboxEmailAdmin(iBandsModelAdmin):
+    list_display = ["to_email", "subject", "status", "attempts", "run_after", "sent_at", "last_error"]
+    list_filter = ["status"]
+    search_fields = ["to_email", "subject"]
+    readonly_fields = ["created_at", "updated_at", "locked_at", "sent_at"]
+    actions = ["retry_emails"]
+
+    @admin.action(description="Retry selected emails now")
+    def retry_emails(self, request, queryset):
+        updated = queryset.exclude(status="done").update(
+            status="pending", attempts=0, run_after=timezone.now(), locked_at=None
+        )
+        self.message_user(request, f"Queued {updated} email(s) for retry.")
+
+
+@admin.register(store_models.SpeedySite)
+class SpeedySiteAdmin(iBandsModelAdmin):
+    list_display = ["id", "type", "name", "name_en", "municipality", "post_code", "synced_at"]
+    search_fields = ["name", "name_en", "post_code"]
+
+
+@admin.register(store_models.SpeedyOffice)
+class SpeedyOfficeAdmin(iBandsModelAdmin):
+    list_display = ["id", "name", "site_id", "synced_at"]
+    search_fields = ["name", "name_en"]
+
+
 class VariantItemInline(admin.TabularInline):
     model = store_models.VariantItem
     extra = 0
@@ -2,6 +2,9 @@ from django.contrib import admin
 from django.template.response import TemplateResponse
 from ibands_site.middleware import RequestCounterMiddleware
 from store.utils import get_500_error_stats
+from store.emails import get_outbox_stats
+from store.speedy import get_quote_stats
+from store.integrations import get_integration_stats
 
 
 def stats_view(request):
@@ -12,5 +15,13 @@ def stats_view(request):
         "bot_request_unique_count": RequestCounterMiddleware.get_bot_request_unique_count(),
     }
     stats.update(get_500_error_stats())
-    context = dict(admin.site.each_context(request), stats=stats)
+    daily_stats = RequestCounterMiddleware.get_daily_stats()
+    context = dict(
+        admin.site.each_context(request),
+        stats=stats,
+        daily_stats=daily_stats,
+        outbox_stats=get_outbox_stats(),
+        speedy_quote_stats=get_quote_stats(),
+        integration_stats=get_integration_stats(),
+    )
     return TemplateResponse(request, "admin/stats.html", context)
\ No newline at end of file
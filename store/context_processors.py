@@ -1,8 +1,18 @@
+import uuid
+
 from django.core.cache import cache
 from django.conf import settings
+from django.db import transaction
 from .models import Category, Cart, CategoryLink, StoreThemeSettings
+from .utils import get_nav_counts, set_nav_count
 from customer.models import Wishlist
 
+CATEGORY_TREE_VERSION_KEY = "category_tree_version"
+
+# Process-local copy of the tree: (version, tree). Only the version string is
+# read from Redis per request; the pickled tree is fetched when it changes.
+_local_category_tree = (None, None)
+
 
 def build_category_tree(categories):
     """Recursively build a category tree from a flat list."""
@@ -34,30 +44,68 @@ def build_category_tree(categories):
         cat.url = cat.get_absolute_url()
     return tree
 
-def navigation_context(request):
-    # Fetch category tree from cache
+def _reset_category_tree():
+    cache.delete("category_tree")
+    cache.set(CATEGORY_TREE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_category_tree():
+    """Drop the shared tree and bump the version so every process reloads it, once committed."""
+    # Earlier, a request could rebuild the old tree and keep it under the new version
+    transaction.on_commit(_reset_category_tree)
+
+
+def get_category_tree():
+    global _local_category_tree
+    version = cache.get(CATEGORY_TREE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(CATEGORY_TREE_VERSION_KEY, version, timeout=None):
+            version = cache.get(CATEGORY_TREE_VERSION_KEY)
+
+    local_version, local_tree = _local_category_tree
+    if local_tree is not None and local_version == version:
+        return local_tree
+
     category_tree = cache.get("category_tree")
     if category_tree is None:
         categories = list(Category.objects.all().select_related('parent'))
         category_tree = build_category_tree(categories)
         cache.set("category_tree", category_tree, timeout=None)
+    _local_category_tree = (version, category_tree)
+    return category_tree
+
+
+def navigation_context(request):
+    category_tree = get_category_tree()
 
     try:
         cart_id = request.session.get("cart_id")
-        total_cart_items = Cart.objects.filter(cart_id=cart_id).count()
     except Exception:
-        total_cart_items = 0
+        cart_id = None
+    user_id = request.user.pk if getattr(request, "user", None) and request.user.is_authenticated else None
+    counts = get_nav_counts(cart_id=cart_id, user_id=user_id)
 
-    try:
-        if request.user.is_authenticated:
-            wishlist_count = Wishlist.objects.filter(user=request.user).count()
-        else:
-            cart_id = request.session.get("cart_id")
-            wishlist_count = (
-                Wishlist.objects.filter(wishlist_id=cart_id).count() if cart_id else 0
-            )
-    except Exception:
-        wishlist_count = 0
+    total_cart_items = counts["cart"]
+    if total_cart_items is None:
+        try:
+            total_cart_items = Cart.objects.filter(cart_id=cart_id).count() if cart_id else 0
+            set_nav_count("cart", total_cart_items, cart_id=cart_id)
+        except Exception:
+            total_cart_items = 0
+
+    wishlist_count = counts["wishlist"]
+    if wishlist_count is None:
+        try:
+            if user_id:
+                wishlist_count = Wishlist.objects.filter(user_id=user_id).count()
+            else:
+                wishlist_count = (
+                    Wishlist.objects.filter(wishlist_id=cart_id).count() if cart_id else 0
+                )
+            set_nav_count("wishlist", wishlist_count, cart_id=cart_id, user_id=user_id)
+        except Exception:
+            wishlist_count = 0
 
     return {
         "category_tree": category_tree,
@@ -1,9 +1,15 @@
-from django.core.mail import EmailMultiAlternatives
+import time
+
+from django.core.cache import cache
+from django.core.mail import get_connection
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 
+from store.models import OutboxEmail
+
 def _validated_email(email_value):
     """Return a cleaned, valid email or None if invalid."""
     if not email_value:
@@ -30,38 +36,77 @@ def _validated_email(email_value):
     return candidate
 
 
-def send_order_notification_email(order, email_heading, email_title, to_email):
-    context = {
-        "order": order,
-        "order_items": order.order_items.all,
-        "email_heading": email_heading,
-        "email_title": email_title,
-    }
-    subject = f"{email_heading}"
-    text_body = render_to_string("email/order.txt", context)
-    html_body = render_to_string("email/order.html", context)
-
-    cleaned_recipient = _validated_email(to_email)
-    if not cleaned_recipient:
-        # No valid recipient; do not attempt to send
-        return
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=text_body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[cleaned_recipient],
-    )
-    msg.attach_alternative(html_body, "text/html")
+def queue_email(subject, text_body, html_body, recipients):
+    """
+    Store a rendered email in the outbox, one row per valid recipient.
+    Delivery happens in the send_outbox_emails worker, never in the request.
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    seen = set()
+    rows = []
+    for recipient in recipients or []:
+        cleaned = _validated_email(recipient)
+        if not cleaned or cleaned.lower() in seen:
+            continue
+        seen.add(cleaned.lower())
+        rows.append(
+            OutboxEmail(
+                subject=subject,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to_email=cleaned,
+                text_body=text_body,
+                html_body=html_body or "",
+            )
+        )
+    if rows:
+        OutboxEmail.objects.bulk_create(rows)
+    return len(rows)
+
+
+def send_order_notification_email(order, email_heading, email_title, to_email, fail_silently=True):
+    """
+    Render the order email once and queue a copy for every recipient.
+    `to_email` may be a single address or a list (e.g. customer + shop copy).
+    """
+    recipients = [to_email] if isinstance(to_email, str) or to_email is None else list(to_email)
+    if not any(_validated_email(r) for r in recipients):
+        # No valid recipient; do not render anything
+        return 0
     try:
-        msg.send()
+        context = {
+            "order": order,
+            "order_items": order.order_items.all,
+            "email_heading": email_heading,
+            "email_title": email_title,
+        }
+        subject = f"{email_heading}"
+        text_body = render_to_string("email/order.txt", context)
+        html_body = render_to_string("email/order.html", context)
+        return queue_email(subject, text_body, html_body, recipients)
     except Exception:
         # Fail safe: don't let email errors break checkout flow
-        pass
+        # (the fulfilment worker passes fail_silently=False to retry instead)
+        if not fail_silently:
+            raise
+        return 0
+
+
+ORDER_STATUS_EMAILS = {
+    "shipped": ("Поръчка #{order_id} e изпратена", "iBands: Пратката е изпратена"),
+    "delivered": ("Поръчка #{order_id} е доставена", "iBands: Пратката е доставена"),
+}
+
+
+def order_status_email(order, status):
+    """(email_heading, email_title) for a shipped/delivered notification."""
+    heading, title = ORDER_STATUS_EMAILS[status]
+    return heading.format(order_id=order.order_id), title
 
 
 def send_welcome_email(user=None, to_email=None, full_name=None):
     """
-    Send a welcome email to a newly registered user.
+    Queue a welcome email for a newly registered user.
     You can pass a user instance or just to_email/full_name.
     """
     try:
@@ -86,15 +131,115 @@ def send_welcome_email(user=None, to_email=None, full_name=None):
         subject = "Добре дошли в iBands"
         text_body = render_to_string("email/welcome.txt", context)
         html_body = render_to_string("email/welcome.html", context)
-
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body=text_body,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[to_email],
-        )
-        msg.attach_alternative(html_body, "text/html")
-        msg.send()
+        queue_email(subject, text_body, html_body, [to_email])
     except Exception:
         # Fail silently for welcome emails so registration flow is not interrupted
-        pass
\ No newline at end of file
+        pass
+
+
+OUTBOX_STATS_PREFIX = "email_outbox"
+OUTBOX_HOURLY_TTL = 48 * 3600
+
+
+def _outbox_hour_key(hour, field):
+    return f"{OUTBOX_STATS_PREFIX}:{hour.strftime('%Y%m%d%H')}:{field}"
+
+
+def record_outbox_batch(sent, failed, send_seconds, queue_seconds):
+    """
+    Add one batch to the outbox counters: totals, per-hour throughput and the
+    summed send/queue latency (in ms) used for averages on the stats page.
+    """
+    try:
+        redis = cache.client.get_client(write=True)
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        pipe = redis.pipeline(transaction=False)
+        pipe.incr(f"{OUTBOX_STATS_PREFIX}:batches")
+        pipe.incrby(f"{OUTBOX_STATS_PREFIX}:sent", sent)
+        pipe.incrby(f"{OUTBOX_STATS_PREFIX}:failed", failed)
+        pipe.incrby(f"{OUTBOX_STATS_PREFIX}:send_ms", int(send_seconds * 1000))
+        pipe.incrby(f"{OUTBOX_STATS_PREFIX}:queue_ms", int(queue_seconds * 1000))
+        for field, value in (("sent", sent), ("failed", failed)):
+            key = _outbox_hour_key(hour, field)
+            pipe.incrby(key, value)
+            pipe.expire(key, OUTBOX_HOURLY_TTL)
+        pipe.execute()
+    except Exception:
+        # Stats are best-effort
+        pass
+
+
+def get_outbox_stats():
+    """Queue depth from the DB plus throughput/latency counters from Redis."""
+    stats = {
+        "pending": OutboxEmail.objects.filter(status__in=["pending", "running"]).count(),
+        "failed_permanently": OutboxEmail.objects.filter(status="failed").count(),
+    }
+    try:
+        redis = cache.client.get_client(write=True)
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        fields = ["batches", "sent", "failed", "send_ms", "queue_ms"]
+        keys = [f"{OUTBOX_STATS_PREFIX}:{field}" for field in fields]
+        keys += [_outbox_hour_key(hour, "sent"), _outbox_hour_key(hour, "failed")]
+        values = [int(v or 0) for v in redis.mget(keys)]
+    except Exception:
+        values = [0] * 7
+    batches, sent, failed, send_ms, queue_ms, hour_sent, hour_failed = values
+    stats.update(
+        batches=batches,
+        sent=sent,
+        failed=failed,
+        sent_this_hour=hour_sent,
+        failed_this_hour=hour_failed,
+        avg_send_ms=round(send_ms / sent) if sent else 0,
+        avg_queue_seconds=round(queue_ms / sent / 1000, 1) if sent else 0,
+    )
+    return stats
+
+
+def send_outbox_batch(limit=50):
+    """
+    Claim up to `limit` due outbox emails and deliver them over a single
+    backend connection. Returns (sent, failed) counts.
+    """
+    emails = OutboxEmail.claim_due(limit=limit)
+    if not emails:
+        return 0, 0
+    sent = failed = 0
+    send_seconds = queue_seconds = 0.0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        print("Outbox: could not open email connection:", e)
+        for email in emails:
+            email.mark_failed(e)
+        record_outbox_batch(0, len(emails), 0, 0)
+        return 0, len(emails)
+    try:
+        for email in emails:
+            started = time.monotonic()
+            try:
+                connection.send_messages([email.as_message(connection=connection)])
+            except Exception as e:
+                print(f"Outbox email {email.pk} failed:", e)
+                email.mark_failed(e)
+                failed += 1
+                # The connection may be broken after an error; start a fresh one
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception:
+                    pass
+                continue
+            send_seconds += time.monotonic() - started
+            email.mark_done()
+            queue_seconds += (email.sent_at - email.created_at).total_seconds()
+            sent += 1
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    record_outbox_batch(sent, failed, send_seconds, queue_seconds)
+    return sent, failed
@@ -0,0 +1,268 @@
+"""
+Bitmap facet index for the shop filters.
+
+Each process keeps one bitmap (a Python int, bit n = product id n) of
+published products per facet value: category subtree, size name, colour group
+and review rating. Shop filtering is OR within a facet and AND across facets,
+so a filter is a handful of big-int ORs/ANDs instead of a multi-join DISTINCT
+query, and facet counts are popcounts. The index also keeps every product's
+listing sort values, so a filtered page is ordered and cut in Python and only
+that page's ids are fetched from the database.
+
+Changes reach other processes through Redis: once a write commits, signals
+push the changed product ids onto FACET_CHANGES_KEY and every process
+re-reads only those products on its next lookup. Structural changes (categories, colours, sizes) bump
+FACET_VERSION_KEY, which makes every process rebuild from scratch.
+"""
+import heapq
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from store.listing import SORT_ORDERS, decode_cursor, encode_cursor
+from store.models import CategoryClosure, Product, ProductItem, Review
+
+FACET_VERSION_KEY = "facet_index:version"
+FACET_CHANGES_KEY = "facet_index:changes"
+MAX_PENDING_CHANGES = 5000  # past this a full rebuild is cheaper than replaying
+FACET_GROUPS = ("categories", "sizes", "colors", "rating")
+
+# Process-local index: (version, applied change count, FacetIndex)
+_local_index = (None, 0, None)
+
+
+def bitmap_ids(bitmap):
+    """Set bit positions of `bitmap`, ascending."""
+    return [pos for pos, bit in enumerate(reversed(bin(bitmap)[2:])) if bit == "1"]
+
+
+def bitmap_of(ids):
+    bitmap = 0
+    for pk in ids:
+        bitmap |= 1 << pk
+    return bitmap
+
+
+def _product_facets(product_ids=None):
+    """
+    ({product_id: {(group, value), ...}}, {product_id: sort values}) for
+    published products (all, or only `product_ids`) in five queries. Categories
+    are the direct ones; the index expands them to ancestor subtrees.
+    """
+    products = Product.objects.filter(status="published")
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    facets = {}
+    sort_values = {}
+    for pk, category_id, featured, date, sort_price in products.values_list(
+        "pk", "category_id", "featured", "date", "sort_price"
+    ):
+        facets[pk] = {("category", category_id)} if category_id else set()
+        sort_values[pk] = {"featured": featured, "date": date, "sort_price": sort_price}
+
+    ids = list(facets) if product_ids is not None else None
+
+    def scoped(qs, field):
+        return qs.filter(**{f"{field}__in": ids}) if ids is not None else qs
+
+    through = Product.additional_categories.through
+    for pk, category_id in scoped(through.objects, "product_id").values_list("product_id", "category_id"):
+        if pk in facets:
+            facets[pk].add(("category", category_id))
+    colors = Product.colors.through.objects
+    for pk, group_id in scoped(colors, "product_id").values_list("product_id", "color__group_id"):
+        if pk in facets:
+            facets[pk].add(("colors", str(group_id)))
+    items = ProductItem.objects.filter(size__isnull=False)
+    for pk, size in scoped(items, "product_id").values_list("product_id", "size__name").order_by().distinct():
+        if pk in facets:
+            facets[pk].add(("sizes", size))
+    reviews = Review.objects.filter(product__isnull=False)
+    for pk, rating in scoped(reviews, "product_id").values_list("product_id", "rating").order_by().distinct():
+        if pk in facets and rating is not None:
+            facets[pk].add(("rating", str(rating)))
+    return facets, sort_values
+
+
+class FacetIndex:
+    def __init__(self, product_facets, closure, sort_values=None):
+        # closure: {descendant category id: [ancestor ids including itself]}
+        self.closure = closure
+        self.published = 0
+        self.bitmaps = {group: {} for group in FACET_GROUPS}
+        self.product_keys = {}
+        self.sort_values = {}
+        sort_values = sort_values or {}
+        for pk, facets in product_facets.items():
+            self._add(pk, facets, sort_values.get(pk))
+
+    def _expand(self, facets):
+        keys = set()
+        for group, value in facets:
+            if group == "category":
+                for ancestor_id in self.closure.get(value, [value]):
+                    keys.add(("categories", str(ancestor_id)))
+            else:
+                keys.add((group, value))
+        return keys
+
+    def _add(self, pk, facets, sort_values=None):
+        bit = 1 << pk
+        self.published |= bit
+        keys = self._expand(facets)
+        for group, value in keys:
+            bitmaps = self.bitmaps[group]
+            bitmaps[value] = bitmaps.get(value, 0) | bit
+        self.product_keys[pk] = keys
+        self.sort_values[pk] = sort_values or {}
+
+    def _remove(self, pk):
+        mask = ~(1 << pk)
+        self.published &= mask
+        self.sort_values.pop(pk, None)
+        for group, value in self.product_keys.pop(pk, ()):
+            self.bitmaps[group][value] &= mask
+
+    def update(self, product_ids):
+        """Re-read the facets of `product_ids` (deleted/unpublished ones drop out)."""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        facets, sort_values = _product_facets(product_ids)
+        for pk in product_ids:
+            self._remove(pk)
+            if pk in facets:
+                self._add(pk, facets[pk], sort_values[pk])
+
+    def _group_bitmap(self, group, values):
+        bitmaps = self.bitmaps[group]
+        bitmap = 0
+        for value in values:
+            bitmap |= bitmaps.get(str(value), 0)
+        return bitmap
+
+    def match(self, selected, base=None, exclude_group=None):
+        """Bitmap of published products matching every selected group (OR within a group)."""
+        bitmap = self.published if base is None else self.published & base
+        for group, values in selected.items():
+            if values and group != exclude_group:
+                bitmap &= self._group_bitmap(group, values)
+        return bitmap
+
+    def counts(self, selected, base=None):
+        """
+        {group: {value: count}}. Each group is counted against the other groups'
+        selections only, so ticking one size still shows how many products every
+        other size would add.
+        """
+        result = {}
+        for group in FACET_GROUPS:
+            scope = self.match(selected, base=base, exclude_group=group)
+            result[group] = {
+                value: (bitmap & scope).bit_count()
+                for value, bitmap in self.bitmaps[group].items()
+                if bitmap & scope
+            }
+        return result
+
+    def sort_key(self, pk, sort, ranks=None):
+        """`pk`'s values for the fields of SORT_ORDERS[sort]; search_rank comes from `ranks`."""
+        values = self.sort_values.get(pk, {})
+        key = []
+        for field, _ in SORT_ORDERS[sort]:
+            if field == "id":
+                key.append(pk)
+            elif field == "search_rank":
+                key.append(float((ranks or {}).get(pk, 0.0)))
+            else:
+                key.append(values[field])
+        return tuple(key)
+
+    def page(self, bitmap, sort, cursor=None, per_page=20, ranks=None):
+        """
+        (ids, next_cursor) of one keyset page of `bitmap` in `sort` order, with
+        the same cursors as store.listing.keyset_page. `ranks` ({id: search_rank})
+        is needed for the relevance sort.
+        """
+        descending = SORT_ORDERS[sort][0][1]  # every field of a sort shares its direction
+        keyed = ((self.sort_key(pk, sort, ranks), pk) for pk in bitmap_ids(bitmap & self.published))
+        after = decode_cursor(cursor, sort) if cursor else None
+        if after is not None:
+            after = tuple(after)
+            keyed = (item for item in keyed if (item[0] < after if descending else item[0] > after))
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        rows = pick(per_page + 1, keyed)
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = encode_cursor(sort, rows[-1][0])
+        return [pk for _, pk in rows], next_cursor
+
+
+def _closure_map():
+    closure = {}
+    for ancestor_id, descendant_id in CategoryClosure.objects.values_list("ancestor_id", "descendant_id"):
+        closure.setdefault(descendant_id, []).append(ancestor_id)
+    return closure
+
+
+def _reset_index():
+    try:
+        redis = cache.client.get_client(write=True)
+        pipe = redis.pipeline(transaction=True)
+        pipe.set(FACET_VERSION_KEY, uuid.uuid4().hex)
+        pipe.delete(FACET_CHANGES_KEY)
+        pipe.execute()
+    except Exception as e:
+        print("Could not invalidate the facet index:", e)
+
+
+def _push_changes(product_ids):
+    try:
+        redis = cache.client.get_client(write=True)
+        pending = redis.rpush(FACET_CHANGES_KEY, *product_ids)
+    except Exception as e:
+        print("Could not queue facet index changes:", e)
+        return
+    if pending > MAX_PENDING_CHANGES:
+        _reset_index()
+
+
+def invalidate_facets():
+    """Force a full rebuild in every process (category tree, colour group or size renames)."""
+    # After commit, so no process rebuilds from rows that are about to change
+    transaction.on_commit(_reset_index)
+
+
+def mark_products_changed(product_ids):
+    """Queue products for an incremental facet update in every process, once committed."""
+    product_ids = [int(pk) for pk in product_ids if pk]
+    if product_ids:
+        # A replay before commit would re-read the old rows and skip past the ids
+        transaction.on_commit(lambda: _push_changes(product_ids))
+
+
+def get_facet_index():
+    """This process's FacetIndex, brought up to date with one Redis round trip."""
+    global _local_index
+    local_version, applied, index = _local_index
+    redis = cache.client.get_client(write=True)
+    pipe = redis.pipeline(transaction=True)
+    pipe.get(FACET_VERSION_KEY)
+    pipe.lrange(FACET_CHANGES_KEY, applied, -1)
+    pipe.llen(FACET_CHANGES_KEY)
+    version, changes, pending = pipe.execute()
+    if version is None:
+        redis.set(FACET_VERSION_KEY, uuid.uuid4().hex, nx=True)
+        version = redis.get(FACET_VERSION_KEY)
+
+    if index is None or local_version != version:
+        # Changes queued so far are covered by reading the database now
+        facets, sort_values = _product_facets()
+        index = FacetIndex(facets, _closure_map(), sort_values)
+        _local_index = (version, pending, index)
+    elif changes:
+        index.update(int(pk) for pk in changes)
+        _local_index = (version, applied + len(changes), index)
+    return index
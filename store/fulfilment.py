@@ -0,0 +1,184 @@
+"""
+Post-payment fulfilment: payment views enqueue FulfilmentJob rows and the
+run_fulfilment_worker command executes them with retries and backoff.
+Labels for whole batches of orders are created concurrently by
+create_shipments (admin action and management command).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from store.models import FulfilmentJob, Order
+from store.utils import buffer_meta_event, build_meta_purchase_event, meta_capi_enabled, meta_client_data, meta_test_code
+
+
+def enqueue_order_fulfilment(order, request=None):
+    """Queue shipment, CAPI event and confirmation emails for a paid/COD order."""
+    FulfilmentJob.enqueue(order, "shipment")
+    FulfilmentJob.enqueue(order, "meta_purchase", payload=meta_client_data(request))
+    FulfilmentJob.enqueue(order, "order_emails")
+
+
+SHIPMENT_LOCK_TIMEOUT = 300  # seconds; longer than the slowest courier round trip
+
+
+def _shipment_lock_key(order):
+    return f"shipment_lock:{order.pk}"
+
+
+def _run_shipment(order, job):
+    from store.views import _send_shipment
+
+    if order.tracking_id:
+        return
+    if not cache.add(_shipment_lock_key(order), 1, timeout=SHIPMENT_LOCK_TIMEOUT):
+        raise RuntimeError("Shipment is already being created for this order")
+    try:
+        _send_shipment(order)
+    finally:
+        cache.delete(_shipment_lock_key(order))
+    if not order.tracking_id:
+        raise RuntimeError("Courier did not return a shipment number")
+
+
+def _run_meta_purchase(order, job):
+    if not meta_capi_enabled():
+        return
+    # Sent in bulk by flush_meta_events; only a Redis outage fails the job
+    client_data = job.payload or {}
+    event = build_meta_purchase_event(order, client_data)
+    if not buffer_meta_event(event, test_code=meta_test_code(client_data)):
+        raise RuntimeError("Could not buffer Meta CAPI Purchase event")
+
+
+def _run_order_emails(order, job):
+    from store.emails import send_order_notification_email
+
+    # Rendered once; the customer and shop copies go to the outbox together
+    send_order_notification_email(
+        order=order,
+        email_heading=f"Потвърдена поръчка #{order.order_id}",
+        email_title="iBands: Приета поръчка",
+        to_email=[getattr(order.address, "email", None), settings.ORDER_NOTIFICATION_EMAIL],
+        fail_silently=False,
+    )
+
+
+def _status_email_handler(status):
+    def run(order, job):
+        from store.emails import order_status_email, send_order_notification_email
+
+        email_heading, email_title = order_status_email(order, status)
+        send_order_notification_email(
+            order=order,
+            email_heading=email_heading,
+            email_title=email_title,
+            to_email=getattr(order.address, "email", None),
+            fail_silently=False,
+        )
+    return run
+
+
+HANDLERS = {
+    "shipment": _run_shipment,
+    "meta_purchase": _run_meta_purchase,
+    "order_emails": _run_order_emails,
+    "shipped_email": _status_email_handler("shipped"),
+    "delivered_email": _status_email_handler("delivered"),
+}
+
+
+def run_job(job):
+    """Execute one claimed job and record the outcome. Returns True on success."""
+    try:
+        order = Order.objects.select_related("address", "customer").get(pk=job.order_id)
+        HANDLERS[job.kind](order, job)
+    except Exception as e:
+        print(f"Fulfilment job {job.pk} ({job.kind}) failed:", e)
+        job.mark_failed(e)
+        return False
+    job.mark_done()
+    return True
+
+
+def process_due_jobs(limit=10):
+    """Claim and run due jobs; returns (succeeded, failed) counts."""
+    succeeded = failed = 0
+    for job in FulfilmentJob.claim_due(limit=limit):
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def pending_shipment_orders():
+    """Received, paid or COD orders that still have no courier label."""
+    return Order.objects.filter(
+        order_status="received",
+        payment_status__in=["paid", "cash_on_delivery"],
+    ).filter(Q(tracking_id__isnull=True) | Q(tracking_id=""))
+
+
+def _create_label(order):
+    from store.views import _send_shipment
+
+    try:
+        _send_shipment(order, save=False)
+        return bool(order.tracking_id)
+    finally:
+        # Worker threads must not leak DB connections
+        connections.close_all()
+
+
+def create_shipments(orders, max_workers=8):
+    """
+    Create courier labels for `orders` (queryset or iterable of pks) with a
+    bounded thread pool. Orders that already have a tracking_id, or whose
+    label is being created by the fulfilment worker, are skipped; new
+    tracking ids are written back with a single bulk_update.
+    Returns {"created": [...], "skipped": [...], "failed": [...]} order_ids.
+    """
+    qs = orders if hasattr(orders, "model") else Order.objects.filter(pk__in=list(orders))
+    # Everything the courier payload builders read is loaded up front, so the
+    # worker threads only do HTTP
+    orders = list(qs.select_related("address").prefetch_related("order_items__product"))
+    result = {"created": [], "skipped": [], "failed": []}
+    workers = max(1, int(max_workers))
+    lock_timeout = SHIPMENT_LOCK_TIMEOUT + 30 * len(orders) // workers
+    locked = []
+    for order in orders:
+        if not order.tracking_id and cache.add(_shipment_lock_key(order), 1, timeout=lock_timeout):
+            locked.append(order)
+        else:
+            result["skipped"].append(order.order_id)
+    try:
+        # Re-check under the lock: another process may have finished meanwhile
+        labelled = set(
+            Order.objects.filter(pk__in=[order.pk for order in locked])
+            .exclude(Q(tracking_id__isnull=True) | Q(tracking_id=""))
+            .values_list("pk", flat=True)
+        )
+        todo = [order for order in locked if order.pk not in labelled]
+        result["skipped"] += [order.order_id for order in locked if order.pk in labelled]
+        if not todo:
+            return result
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            outcomes = list(pool.map(_create_label, todo))
+
+        created = [order for order, ok in zip(todo, outcomes) if ok]
+        result["created"] = [order.order_id for order in created]
+        result["failed"] = [order.order_id for order, ok in zip(todo, outcomes) if not ok]
+        if created:
+            Order.objects.bulk_update(created, ["tracking_id", "shipping_service"])
+            FulfilmentJob.objects.filter(order__in=created, kind="shipment").exclude(status="done").update(
+                status="done", locked_at=None, last_error=None, updated_at=timezone.now()
+            )
+        return result
+    finally:
+        cache.delete_many([_shipment_lock_key(order) for order in locked])
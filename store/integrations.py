@@ -0,0 +1,219 @@
+"""
+Shared HTTP client for courier and ads integrations (Speedy, Econt, Meta).
+
+Each provider gets one keep-alive requests.Session with its own connection
+pool, timeouts and retry policy (full-jitter exponential backoff). A
+process-local circuit breaker fails fast while a provider is down, and every
+call is counted in hourly Redis buckets for the admin stats page.
+
+Per-provider overrides come from settings.INTEGRATION_HTTP, e.g.
+    INTEGRATION_HTTP = {"speedy": {"timeout": (3.05, 20), "retries": 1}}
+Base URLs stay in their own settings (SPEEDY_API_BASE, META_GRAPH_BASE, ...)
+so a local stub server can stand in for any provider.
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+DEFAULT_CONFIG = {
+    "timeout": (3.05, 15),  # (connect, read) seconds
+    "retries": 2,
+    "backoff": 0.3,  # seconds; attempt n sleeps up to backoff * 2**n
+    "backoff_max": 5,
+    "pool_size": 10,
+    "failure_threshold": 5,  # consecutive failed calls that open the circuit
+    "reset_after": 30,  # seconds before a trial call is let through
+}
+PROVIDER_CONFIG = {
+    "speedy": {},
+    "econt": {"timeout": (3.05, 10)},
+    "meta": {"retries": 3},
+}
+PROVIDERS = tuple(PROVIDER_CONFIG)
+RETRY_STATUSES = {429, 502, 503, 504}
+STATS_TTL = 48 * 3600
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without touching the network while a provider's circuit is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_after):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return "open" if self.opened_at is not None else "closed"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: let this call through, keep failing the others fast
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class IntegrationClient:
+    def __init__(self, provider, **config):
+        self.provider = provider
+        self.config = {
+            **DEFAULT_CONFIG,
+            **PROVIDER_CONFIG.get(provider, {}),
+            **(getattr(settings, "INTEGRATION_HTTP", None) or {}).get(provider, {}),
+            **config,
+        }
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.config["pool_size"])
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = CircuitBreaker(self.config["failure_threshold"], self.config["reset_after"])
+
+    def _sleep_before_retry(self, attempt):
+        cap = min(self.config["backoff_max"], self.config["backoff"] * (2 ** attempt))
+        if cap > 0:
+            time.sleep(random.uniform(0, cap))
+
+    def request(self, method, url, idempotent=True, timeout=None, **kwargs):
+        """
+        Send a request and return the requests.Response (callers still decide
+        whether to raise_for_status). Non-idempotent calls such as shipment
+        creation are only retried when the connection was never established.
+        """
+        if not self.breaker.allow():
+            record_call(self.provider, 0, error=True, short_circuit=True)
+            raise CircuitOpenError(f"{self.provider} is unavailable (circuit open)")
+        timeout = timeout or self.config["timeout"]
+        last_attempt = max(0, int(self.config["retries"]))
+        for attempt in range(last_attempt + 1):
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                record_call(self.provider, (time.monotonic() - started) * 1000, error=True)
+                retryable = isinstance(e, requests.ConnectTimeout) or (
+                    idempotent and isinstance(e, (requests.ConnectionError, requests.Timeout))
+                )
+                if retryable and attempt < last_attempt:
+                    self._sleep_before_retry(attempt)
+                    continue
+                self.breaker.record_failure()
+                raise
+            server_error = response.status_code >= 500 or response.status_code in RETRY_STATUSES
+            record_call(self.provider, (time.monotonic() - started) * 1000, error=server_error)
+            if not server_error:
+                self.breaker.record_success()
+                return response
+            if idempotent and response.status_code in RETRY_STATUSES and attempt < last_attempt:
+                response.close()
+                self._sleep_before_retry(attempt)
+                continue
+            self.breaker.record_failure()
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def http_client(provider):
+    """Process-wide client for `provider`, created on first use."""
+    client = _clients.get(provider)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = _clients[provider] = IntegrationClient(provider)
+    return client
+
+
+def reset_clients():
+    """Drop cached clients (e.g. after changing INTEGRATION_HTTP in tests)."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
+
+
+def _stats_key(provider, hour, field):
+    return f"integration_stats:{provider}:{hour.strftime('%Y%m%d%H')}:{field}"
+
+
+def record_call(provider, elapsed_ms, error=False, short_circuit=False):
+    try:
+        redis = cache.client.get_client(write=True)
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        pipe = redis.pipeline(transaction=False)
+        if short_circuit:
+            fields = {"short_circuits": 1}
+        else:
+            fields = {"calls": 1, "ms": int(elapsed_ms)}
+            if error:
+                fields["errors"] = 1
+        for field, value in fields.items():
+            key = _stats_key(provider, hour, field)
+            pipe.incrby(key, value)
+            pipe.expire(key, STATS_TTL)
+        pipe.execute()
+    except Exception:
+        # Stats are best-effort
+        pass
+
+
+def get_integration_stats(hours=24):
+    """Per-provider calls, errors, fail-fast count and average latency over the last `hours`."""
+    now = timezone.now().replace(minute=0, second=0, microsecond=0)
+    hour_list = [now - timezone.timedelta(hours=offset) for offset in range(hours)]
+    fields = ("calls", "errors", "short_circuits", "ms")
+    try:
+        redis = cache.client.get_client(write=True)
+        keys = [_stats_key(p, h, f) for p in PROVIDERS for h in hour_list for f in fields]
+        values = iter(redis.mget(keys))
+    except Exception:
+        values = iter([0] * (len(PROVIDERS) * hours * len(fields)))
+    rows = []
+    for provider in PROVIDERS:
+        totals = dict.fromkeys(fields, 0)
+        for _ in hour_list:
+            for field in fields:
+                totals[field] += int(next(values) or 0)
+        client = _clients.get(provider)
+        rows.append({
+            "provider": provider,
+            "calls": totals["calls"],
+            "errors": totals["errors"],
+            "short_circuits": totals["short_circuits"],
+            "avg_ms": round(totals["ms"] / totals["calls"]) if totals["calls"] else 0,
+            "circuit": client.breaker.state if client else "closed",
+        })
+    return rows
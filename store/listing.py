@@ -0,0 +1,222 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Pages are fetched with WHERE (sort key, id) < / > (last row's values) instead
+of OFFSET, so page 300 costs the same as page 1 and no page needs a COUNT.
+The cursor is an opaque base64 token of the last row's sort values. Listing
+totals are cached per normalized filter signature and served stale while a
+single worker recounts after a catalogue change.
+"""
+import base64
+import hashlib
+import json
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Q
+
+# sort name -> ((field, descending), ...); the last field is always unique
+SORT_ORDERS = {
+    "featured": (("featured", True), ("date", True), ("id", True)),
+    "newest": (("date", True), ("id", True)),
+    "price_asc": (("sort_price", False), ("id", False)),
+    "price_desc": (("sort_price", True), ("id", True)),
+    # Only for querysets annotated by store.search.search_products
+    "relevance": (("search_rank", True), ("id", True)),
+}
+# Older ?prices= values of the shop's sort radio buttons
+LEGACY_PRICE_SORTS = {"lowest": "price_desc", "highest": "price_asc"}
+DEFAULT_SORT = "featured"
+COUNT_VERSION_KEY = "listing_count_version"
+COUNT_TTL = 7 * 86400  # stale counts stay usable until recounted
+COUNT_REFRESH_LOCK = 60  # seconds; one recount per signature at a time
+
+
+def listing_sort(params, default=DEFAULT_SORT):
+    """Sort name from ?sort= (or the legacy ?prices=), falling back to `default`."""
+    for sort in (params.get("sort"), params.get("prices")):
+        sort = LEGACY_PRICE_SORTS.get(sort, sort)
+        if sort in SORT_ORDERS and sort != "relevance":
+            return sort
+    return default
+
+
+def order_listing(queryset, sort):
+    return queryset.order_by(*[f"-{field}" if desc else field for field, desc in SORT_ORDERS[sort]])
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _load(field, value):
+    if field == "date":
+        return datetime.fromisoformat(value)
+    if field == "sort_price":
+        return Decimal(value)
+    if field == "featured":
+        return bool(value)
+    if field == "id":
+        return int(value)
+    return float(value)
+
+
+def encode_cursor(sort, values):
+    raw = json.dumps([sort] + [_dump(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, sort):
+    """Sort values stored in `token`, or None if it is malformed or for another sort."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        fields = SORT_ORDERS[sort]
+        if data[0] != sort or len(data) != len(fields) + 1:
+            return None
+        if None in data[1:]:
+            return None
+        return [_load(field, value) for (field, _), value in zip(fields, data[1:])]
+    except (ValueError, TypeError, KeyError, IndexError, InvalidOperation):
+        return None
+
+
+def _after(sort, values):
+    """
+    Rows strictly after `values` in `sort` order: (a > x) OR (a = x AND b > y) OR ...
+    Every sort key is NOT NULL (sort_price included), so a NULL in a cursor can
+    only come from a stale or forged token and restarts the listing.
+    """
+    condition = Q()
+    equal = {}
+    for (field, desc), value in zip(SORT_ORDERS[sort], values):
+        condition |= Q(**equal, **{f"{field}__{'lt' if desc else 'gt'}": value})
+        equal[field] = value
+    return condition
+
+
+class CursorPage:
+    """One page of a keyset listing; iterable like a Paginator page."""
+
+    def __init__(self, object_list, sort, next_cursor=None, count=None):
+        self.object_list = object_list
+        self.sort = sort
+        self.next_cursor = next_cursor
+        self.count = count
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, sort, cursor=None, per_page=20):
+    """`per_page` rows of `queryset` after `cursor` in `sort` order (first page if the cursor is invalid)."""
+    queryset = order_listing(queryset, sort)
+    values = decode_cursor(cursor, sort) if cursor else None
+    if values is not None:
+        queryset = queryset.filter(_after(sort, values))
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, field) for field, _ in SORT_ORDERS[sort]])
+    return CursorPage(rows, sort, next_cursor)
+
+
+def _bump_count_version():
+    cache.set(COUNT_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def bump_listing_counts():
+    """Mark every cached listing count stale (product, item or review writes) once committed."""
+    # A recount started before the commit would store the old total as current
+    transaction.on_commit(_bump_count_version)
+
+
+def count_signature(scope, **filters):
+    """
+    Stable key for a listing's filters: list values are deduplicated and
+    sorted, search text is reduced to its normalized terms, empty filters are
+    dropped. count_signature("shop", colors=["2", 1]) == count_signature("shop", colors=[1, 2]).
+    """
+    from store.search import search_terms
+
+    parts = {"scope": scope}
+    for name, value in sorted(filters.items()):
+        if name == "search":
+            value = " ".join(search_terms(value or ""))
+        elif isinstance(value, (list, tuple, set)):
+            value = sorted({str(item) for item in value})
+        if value not in (None, "", []):
+            parts[name] = value
+    return hashlib.md5(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _refresh_in_background(refresh):
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def _store_count(key, count, version):
+    cache.set(key, {"count": count, "version": version}, COUNT_TTL)
+
+
+def cached_count(queryset, signature):
+    """
+    queryset.count() cached under `signature`. After a catalogue version bump
+    the old count is still served while one worker recounts in the background;
+    only a signature never seen before is counted inline.
+    """
+    key = f"listing_count:{signature}"
+    try:
+        found = cache.get_many([COUNT_VERSION_KEY, key])
+    except Exception:
+        return queryset.count()
+    version = found.get(COUNT_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(COUNT_VERSION_KEY, version, timeout=None):
+            version = cache.get(COUNT_VERSION_KEY)
+    entry = found.get(key)
+    if entry is None:
+        count = queryset.count()
+        _store_count(key, count, version)
+        return count
+    if entry["version"] != version and cache.add(f"{key}:refresh", 1, COUNT_REFRESH_LOCK):
+        queryset = queryset.all()  # own copy; the caller goes on to paginate theirs
+
+        def refresh():
+            try:
+                _store_count(key, queryset.count(), version)
+            except Exception as e:
+                print("Listing count refresh failed:", e)
+            finally:
+                cache.delete(f"{key}:refresh")
+                connections.close_all()
+
+        _refresh_in_background(refresh)
+    return entry["count"]
+
+
+def listing_page(request, queryset, signature, per_page=20, default_sort=DEFAULT_SORT):
+    """
+    Keyset page for a listing view from ?cursor= and ?sort=/?prices=; the
+    total is cached under `signature` (see count_signature).
+    """
+    sort = listing_sort(request.GET, default_sort)
+    page = keyset_page(queryset, sort, request.GET.get("cursor"), per_page)
+    page.count = cached_count(queryset, signature)
+    return page
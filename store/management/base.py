@@ -0,0 +1,69 @@
+import time
+from abc import ABCMeta, abstractmethod
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class BatchWorkerCommand(BaseCommand, metaclass=ABCMeta):
+    """
+    Base for the queue worker commands: runs one batch at a time until stopped.
+
+    A full batch is followed by the next one straight away; a partial or empty
+    batch means the queue is drained, so the worker sleeps --sleep seconds
+    (with --once it exits instead). Subclasses must implement run_batch() (a
+    command without it cannot be instantiated) and may override batch_due()
+    to hold back partial batches.
+    """
+    default_batch_size = 10
+    max_batch_size = None
+    default_sleep = 2.0
+    sleep_aliases = ()
+    once_help = "Process everything currently due and exit."
+    batch_size_help = "Items per batch (default: %(default)s)."
+    sleep_help = "Seconds to wait when the queue is drained (default: %(default)s)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help=self.once_help)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=self.default_batch_size,
+            help=self.batch_size_help,
+        )
+        parser.add_argument(
+            "--sleep",
+            *self.sleep_aliases,
+            dest="sleep",
+            type=float,
+            default=self.default_sleep,
+            help=self.sleep_help,
+        )
+
+    @abstractmethod
+    def run_batch(self, batch_size, options):
+        """Process up to `batch_size` items; returns (succeeded, failed)."""
+
+    def batch_due(self, batch_size, options):
+        """Whether to run a batch now (ignored with --once)."""
+        return True
+
+    def batch_message(self, succeeded, failed):
+        return f"Processed {succeeded + failed} item(s): {succeeded} ok, {failed} failed."
+
+    def handle(self, *args, **options):
+        batch_size = int(options["batch_size"])
+        if self.max_batch_size:
+            batch_size = min(batch_size, self.max_batch_size)
+        while True:
+            if options["once"] or self.batch_due(batch_size, options):
+                close_old_connections()
+                succeeded, failed = self.run_batch(batch_size, options)
+                if succeeded or failed:
+                    self.stdout.write(self.batch_message(succeeded, failed))
+                if succeeded + failed >= batch_size:
+                    continue
+                if options["once"]:
+                    break
+            time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -53,7 +53,7 @@ class Command(BaseCommand):
             return converted.quantize(quant, rounding=ROUND_HALF_UP)
 
         model_specs = [
-            (store_models.Product, ["price", "sale_price", "shipping"]),
+            (store_models.Product, ["price", "sale_price", "sort_price", "shipping"]),
             (store_models.Cart, ["price", "sub_total"]),
             (store_models.Order, ["sub_total", "shipping", "total", "saved"]),
             (store_models.OrderItem, ["price", "sub_total"]),
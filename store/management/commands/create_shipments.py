@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from store.fulfilment import create_shipments, pending_shipment_orders
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = "Create courier labels concurrently for pending orders (or the given order ids)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "order_ids",
+            nargs="*",
+            help="Order ids to ship; defaults to all received orders without a tracking id.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Concurrent courier requests (default: 8).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the orders that would be shipped.",
+        )
+
+    def handle(self, *args, **options):
+        if options["order_ids"]:
+            orders = Order.objects.filter(order_id__in=options["order_ids"])
+        else:
+            orders = pending_shipment_orders()
+        if options["dry_run"]:
+            order_ids = list(orders.values_list("order_id", flat=True))
+            self.stdout.write(f"{len(order_ids)} order(s) to ship: {', '.join(order_ids)}")
+            return
+        result = create_shipments(orders, max_workers=options["workers"])
+        for order_id in result["failed"]:
+            self.stdout.write(self.style.WARNING(f"Order {order_id}: no tracking id returned"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(result['created'])} label(s), skipped {len(result['skipped'])}, "
+            f"failed {len(result['failed'])}."
+        ))
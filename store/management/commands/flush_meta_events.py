@@ -0,0 +1,31 @@
+from store.management.base import BatchWorkerCommand
+from store.utils import META_EVENT_MAX_BATCH, flush_meta_events, meta_events_due
+
+
+class Command(BatchWorkerCommand):
+    help = "Send buffered Meta Conversions API events in batches."
+    default_batch_size = META_EVENT_MAX_BATCH
+    max_batch_size = META_EVENT_MAX_BATCH
+    default_sleep = 1.0
+    sleep_aliases = ("--poll",)
+    once_help = "Flush everything currently buffered and exit."
+    batch_size_help = f"Events per Graph API call (max {META_EVENT_MAX_BATCH})."
+    sleep_help = "Seconds between buffer checks (default: %(default)s)."
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--max-wait",
+            type=float,
+            default=10.0,
+            help="Flush a partial batch once its oldest event is this many seconds old (default: 10).",
+        )
+
+    def batch_due(self, batch_size, options):
+        return meta_events_due(batch_size, options["max_wait"])
+
+    def run_batch(self, batch_size, options):
+        return flush_meta_events(batch_size)
+
+    def batch_message(self, succeeded, failed):
+        return f"Sent {succeeded} event(s), {failed} failed."
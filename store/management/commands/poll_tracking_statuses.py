@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store.tracking import poll_tracking_statuses
+
+
+class Command(BaseCommand):
+    help = (
+        "Pull courier tracking for all open shipments and advance order statuses in bulk. "
+        "Schedule it every 30-60 minutes (e.g. Heroku Scheduler)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Concurrent tracking requests (default: 4).",
+        )
+
+    def handle(self, *args, **options):
+        result = poll_tracking_statuses(max_workers=options["workers"])
+        if result["failed_batches"]:
+            self.stdout.write(self.style.WARNING(f"{result['failed_batches']} tracking batch(es) failed."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {result['checked']} shipment(s): {result['shipped']} shipped, {result['delivered']} delivered."
+        ))
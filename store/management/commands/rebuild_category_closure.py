@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.models import CategoryClosure
+
+
+class Command(BaseCommand):
+    help = "Rebuild the category closure table (ancestor/descendant pairs) in bulk."
+
+    def handle(self, *args, **options):
+        rows = CategoryClosure.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Done. Wrote {rows} closure rows."))
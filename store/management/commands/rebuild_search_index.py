@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.search import refresh_search_documents
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the product search documents. Signals keep them current; run this "
+        "after bulk imports or raw SQL changes to products."
+    )
+
+    def handle(self, *args, **options):
+        count = refresh_search_documents()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} product search document(s)."))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from store import models as store_models
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized Product.sort_price (band/sale/regular price)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Bulk update batch size (default: 500).",
+        )
+        parser.add_argument(
+            "--week",
+            action="store_true",
+            help="Only resync this and last week's Band of the Week products and stale "
+                 "band discounts (schedule it shortly after midnight on Mondays).",
+        )
+
+    def handle(self, *args, **options):
+        if options["week"]:
+            updated = store_models.BandOfTheWeek.sync_sort_prices()
+        else:
+            updated = store_models.Product.refresh_sort_prices(
+                batch_size=int(options["batch_size"])
+            )
+        self.stdout.write(self.style.SUCCESS(f"Done. Updated {updated} products."))
@@ -0,0 +1,15 @@
+from store.fulfilment import process_due_jobs
+from store.management.base import BatchWorkerCommand
+
+
+class Command(BatchWorkerCommand):
+    help = "Process queued post-payment fulfilment jobs (shipments, CAPI events, emails)."
+    once_help = "Process the currently due jobs and exit."
+    batch_size_help = "Jobs claimed per iteration (default: %(default)s)."
+    sleep_help = "Seconds to wait when the queue is empty (default: %(default)s)."
+
+    def run_batch(self, batch_size, options):
+        return process_due_jobs(limit=batch_size)
+
+    def batch_message(self, succeeded, failed):
+        return f"Processed {succeeded + failed} job(s): {succeeded} ok, {failed} failed."
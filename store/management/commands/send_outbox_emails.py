@@ -0,0 +1,16 @@
+from store.emails import send_outbox_batch
+from store.management.base import BatchWorkerCommand
+
+
+class Command(BatchWorkerCommand):
+    help = "Deliver queued outbox emails, one backend connection per batch."
+    default_batch_size = 50
+    once_help = "Send the currently due emails and exit."
+    batch_size_help = "Emails sent per connection (default: %(default)s)."
+    sleep_help = "Seconds to wait when the outbox is empty (default: %(default)s)."
+
+    def run_batch(self, batch_size, options):
+        return send_outbox_batch(limit=batch_size)
+
+    def batch_message(self, succeeded, failed):
+        return f"Sent {succeeded} email(s), {failed} failed."
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.models import SpeedySite
+from store.speedy import fetch_catalogue, load_catalogue_file, sync_catalogue
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy Speedy's site and office nomenclature into the local catalogue used by "
+        "checkout autocomplete. Schedule it daily (e.g. Heroku Scheduler) with --max-age."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-file",
+            help="Load sites/offices from a JSON file instead of calling the Speedy API.",
+        )
+        parser.add_argument(
+            "--country",
+            type=int,
+            default=100,
+            help="Speedy country id (default: 100, Bulgaria).",
+        )
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            default=0,
+            help="Skip the sync if the catalogue is younger than this many hours.",
+        )
+
+    def handle(self, *args, **options):
+        if options["max_age"]:
+            last_sync = SpeedySite.objects.order_by("-synced_at").values_list("synced_at", flat=True).first()
+            if last_sync and timezone.now() - last_sync < timezone.timedelta(hours=options["max_age"]):
+                self.stdout.write(f"Catalogue synced at {last_sync:%Y-%m-%d %H:%M}; skipping.")
+                return
+        try:
+            if options["from_file"]:
+                sites, offices = load_catalogue_file(options["from_file"])
+            else:
+                sites, offices = fetch_catalogue(options["country"])
+            site_count, office_count = sync_catalogue(sites, offices)
+        except Exception as e:
+            raise CommandError(f"Speedy catalogue sync failed: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Synced {site_count} site(s) and {office_count} office(s)."))
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 14:09
+
+from django.db import migrations, models
+from decimal import Decimal, ROUND_FLOOR
+import datetime
+
+
+def backfill_sort_price(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    BandOfTheWeek = apps.get_model('store', 'BandOfTheWeek')
+    db_alias = schema_editor.connection.alias
+
+    today = datetime.date.today()
+    week_start = today - datetime.timedelta(days=today.weekday())
+    band_product_id = (
+        BandOfTheWeek.objects.using(db_alias)
+        .filter(week_start=week_start)
+        .values_list('product_id', flat=True)
+        .first()
+    )
+
+    batch = []
+    for p in Product.objects.using(db_alias).only('id', 'price', 'sale_price').iterator():
+        if band_product_id and p.id == band_product_id and p.price:
+            value = (p.price * Decimal('0.5')).quantize(Decimal('0.01'), rounding=ROUND_FLOOR)
+        elif p.sale_price and p.price and p.sale_price < p.price:
+            value = p.sale_price
+        else:
+            value = p.price
+        p.sort_price = value
+        batch.append(p)
+        if len(batch) >= 500:
+            Product.objects.using(db_alias).bulk_update(batch, ['sort_price'])
+            batch = []
+    if batch:
+        Product.objects.using(db_alias).bulk_update(batch, ['sort_price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0053_alter_product_h1_override_alter_product_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sort_price',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, default=0.0, editable=False, max_digits=12, null=True),
+        ),
+        migrations.RunPython(backfill_sort_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2 on 2026-10-18 14:11
+
+from collections import deque
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    CategoryLink = apps.get_model('store', 'CategoryLink')
+    CategoryClosure = apps.get_model('store', 'CategoryClosure')
+    db_alias = schema_editor.connection.alias
+
+    parents = dict(Category.objects.using(db_alias).values_list('id', 'parent_id'))
+    children = {}
+    for cat_id, parent_id in parents.items():
+        if parent_id:
+            children.setdefault(parent_id, []).append((cat_id, False))
+    for parent_id, child_id in CategoryLink.objects.using(db_alias).values_list('parent_id', 'child_id'):
+        children.setdefault(parent_id, []).append((child_id, True))
+
+    rows = []
+    for root_id in parents:
+        best = {root_id: (0, False)}
+        queue = deque([root_id])
+        while queue:
+            node = queue.popleft()
+            depth, via_link = best[node]
+            for child_id, is_link in children.get(node, ()):
+                candidate = (depth + 1, via_link or is_link)
+                previous = best.get(child_id)
+                if previous is None or (previous[1] and not candidate[1]) or (previous[1] == candidate[1] and candidate[0] < previous[0]):
+                    best[child_id] = candidate
+                    queue.append(child_id)
+        for descendant_id, (depth, via_link) in best.items():
+            rows.append(CategoryClosure(ancestor_id=root_id, descendant_id=descendant_id, depth=depth, via_link=via_link))
+    CategoryClosure.objects.using(db_alias).bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0055_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('via_link', models.BooleanField(default=False)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='store.category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='store.category')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='categoryclosure',
+            index=models.Index(fields=['descendant', 'via_link', 'depth'], name='store_categ_descend_2a9526_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='categoryclosure',
+            unique_together={('ancestor', 'descendant')},
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
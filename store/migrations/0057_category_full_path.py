@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+def populate_full_path(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    db_alias = schema_editor.connection.alias
+
+    rows = {c.id: c for c in Category.objects.using(db_alias).all()}
+    paths = {}
+
+    def path_for(cat, seen=()):
+        if cat.id in paths:
+            return paths[cat.id]
+        parent = rows.get(cat.parent_id)
+        if parent and parent.id not in seen:
+            path = f"{path_for(parent, seen + (cat.id,))}/{cat.slug}"
+        else:
+            path = cat.slug
+        paths[cat.id] = path
+        return path
+
+    for cat in rows.values():
+        cat.full_path = path_for(cat)
+    Category.objects.using(db_alias).bulk_update(list(rows.values()), ['full_path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0056_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='full_path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(populate_full_path, migrations.RunPython.noop),
+    ]
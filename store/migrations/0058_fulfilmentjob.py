@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-18 14:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0057_category_full_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FulfilmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('shipment', 'Създаване на товарителница'), ('meta_purchase', 'Meta CAPI Purchase'), ('customer_email', 'Имейл до клиента'), ('admin_email', 'Имейл до магазина')], max_length=32)),
+                ('status', models.CharField(choices=[('pending', 'Чакащ'), ('running', 'Изпълнява се'), ('done', 'Изпълнен'), ('failed', 'Неуспешен')], default='pending', max_length=16)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=6)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fulfilment_jobs', to='store.order')),
+            ],
+            options={
+                'verbose_name': 'Fulfilment job',
+                'verbose_name_plural': 'Fulfilment jobs',
+                'ordering': ['run_after', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='fulfilmentjob',
+            index=models.Index(fields=['status', 'run_after'], name='store_fulfi_status_10541d_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fulfilmentjob',
+            unique_together={('order', 'kind')},
+        ),
+    ]
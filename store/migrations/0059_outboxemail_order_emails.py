@@ -0,0 +1,59 @@
+# Generated by Django 4.2 on 2026-10-18 14:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def merge_legacy_email_jobs(apps, schema_editor):
+    """Collapse unfinished customer_email/admin_email jobs into one order_emails job per order."""
+    FulfilmentJob = apps.get_model("store", "FulfilmentJob")
+    legacy = FulfilmentJob.objects.filter(kind__in=["customer_email", "admin_email"])
+    order_ids = set(legacy.exclude(status="done").values_list("order_id", flat=True))
+    for order_id in order_ids:
+        FulfilmentJob.objects.get_or_create(order_id=order_id, kind="order_emails")
+    legacy.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0058_fulfilmentjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Чакащ'), ('running', 'Изпълнява се'), ('done', 'Изпълнен'), ('failed', 'Неуспешен')], default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=6)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('subject', models.CharField(max_length=255)),
+                ('from_email', models.CharField(max_length=255)),
+                ('to_email', models.EmailField(max_length=254)),
+                ('text_body', models.TextField()),
+                ('html_body', models.TextField(blank=True, default='')),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Outbox email',
+                'verbose_name_plural': 'Outbox emails',
+                'ordering': ['run_after', 'id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='fulfilmentjob',
+            name='kind',
+            field=models.CharField(choices=[('shipment', 'Създаване на товарителница'), ('meta_purchase', 'Meta CAPI Purchase'), ('order_emails', 'Имейли за поръчката')], max_length=32),
+        ),
+        migrations.RunPython(merge_legacy_email_jobs, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(fields=['status', 'run_after'], name='store_outbo_status_1dd5f7_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0059_outboxemail_order_emails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeedyOffice',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('site_id', models.PositiveIntegerField(db_index=True)),
+                ('name', models.CharField(max_length=255)),
+                ('name_en', models.CharField(blank=True, default='', max_length=255)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Speedy office',
+                'verbose_name_plural': 'Speedy offices',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SpeedySite',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('name_en', models.CharField(blank=True, default='', max_length=255)),
+                ('type', models.CharField(blank=True, default='', max_length=32)),
+                ('municipality', models.CharField(blank=True, default='', max_length=255)),
+                ('region', models.CharField(blank=True, default='', max_length=255)),
+                ('post_code', models.CharField(blank=True, default='', max_length=16)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Speedy site',
+                'verbose_name_plural': 'Speedy sites',
+                'ordering': ['name'],
+            },
+        ),
+    ]
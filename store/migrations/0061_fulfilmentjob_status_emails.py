@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0060_speedy_catalogue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fulfilmentjob',
+            name='kind',
+            field=models.CharField(choices=[('shipment', 'Създаване на товарителница'), ('meta_purchase', 'Meta CAPI Purchase'), ('order_emails', 'Имейли за поръчката'), ('shipped_email', 'Имейл: изпратена'), ('delivered_email', 'Имейл: доставена')], max_length=32),
+        ),
+    ]
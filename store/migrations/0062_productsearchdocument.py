@@ -0,0 +1,110 @@
+# Generated by Django 4.2 on 2026-10-18 14:37
+
+import html
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.html import strip_tags
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in ('title', 'body'):
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS store_productsearch_{column}_trgm '
+            f'ON store_productsearchdocument USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in ('title', 'body'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS store_productsearch_{column}_trgm')
+
+
+# Frozen copy of store.search's normalization at the time of this migration;
+# later changes to store.search reach existing rows via rebuild_search_index.
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sht', 'ъ': 'a', 'ь': 'y', 'ю': 'yu', 'я': 'ya', 'ѝ': 'i',
+})
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_text(value):
+    value = html.unescape(strip_tags(value or '')).lower().translate(TRANSLIT)
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return ' '.join(NON_WORD.sub(' ', value).split())
+
+
+def category_paths(rows):
+    rows = {cat_id: (parent_id, title) for cat_id, parent_id, title in rows}
+    paths = {}
+
+    def path_for(cat_id, seen=()):
+        if cat_id not in paths:
+            parent_id, title = rows[cat_id]
+            if parent_id in rows and parent_id not in seen:
+                paths[cat_id] = f'{path_for(parent_id, seen + (cat_id,))} {title}'
+            else:
+                paths[cat_id] = title
+        return paths[cat_id]
+
+    for cat_id in rows:
+        path_for(cat_id)
+    return paths
+
+
+def build_documents(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    ProductSearchDocument = apps.get_model('store', 'ProductSearchDocument')
+    db_alias = schema_editor.connection.alias
+
+    paths = category_paths(Category.objects.using(db_alias).values_list('id', 'parent_id', 'title'))
+    rows = []
+    for product in Product.objects.using(db_alias).prefetch_related('colors').iterator(chunk_size=500):
+        colors = ' '.join(f'{color.name_bg} {color.name_en}' for color in product.colors.all())
+        body = ' '.join([
+            product.name,
+            product.h1_override or '',
+            product.sku or '',
+            paths.get(product.category_id, ''),
+            colors,
+            product.description or '',
+        ])
+        rows.append(ProductSearchDocument(
+            product_id=product.pk,
+            title=normalize_text(f'{product.name} {product.sku}'),
+            body=normalize_text(body),
+        ))
+    ProductSearchDocument.objects.using(db_alias).bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0061_fulfilmentjob_status_emails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='store.product')),
+                ('title', models.TextField(blank=True, default='')),
+                ('body', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 14:53
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def zero_null_sort_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Product.objects.using(schema_editor.connection.alias).filter(sort_price__isnull=True).update(sort_price=Decimal('0.00'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0062_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.RunPython(zero_null_sort_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='sort_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0.0, editable=False, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 15:02
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # Same weights and config as store.search.document_vector()
+    schema_editor.execute(
+        "UPDATE store_productsearchdocument SET vector = "
+        "setweight(to_tsvector('simple', COALESCE(title, '')), 'A') || "
+        "setweight(to_tsvector('simple', COALESCE(body, '')), 'B')"
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS store_productsearch_vector_gin '
+        'ON store_productsearchdocument USING gin (vector)'
+    )
+
+
+def drop_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS store_productsearch_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0063_product_sort_price_not_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsearchdocument',
+            name='vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_vector_index, drop_vector_index),
+    ]
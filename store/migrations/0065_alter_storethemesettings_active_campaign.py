@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0064_productsearchdocument_vector'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='storethemesettings',
+            name='active_campaign',
+            field=models.CharField(choices=[('default', 'Default'), ('halloween', 'Halloween'), ('black-friday', 'Black Friday'), ('valentine', 'Valentine')], db_index=True, default='default', max_length=32),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.search import SearchVectorField
 from django.core.cache import cache
 from shortuuid.django_fields import ShortUUIDField
 from django.utils import timezone
@@ -8,6 +9,9 @@ from userauths import models as user_models
 from django.urls import reverse
 from decimal import Decimal, ROUND_FLOOR
 from store.utils import floor_to_cent
+import time
+from collections import deque
+from functools import partial
 
 STATUS = (
     ("published", "Published"),
@@ -40,6 +44,21 @@ SHIPPING_SERVICE = (
     ("speedy", "Спиди"),
 )
 
+FULFILMENT_JOB_KIND = (
+    ("shipment", "Създаване на товарителница"),
+    ("meta_purchase", "Meta CAPI Purchase"),
+    ("order_emails", "Имейли за поръчката"),
+    ("shipped_email", "Имейл: изпратена"),
+    ("delivered_email", "Имейл: доставена"),
+)
+
+FULFILMENT_JOB_STATUS = (
+    ("pending", "Чакащ"),
+    ("running", "Изпълнява се"),
+    ("done", "Изпълнен"),
+    ("failed", "Неуспешен"),
+)
+
 VARIANT_TYPE_CHOICES = (
     ("specification", "Specification"),
     ("length", "Length"),
@@ -92,6 +111,8 @@ class Category(models.Model):
         verbose_name="Показвай банера в категория",
     )
     slug = models.SlugField()
+    # Denormalized slug path ("parent/child/leaf") used to resolve category URLs in one lookup
+    full_path = models.CharField(max_length=500, blank=True, default="", db_index=True, editable=False)
     meta_title = models.CharField(max_length=150, blank=True, null=True)
     meta_description = models.CharField(max_length=300, blank=True, null=True)
     is_popular = models.BooleanField(default=False, verbose_name="Популярна категория")
@@ -101,24 +122,38 @@ class Category(models.Model):
         ordering = ["sku"]
         unique_together = ("parent", "slug")
 
-    def get_full_path(self):
-        parts = []
+    def get_ancestors(self):
+        """
+        Return ancestors root-first. Walks parents already loaded via select_related
+        and resolves the rest with one indexed query on the closure table.
+        """
+        chain = []
         current = self
-        while current:
-            parts.insert(0, current.slug)
+        while current.parent_id:
+            if not Category.parent.is_cached(current):
+                rest = list(
+                    Category.objects.filter(
+                        descendant_links__descendant_id=current.pk,
+                        descendant_links__via_link=False,
+                        descendant_links__depth__gt=0,
+                    ).order_by("-descendant_links__depth")
+                )
+                if rest:
+                    return rest + chain[::-1]
             current = current.parent
-        return "/".join(parts)
+            chain.append(current)
+        return chain[::-1]
+
+    def get_full_path(self):
+        if self.full_path:
+            return self.full_path
+        return "/".join([c.slug for c in self.get_ancestors()] + [self.slug])
 
     def get_full_name_path(self):
         """
         Returns a human-readable category path, e.g. "Parent / Child / Subcategory".
         """
-        names = []
-        current = self
-        while current:
-            names.insert(0, current.title)
-            current = current.parent
-        return " - ".join(names)
+        return " - ".join([c.title for c in self.get_ancestors()] + [self.title])
 
     def __str__(self):
         return self.sku
@@ -134,16 +169,50 @@ class Category(models.Model):
             orig = Category.objects.get(pk=self.pk)
             if orig.title != self.title:
                 self.slug = slugify(self.title)
+            # Read by the category signals to skip work for cosmetic edits
+            self._saved_tree = (orig.parent_id, orig.slug, orig.title)
         else:
             self.slug = slugify(self.title)
+            self._saved_tree = None
+        parent_path = self.parent.get_full_path() if self.parent_id else ""
+        self.full_path = f"{parent_path}/{self.slug}" if parent_path else self.slug
         super().save(*args, **kwargs)
 
+    @classmethod
+    def refresh_full_paths(cls):
+        """Recompute full_path for every category and write only the rows that changed."""
+        rows = {
+            cat_id: (parent_id, slug, full_path)
+            for cat_id, parent_id, slug, full_path in cls.objects.values_list(
+                "id", "parent_id", "slug", "full_path"
+            )
+        }
+        paths = {}
+
+        def path_for(cat_id, seen=()):
+            if cat_id in paths:
+                return paths[cat_id]
+            parent_id, slug, _ = rows[cat_id]
+            if parent_id and parent_id in rows and parent_id not in seen:
+                path = f"{path_for(parent_id, seen + (cat_id,))}/{slug}"
+            else:
+                path = slug
+            paths[cat_id] = path
+            return path
+
+        changed = []
+        for cat_id, (_, _, current) in rows.items():
+            path = path_for(cat_id)
+            if path != current:
+                changed.append(cls(id=cat_id, full_path=path))
+        if changed:
+            cls.objects.bulk_update(changed, ["full_path"], batch_size=500)
+        return len(changed)
+
     @property
     def root(self):
-        cat = self
-        while cat.parent:
-            cat = cat.parent
-        return cat
+        ancestors = self.get_ancestors()
+        return ancestors[0] if ancestors else self
 
 
 class CategoryLink(models.Model):
@@ -173,6 +242,102 @@ class CategoryLink(models.Model):
         return f"{self.parent.title} → {self.child.title}"
 
 
+class CategoryClosure(models.Model):
+    """
+    Materialized ancestor/descendant pairs of the category tree (including the
+    category itself at depth 0). Rows reachable only through a CategoryLink are
+    flagged via_link so breadcrumbs and slug paths can ignore them.
+    New categories get their rows from add_leaf(); moves, deletes and link
+    changes rebuild() in bulk once their transaction commits.
+    """
+    ancestor = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="descendant_links"
+    )
+    descendant = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="ancestor_links"
+    )
+    depth = models.PositiveIntegerField(default=0)
+    via_link = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        indexes = [
+            models.Index(fields=["descendant", "via_link", "depth"]),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} → {self.descendant_id} ({self.depth})"
+
+    @classmethod
+    def descendant_ids(cls, category_ids):
+        """All category ids under the given ones (inclusive), following links too."""
+        return list(
+            cls.objects.filter(ancestor_id__in=category_ids)
+            .values_list("descendant_id", flat=True)
+            .distinct()
+        )
+
+    @classmethod
+    def add_leaf(cls, category):
+        """
+        Rows for a just-created category: itself plus its parent's ancestors one
+        level deeper. A new category has no children or links yet, so this is
+        what rebuild() would produce for it.
+        """
+        rows = [cls(ancestor_id=category.pk, descendant_id=category.pk, depth=0)]
+        if category.parent_id:
+            for ancestor_id, depth, via_link in cls.objects.filter(descendant_id=category.parent_id).values_list(
+                "ancestor_id", "depth", "via_link"
+            ):
+                rows.append(cls(
+                    ancestor_id=ancestor_id, descendant_id=category.pk, depth=depth + 1, via_link=via_link,
+                ))
+        cls.objects.bulk_create(rows, ignore_conflicts=True)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute the whole closure from parent pointers and CategoryLink edges."""
+        parents = dict(Category.objects.values_list("id", "parent_id"))
+        children = {}
+        for cat_id, parent_id in parents.items():
+            if parent_id:
+                children.setdefault(parent_id, []).append((cat_id, False))
+        for parent_id, child_id in CategoryLink.objects.values_list("parent_id", "child_id"):
+            if parent_id in parents and child_id in parents:
+                children.setdefault(parent_id, []).append((child_id, True))
+
+        rows = []
+        for root_id in parents:
+            # Breadth-first; prefer real (non-link) paths, then the shallowest one
+            best = {root_id: (0, False)}
+            queue = deque([root_id])
+            while queue:
+                node = queue.popleft()
+                depth, via_link = best[node]
+                for child_id, is_link in children.get(node, ()):
+                    candidate = (depth + 1, via_link or is_link)
+                    previous = best.get(child_id)
+                    if (
+                        previous is None
+                        or (previous[1] and not candidate[1])
+                        or (previous[1] == candidate[1] and candidate[0] < previous[0])
+                    ):
+                        best[child_id] = candidate
+                        queue.append(child_id)
+            for descendant_id, (depth, via_link) in best.items():
+                rows.append(cls(
+                    ancestor_id=root_id,
+                    descendant_id=descendant_id,
+                    depth=depth,
+                    via_link=via_link,
+                ))
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     # Optional override for the H1 title on the product detail page
@@ -215,6 +380,16 @@ class Product(models.Model):
         blank=True,
         verbose_name="Sale Price",
     )
+    # Denormalized purchase price (Band of the Week, sale or regular) used for sorting.
+    # Kept in sync by save() and BandOfTheWeek changes; see Product.refresh_sort_prices.
+    # Never NULL (products without a price sort as 0.00) so keyset cursors can compare it.
+    sort_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0.00,
+        db_index=True,
+        editable=False,
+    )
     stock = models.PositiveIntegerField(default=0, null=True, blank=True)
     shipping = models.DecimalField(
         max_digits=12,
@@ -231,6 +406,8 @@ class Product(models.Model):
     # Special product type that allows custom note and multi-device selection
     is_mystery_box = models.BooleanField(default=False, db_index=True)
     date = models.DateTimeField(default=timezone.now)
+    # Bumped on every save; part of the product card fragment cache key
+    updated_at = models.DateTimeField(auto_now=True)
     variants = models.ManyToManyField("Variant", blank=True, related_name="products")
     colors = models.ManyToManyField("Color", blank=True, related_name="products")
     on_sale = models.BooleanField(default=False, db_index=True)
@@ -300,22 +477,60 @@ class Product(models.Model):
         """Price used for purchase: applies Band of the Week 50% discount if active,
         otherwise uses sale_price if valid, otherwise price.
         """
-        # Apply Band of the Week discount (50% of base price) if this product is this week's band
+        band_product_id = None
         BandOfTheWeek = globals().get("BandOfTheWeek")
         if BandOfTheWeek and self.price:
             try:
-                current_week_deal = BandOfTheWeek.get_current_week()
-                if current_week_deal and current_week_deal.product_id == self.id:
-                    half_price = self.price * Decimal("0.5")
-                    return floor_to_cent(half_price)
+                band_product_id = BandOfTheWeek.get_current_product_id()
             except Exception:
-                pass
+                band_product_id = None
+        return self.compute_effective_price(band_product_id)
+
+    def compute_effective_price(self, band_product_id=None):
+        """Effective price given the id of this week's band product (no queries)."""
+        # Apply Band of the Week discount (50% of base price) if this product is this week's band
+        if band_product_id and band_product_id == self.id and self.price:
+            half_price = self.price * Decimal("0.5")
+            return floor_to_cent(half_price)
 
         # Fallback to regular sale logic
         if self.sale_price and self.price and self.sale_price < self.price:
             return self.sale_price
         return self.price
 
+    def compute_sort_price(self, band_product_id=None):
+        return self.compute_effective_price(band_product_id) or Decimal("0.00")
+
+    @classmethod
+    def refresh_sort_prices(cls, queryset=None, batch_size=500):
+        """Recompute the denormalized sort_price and write only rows that changed.
+
+        Returns the number of updated products.
+        """
+        from store.facets import mark_products_changed
+
+        band_product_id = BandOfTheWeek.get_current_product_id()
+        if queryset is None:
+            queryset = cls.objects.all()
+        changed = []
+        updated = 0
+        for product in queryset.only("id", "price", "sale_price", "sort_price").iterator():
+            new_price = product.compute_sort_price(band_product_id)
+            if new_price != product.sort_price:
+                product.sort_price = new_price
+                changed.append(product)
+            if len(changed) >= batch_size:
+                cls.objects.bulk_update(changed, ["sort_price"])
+                # bulk_update sends no signals; the facet index keeps sort prices too
+                mark_products_changed([product.pk for product in changed])
+                updated += len(changed)
+                changed = []
+        if changed:
+            cls.objects.bulk_update(changed, ["sort_price"])
+            mark_products_changed([product.pk for product in changed])
+            updated += len(changed)
+        return updated
+
     @property
     def discount_percent(self):
         if self.price and self.sale_price and self.sale_price < self.price:
@@ -330,6 +545,13 @@ class Product(models.Model):
                 self.slug = slugify(self.name)
         else:
             self.slug = slugify(self.name)
+        self.sort_price = self.effective_price or Decimal("0.00")
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            extra = ["updated_at"]
+            if {"price", "sale_price"} & set(update_fields):
+                extra.append("sort_price")
+            kwargs["update_fields"] = list(dict.fromkeys(list(update_fields) + extra))
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -420,6 +642,23 @@ class Gallery(models.Model):
         return f"{self.product.name} - image"
 
 
+class ProductSearchDocument(models.Model):
+    """Normalized, transliterated search text for a product; kept in sync by store.search."""
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="search_document"
+    )
+    # Name + SKU, ranked above matches elsewhere in the document
+    title = models.TextField(blank=True, default="")
+    # Name, SKU, category path, colour names and stripped description
+    body = models.TextField(blank=True, default="")
+    # PostgreSQL only: weighted tsvector of title (A) and body (B), GIN-indexed
+    vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.title
+
+
 class Cart(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     user = models.ForeignKey(
@@ -568,6 +807,185 @@ class OrderItem(models.Model):
             return 0
 
 
+class QueuedJob(models.Model):
+    """
+    Shared bookkeeping for DB-backed work queues: workers claim due rows with
+    SKIP LOCKED and failed attempts are retried with exponential backoff until
+    max_attempts is reached.
+    """
+    status = models.CharField(max_length=16, choices=FULFILMENT_JOB_STATUS, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=6)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    BACKOFF_BASE = 30  # seconds; doubled after each failed attempt
+    BACKOFF_MAX = 3600
+    LOCK_TIMEOUT = 600  # a "running" job older than this is considered abandoned
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def claim_due(cls, limit=10):
+        """Atomically mark up to `limit` due jobs as running and return them."""
+        now = timezone.now()
+        stale = now - timezone.timedelta(seconds=cls.LOCK_TIMEOUT)
+        with transaction.atomic():
+            jobs = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(
+                    models.Q(status="pending", run_after__lte=now)
+                    | models.Q(status="running", locked_at__lt=stale)
+                )
+                .order_by("run_after", "id")[:limit]
+            )
+            if jobs:
+                cls.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                    status="running", locked_at=now, attempts=models.F("attempts") + 1
+                )
+                for job in jobs:
+                    job.status = "running"
+                    job.locked_at = now
+                    job.attempts += 1
+        return jobs
+
+    def mark_done(self):
+        self.status = "done"
+        self.locked_at = None
+        self.last_error = None
+        self.save(update_fields=["status", "locked_at", "last_error", "updated_at"])
+
+    def mark_failed(self, error):
+        self.last_error = str(error)[:2000]
+        self.locked_at = None
+        if self.attempts >= self.max_attempts:
+            self.status = "failed"
+        else:
+            self.status = "pending"
+            delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** max(0, self.attempts - 1)))
+            self.run_after = timezone.now() + timezone.timedelta(seconds=delay)
+        self.save(update_fields=["status", "locked_at", "last_error", "run_after", "updated_at"])
+
+
+class FulfilmentJob(QueuedJob):
+    """
+    Post-payment side effect (shipment, CAPI event, emails) processed by the
+    run_fulfilment_worker command instead of inside the checkout request.
+
+    One job per (order, kind) keeps enqueueing idempotent.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="fulfilment_jobs")
+    kind = models.CharField(max_length=32, choices=FULFILMENT_JOB_KIND)
+    payload = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        verbose_name = "Fulfilment job"
+        verbose_name_plural = "Fulfilment jobs"
+        ordering = ["run_after", "id"]
+        unique_together = ("order", "kind")
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id} — {self.kind} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, order, kind, payload=None):
+        job, _ = cls.objects.get_or_create(
+            order=order, kind=kind, defaults={"payload": payload or {}}
+        )
+        return job
+
+
+class OutboxEmail(QueuedJob):
+    """
+    Rendered email waiting to be delivered by the send_outbox_emails command,
+    which sends a whole batch over one backend connection.
+    """
+    subject = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=255)
+    to_email = models.EmailField(max_length=254)
+    text_body = models.TextField()
+    html_body = models.TextField(blank=True, default="")
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Outbox email"
+        verbose_name_plural = "Outbox emails"
+        ordering = ["run_after", "id"]
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} — {self.subject} ({self.status})"
+
+    def as_message(self, connection=None):
+        from django.core.mail import EmailMultiAlternatives
+
+        msg = EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.text_body,
+            from_email=self.from_email,
+            to=[self.to_email],
+            connection=connection,
+        )
+        if self.html_body:
+            msg.attach_alternative(self.html_body, "text/html")
+        return msg
+
+    def mark_done(self):
+        self.sent_at = timezone.now()
+        self.status = "done"
+        self.locked_at = None
+        self.last_error = None
+        self.save(update_fields=["status", "locked_at", "last_error", "sent_at", "updated_at"])
+
+
+class SpeedySite(models.Model):
+    """Local copy of Speedy's site (city/village) nomenclature, synced by sync_speedy_catalogue."""
+    id = models.PositiveIntegerField(primary_key=True)
+    name = models.CharField(max_length=255)
+    name_en = models.CharField(max_length=255, blank=True, default="")
+    type = models.CharField(max_length=32, blank=True, default="")
+    municipality = models.CharField(max_length=255, blank=True, default="")
+    region = models.CharField(max_length=255, blank=True, default="")
+    post_code = models.CharField(max_length=16, blank=True, default="")
+    data = models.JSONField(default=dict, blank=True)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Speedy site"
+        verbose_name_plural = "Speedy sites"
+        ordering = ["name"]
+
+    def __str__(self):
+        return f"{self.type} {self.name} ({self.municipality})".strip()
+
+
+class SpeedyOffice(models.Model):
+    """Local copy of a Speedy office/automat, synced by sync_speedy_catalogue."""
+    id = models.PositiveIntegerField(primary_key=True)
+    site_id = models.PositiveIntegerField(db_index=True)
+    name = models.CharField(max_length=255)
+    name_en = models.CharField(max_length=255, blank=True, default="")
+    data = models.JSONField(default=dict, blank=True)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Speedy office"
+        verbose_name_plural = "Speedy offices"
+        ordering = ["name"]
+
+    def __str__(self):
+        return self.name
+
+
 class Review(models.Model):
     user = models.ForeignKey(
         user_models.User, on_delete=models.SET_NULL, blank=True, null=True
@@ -646,6 +1064,75 @@ class BandOfTheWeek(models.Model):
         except cls.DoesNotExist:
             return None
 
+    # Current week's product id: shared via cache (one key per week) and memoized
+    # per process for LOCAL_TTL seconds so pricing a page costs at most one lookup.
+    CACHE_KEY_PREFIX = "store.band_of_the_week"
+    CACHE_TIMEOUT = 60 * 60 * 24 * 8
+    LOCAL_TTL = 30
+    _local_memo = None
+
+    @classmethod
+    def _cache_key(cls, week_start):
+        return f"{cls.CACHE_KEY_PREFIX}.{week_start.isoformat()}"
+
+    @classmethod
+    def get_current_product_id(cls):
+        """Return the id of this week's band product (or None) without a per-call query."""
+        week_start = cls._to_week_start(timezone.localdate())
+        now = time.monotonic()
+        memo = cls._local_memo
+        if memo and memo[0] == week_start and memo[2] > now:
+            return memo[1]
+        key = cls._cache_key(week_start)
+        cached = cache.get(key)
+        if cached is None:
+            product_id = (
+                cls.objects.filter(week_start=week_start)
+                .values_list("product_id", flat=True)
+                .first()
+            )
+            cached = product_id or 0
+            cache.set(key, cached, timeout=cls.CACHE_TIMEOUT)
+        cls._local_memo = (week_start, cached or None, now + cls.LOCAL_TTL)
+        return cached or None
+
+    @classmethod
+    def sync_sort_prices(cls, week_start=None, product_ids=()):
+        """Refresh sort_price for this/last week's bands, any product still priced
+        below its regular/sale price (a stale band discount) and `product_ids`.
+
+        Run by `refresh_sort_prices --week` when a new week starts and after band
+        changes commit; returns the number of updated products.
+        """
+        week_start = cls._to_week_start(week_start or timezone.localdate())
+        previous_week = week_start - timezone.timedelta(days=7)
+        candidates = Product.objects.filter(
+            models.Q(weekly_deals__week_start__in=[week_start, previous_week])
+            | models.Q(sort_price__lt=models.F("price"))
+            | models.Q(pk__in=[pid for pid in product_ids if pid])
+        ).distinct()
+        return Product.refresh_sort_prices(candidates)
+
+    @classmethod
+    def invalidate_cache(cls, week_start=None, product_ids=()):
+        """Drop cached band ids; the affected sort prices are resynced on commit."""
+        keys = {cls._cache_key(cls._to_week_start(timezone.localdate()))}
+        if week_start:
+            keys.add(cls._cache_key(cls._to_week_start(week_start)))
+        try:
+            cache.delete_many(list(keys))
+        except Exception:
+            pass
+        cls._local_memo = None
+        transaction.on_commit(partial(cls._sync_after_change, tuple(product_ids)))
+
+    @classmethod
+    def _sync_after_change(cls, product_ids):
+        try:
+            cls.sync_sort_prices(product_ids=product_ids)
+        except Exception as e:
+            print(f"Error syncing band of the week sort prices: {e}")
+
     def save(self, *args, **kwargs):
         # Ensure week_start is normalized to Monday regardless of input date
         try:
@@ -654,7 +1141,15 @@ class BandOfTheWeek(models.Model):
                 self.week_start = self._to_week_start(self.week_start)
         except Exception:
             pass
+        previous_product_id = None
+        if self.pk:
+            previous_product_id = (
+                BandOfTheWeek.objects.filter(pk=self.pk)
+                .values_list("product_id", flat=True)
+                .first()
+            )
         super().save(*args, **kwargs)
+        self.invalidate_cache(self.week_start, [previous_product_id, self.product_id])
 
 
 class DeviceModel(models.Model):
@@ -747,6 +1242,115 @@ class ProductItem(models.Model):
             delta = 0
         return (base or 0) + delta
 
+    # Per-product SKU matrix, shared via cache and dropped by signals
+    MATRIX_CACHE_PREFIX = "store.sku_matrix"
+    MATRIX_CACHE_TIMEOUT = 24 * 3600
+
+    @classmethod
+    def _matrix_cache_key(cls, product_id):
+        return f"{cls.MATRIX_CACHE_PREFIX}:{product_id}"
+
+    @classmethod
+    def get_matrix(cls, product):
+        """Return the SkuMatrix for a product (instance or id), building it on a cache miss."""
+        product_id = getattr(product, "pk", product)
+        key = cls._matrix_cache_key(product_id)
+        matrix = cache.get(key)
+        if matrix is None:
+            matrix = SkuMatrix.build(product_id)
+            cache.set(key, matrix, timeout=cls.MATRIX_CACHE_TIMEOUT)
+        return matrix
+
+    @classmethod
+    def get_matrices(cls, product_ids):
+        """Return {product_id: SkuMatrix} using one cache round trip for all ids."""
+        keys = {cls._matrix_cache_key(pid): pid for pid in set(product_ids) if pid}
+        cached = cache.get_many(list(keys))
+        matrices = {keys[key]: matrix for key, matrix in cached.items()}
+        missing_ids = [pid for pid in keys.values() if pid not in matrices]
+        if missing_ids:
+            built = SkuMatrix.build_many(missing_ids)
+            matrices.update(built)
+            cache.set_many(
+                {cls._matrix_cache_key(pid): matrix for pid, matrix in built.items()},
+                timeout=cls.MATRIX_CACHE_TIMEOUT,
+            )
+        return matrices
+
+    @classmethod
+    def invalidate_matrix(cls, product_ids):
+        keys = [cls._matrix_cache_key(pid) for pid in set(product_ids) if pid]
+        if keys:
+            cache.delete_many(keys)
+
+
+class SkuMatrix:
+    """
+    All SKUs of one product indexed by (size name, model name).
+
+    Lookups mirror the old chained ProductItem filters and return the lowest-id
+    matching SKU as a plain dict: {"id", "sku", "size", "models", "quantity",
+    "price_delta"}. A size of None means "SKU without size"; ANY means "don't
+    filter on this dimension".
+    """
+
+    ANY = "__any__"
+
+    def __init__(self, items):
+        self.items = items
+        self.has_skus = bool(items)
+        self.has_size = any(it["size"] is not None for it in items)
+        self.has_model = any(it["models"] for it in items)
+        self.size_names = {it["size"] for it in items if it["size"] is not None}
+        self.model_names = {name for it in items for name in it["models"]}
+        self._index = {}
+        for it in items:
+            for size_key in (it["size"], self.ANY):
+                for model_key in list(it["models"]) + [self.ANY]:
+                    self._index.setdefault((size_key, model_key), it)
+
+    @classmethod
+    def build(cls, product_id):
+        return cls.build_many([product_id])[product_id]
+
+    @classmethod
+    def build_many(cls, product_ids):
+        """Build matrices for several products with one query (plus model prefetch)."""
+        rows = (
+            ProductItem.objects.filter(product_id__in=product_ids)
+            .select_related("size")
+            .prefetch_related("device_models")
+            .order_by("id")
+        )
+        items_by_product = {pid: [] for pid in product_ids}
+        for row in rows:
+            items_by_product.setdefault(row.product_id, []).append({
+                "id": row.id,
+                "sku": row.sku,
+                "size": row.size.name if row.size else None,
+                "models": [dm.name for dm in row.device_models.all()],
+                "quantity": int(row.quantity or 0),
+                "price_delta": Decimal(str(row.price_delta or 0)),
+            })
+        return {pid: cls(items) for pid, items in items_by_product.items()}
+
+    def find(self, size=None, model=None, size_required=False):
+        """
+        Find the SKU for a size/model selection. Empty size/model match any
+        value, unless size_required is set, in which case an empty size only
+        matches SKUs without a size.
+        """
+        size_key = size or (None if size_required else self.ANY)
+        model_key = model or self.ANY
+        return self._index.get((size_key, model_key))
+
+    def price_for(self, product, entry):
+        """Effective unit price of a SKU entry (product price plus delta)."""
+        base = product.effective_price or 0
+        if not entry:
+            return base
+        return base + entry["price_delta"]
+
 
 class SpinEntry(models.Model):
     """Stores a record of a user's spin result for a specific day.
@@ -0,0 +1,301 @@
+"""
+Ranked product search.
+
+Every product has a ProductSearchDocument: its name and SKU (title) plus the
+stripped description, category path and colour names (body), lowercased and
+transliterated to Latin so "каишка", "kaishka" and "KAISHKA" all match the
+same document. Documents are refreshed by signals and rebuilt in bulk with
+rebuild_search_index.
+
+On PostgreSQL each document also stores a weighted tsvector. A product
+matches when the vector contains every query word as a prefix (GIN on the
+vector) or when the body is word-similar to the query (`%>`, pg_trgm GIN on
+the body), which lets slightly misspelled queries match; both branches are
+index scans. Ranking adds full-text rank and trigram word similarity. Other
+backends filter with substring matches and a portable field-weighted rank.
+
+Autocomplete (/search/suggest/) is answered from a per-process SuggestIndex
+over product names, category titles and device model names, reloaded only
+when the suggest version in the cache changes.
+"""
+import bisect
+import html
+import re
+import unicodedata
+import uuid
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.urls import reverse
+from django.utils.html import strip_tags
+
+from store.models import Category, DeviceModel, Product, ProductSearchDocument
+
+# Bulgarian streamlined transliteration (as used on Bulgarian ID cards)
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "sht", "ъ": "a", "ь": "y", "ю": "yu", "я": "ya", "ѝ": "i",
+})
+NON_WORD = re.compile(r"[\W_]+")
+MAX_TERMS = 8
+
+
+def normalize_text(value):
+    """Lowercase Latin words: HTML stripped, Cyrillic transliterated, accents and punctuation dropped."""
+    value = html.unescape(strip_tags(value or "")).lower().translate(TRANSLIT)
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return " ".join(NON_WORD.sub(" ", value).split())
+
+
+def search_terms(query):
+    """Distinct normalized query words, in order, capped at MAX_TERMS."""
+    terms = []
+    for term in normalize_text(query).split(" "):
+        if term and term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def category_paths(categories=None):
+    """{category_id: "Parent Child Leaf"} from (id, parent_id, title) rows."""
+    if categories is None:
+        categories = Category.objects.values_list("id", "parent_id", "title")
+    rows = {cat_id: (parent_id, title) for cat_id, parent_id, title in categories}
+    paths = {}
+
+    def path_for(cat_id, seen=()):
+        if cat_id not in paths:
+            parent_id, title = rows[cat_id]
+            if parent_id in rows and parent_id not in seen:
+                paths[cat_id] = f"{path_for(parent_id, seen + (cat_id,))} {title}"
+            else:
+                paths[cat_id] = title
+        return paths[cat_id]
+
+    for cat_id in rows:
+        path_for(cat_id)
+    return paths
+
+
+def build_document(product, paths):
+    """(title, body) for a product with prefetched colors; `paths` from category_paths()."""
+    title = normalize_text(f"{product.name} {product.sku}")
+    colors = " ".join(f"{color.name_bg} {color.name_en}" for color in product.colors.all())
+    body = normalize_text(" ".join([
+        product.name,
+        product.h1_override or "",
+        product.sku or "",
+        paths.get(product.category_id, ""),
+        colors,
+        product.description or "",
+    ]))
+    return title, body
+
+
+def refresh_search_documents(product_ids=None, batch_size=500):
+    """Rebuild the documents of `product_ids` (all products when None). Returns the row count."""
+    products = Product.objects.prefetch_related("colors").order_by("pk")
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+        products = products.filter(pk__in=product_ids)
+    paths = category_paths()
+    count = 0
+    rows = []
+    for product in products.iterator(chunk_size=batch_size):
+        title, body = build_document(product, paths)
+        rows.append(ProductSearchDocument(product_id=product.pk, title=title, body=body))
+        if len(rows) >= batch_size:
+            count += _save_documents(rows)
+            rows = []
+    count += _save_documents(rows)
+    return count
+
+
+def document_vector():
+    """Weighted tsvector of a ProductSearchDocument (PostgreSQL only)."""
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector("title", weight="A", config="simple") + SearchVector("body", weight="B", config="simple")
+
+
+def _save_documents(rows):
+    if rows:
+        ProductSearchDocument.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["title", "body", "updated_at"],
+        )
+        if connection.vendor == "postgresql":
+            ProductSearchDocument.objects.filter(
+                pk__in=[row.product_id for row in rows]
+            ).update(vector=document_vector())
+    return len(rows)
+
+
+def refresh_category_documents(category_id):
+    """Refresh products whose category path includes `category_id` (after a rename/move)."""
+    from store.models import CategoryClosure
+
+    category_ids = CategoryClosure.descendant_ids([category_id]) or [category_id]
+    refresh_search_documents(
+        Product.objects.filter(category_id__in=category_ids).values_list("pk", flat=True)
+    )
+
+
+def _portable_rank(terms):
+    """Per term: title prefix 4, title word 3, anywhere in title 2, body only 1."""
+    rank = Value(0.0)
+    for term in terms:
+        rank = rank + Case(
+            When(search_document__title__startswith=term, then=Value(4.0)),
+            When(search_document__title__contains=f" {term}", then=Value(3.0)),
+            When(search_document__title__contains=term, then=Value(2.0)),
+            default=Value(1.0),
+            output_field=FloatField(),
+        )
+    return rank
+
+
+def search_products(queryset, query, order=True):
+    """
+    Restrict a Product queryset to documents matching every word of `query` and
+    annotate `search_rank`. With order=True the result is ranked best-first;
+    pass order=False to keep the caller's ordering (e.g. price sorting).
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    rank = _portable_rank(terms)
+
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+
+        normalized = " ".join(terms)
+        # Terms are normalized to [a-z0-9] words, so the raw query is safe
+        ts_query = SearchQuery(" & ".join(f"{term}:*" for term in terms), search_type="raw", config="simple")
+        # Two indexable predicates (tsvector GIN, trigram GIN) so the OR is a
+        # BitmapOr; the similarity itself is only computed for matched rows
+        match = (
+            Q(search_document__vector=ts_query)
+            | Q(search_document__body__trigram_word_similar=normalized)
+        )
+        queryset = queryset.annotate(
+            search_similarity=TrigramWordSimilarity(Value(normalized), "search_document__body"),
+            search_text_rank=SearchRank(F("search_document__vector"), ts_query),
+        )
+        rank = rank + F("search_text_rank") * 10 + F("search_similarity") * 4
+    else:
+        match = Q()
+        for term in terms:
+            match &= Q(search_document__body__contains=term)
+
+    queryset = queryset.filter(match).annotate(search_rank=rank)
+    if order:
+        queryset = queryset.order_by("-search_rank", "-featured", "-date", "pk")
+    return queryset
+
+
+# --- Autocomplete ---
+SUGGEST_VERSION_KEY = "search_suggest_version"
+SUGGEST_KINDS = ("product", "category", "model")
+
+# Process-local index: (version, SuggestIndex)
+_local_suggest_index = (None, None)
+
+
+class SuggestIndex:
+    """
+    Sorted (key, ...) entries for every word suffix of every label, like the
+    Speedy CatalogueIndex: the first query word is one bisect plus a short
+    scan, later words must prefix some other word of the same label.
+    """
+    MAX_SCAN = 2000
+
+    def __init__(self, items):
+        self.items = []
+        entries = []
+        for kind, label, url in items:
+            words = normalize_text(label).split(" ")
+            if not words[0]:
+                continue
+            item_id = len(self.items)
+            self.items.append(({"type": kind, "label": label, "url": url}, words))
+            for pos in range(len(words)):
+                entries.append((" ".join(words[pos:]), pos, SUGGEST_KINDS.index(kind), len(label), item_id))
+        entries.sort()
+        self._keys = [entry[0] for entry in entries]
+        self._entries = entries
+
+    def __len__(self):
+        return len(self.items)
+
+    def suggest(self, query, limit=8):
+        """Labels matching every word of `query` as prefixes; exact and leading matches, products first."""
+        terms = search_terms(query)
+        if not terms:
+            return []
+        first, rest = terms[0], terms[1:]
+        best = {}
+        start = bisect.bisect_left(self._keys, first)
+        for candidate, word_pos, kind_rank, label_len, item_id in self._entries[start:start + self.MAX_SCAN]:
+            if not candidate.startswith(first):
+                break
+            words = self.items[item_id][1]
+            if rest and not all(any(word.startswith(term) for word in words) for term in rest):
+                continue
+            rank = (candidate != first, word_pos > 0, kind_rank, label_len)
+            if item_id not in best or rank < best[item_id]:
+                best[item_id] = rank
+        ordered = sorted(best, key=lambda item_id: (best[item_id], item_id))
+        return [self.items[item_id][0] for item_id in ordered[:limit]]
+
+
+def suggest_items():
+    """(kind, label, url) for every published product, category and device model."""
+    items = []
+    products = (
+        Product.objects.filter(status="published", category__isnull=False)
+        .exclude(slug__isnull=True).exclude(slug="")
+        .values_list("name", "slug", "category__full_path")
+    )
+    for name, slug, category_path in products:
+        items.append(("product", name, reverse("store:product_detail", args=[category_path, slug])))
+    for title, full_path in Category.objects.values_list("title", "full_path"):
+        if full_path:
+            items.append(("category", title, reverse("store:category", args=[full_path])))
+    for name in DeviceModel.objects.values_list("name", flat=True):
+        # No page of its own; the client puts the model name into the search box
+        items.append(("model", name, None))
+    return items
+
+
+def _bump_suggest_version():
+    cache.set(SUGGEST_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_suggestions():
+    """Reload every process's SuggestIndex once the current transaction commits."""
+    # Earlier, another process could reload from the old rows and keep them
+    transaction.on_commit(_bump_suggest_version)
+
+
+def get_suggest_index():
+    global _local_suggest_index
+    version = cache.get(SUGGEST_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(SUGGEST_VERSION_KEY, version, timeout=None):
+            version = cache.get(SUGGEST_VERSION_KEY)
+
+    local_version, index = _local_suggest_index
+    if index is None or local_version != version:
+        index = SuggestIndex(suggest_items())
+        _local_suggest_index = (version, index)
+    return index
@@ -1,37 +1,261 @@
-from django.db.models.signals import pre_save, post_save, post_delete
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Order, Category, CategoryLink
-from .emails import send_order_notification_email
-from django.core.cache import cache
+from .models import (
+    Order, Category, CategoryLink, CategoryClosure, BandOfTheWeek, Product, Gallery, Cart,
+    ProductItem, DeviceModel, Size, Color, ColorGroup, Review,
+)
+from .emails import ORDER_STATUS_EMAILS, order_status_email, send_order_notification_email
+from .context_processors import invalidate_category_tree
+from .utils import invalidate_nav_count
+from .facets import invalidate_facets, mark_products_changed
+from .listing import bump_listing_counts
+from .search import invalidate_suggestions, refresh_category_documents, refresh_search_documents
+from customer.models import Wishlist
+from django.utils import timezone
+
+@receiver(post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # Status as loaded from the DB, so saves don't need to re-fetch the order
+    if instance.pk and "order_status" in instance.__dict__:
+        instance._loaded_order_status = instance.order_status
+
 
 @receiver(pre_save, sender=Order)
-def order_status_signal(sender, instance, **kwargs):
+def order_status_signal(sender, instance, update_fields=None, **kwargs):
     if not instance.pk:
         return
-    try:
-        previous = Order.objects.get(pk=instance.pk)
-    except Order.DoesNotExist:
+    if update_fields is not None and "order_status" not in update_fields:
         return
-    if previous.order_status != "shipped" and instance.order_status == "shipped":
-        send_order_notification_email(
-            instance,
-            f"Поръчка #{instance.order_id} e изпратена",
-            "iBands: Пратката е изпратена",
-            to_email=instance.address.email,
-        )
-    if previous.order_status != "delivered" and instance.order_status == "delivered":
-        send_order_notification_email(
-            instance,
-            f"Поръчка #{instance.order_id} е доставена",
-            "iBands: Пратката е доставена",
-            to_email=instance.address.email,
-        )
+    if hasattr(instance, "_loaded_order_status"):
+        previous_status = instance._loaded_order_status
+    else:
+        try:
+            previous_status = Order.objects.values_list("order_status", flat=True).get(pk=instance.pk)
+        except Order.DoesNotExist:
+            return
+    instance._loaded_order_status = instance.order_status
+    for status in ORDER_STATUS_EMAILS:
+        if previous_status != status and instance.order_status == status:
+            email_heading, email_title = order_status_email(instance, status)
+            send_order_notification_email(
+                instance,
+                email_heading,
+                email_title,
+                to_email=instance.address.email,
+            )
+
+# Category work deferred to the end of the transaction; see schedule_category_refresh
+_category_refresh = threading.local()
+
+
+def schedule_category_refresh(document_category_id=None, rebuild=True):
+    """
+    Once the current transaction commits: rebuild the category closure and
+    full paths (when `rebuild`), refresh the search documents under
+    `document_category_id`, then drop the category caches. All category and
+    link saves in one transaction share a single run.
+    """
+    state = _category_refresh.__dict__
+    state["rebuild"] = state.get("rebuild", False) or rebuild
+    if document_category_id:
+        state.setdefault("documents", set()).add(document_category_id)
+    state["pending"] = True
+    transaction.on_commit(_refresh_categories)
+
+
+def _refresh_categories():
+    state = _category_refresh.__dict__
+    if not state.get("pending"):
+        return  # already done by an earlier callback of the same commit
+    state["pending"] = False
+    rebuild = state.pop("rebuild", False)
+    documents = state.pop("documents", set())
+    if rebuild:
+        CategoryClosure.rebuild()
+        Category.refresh_full_paths()
+    # Category titles are part of the product search documents
+    for category_id in documents:
+        refresh_category_documents(category_id)
+    # Only now, so no request caches a tree or index built from the old rows
+    _invalidate_category_caches()
+
+
+def _invalidate_category_caches():
+    invalidate_category_tree()
+    invalidate_suggestions()
+    invalidate_facets()
+    bump_listing_counts()
+
 
 @receiver([post_save, post_delete], sender=Category)
-def clear_category_cache(sender, **kwargs):
-    cache.delete("category_tree")
+def clear_category_cache(sender, instance, **kwargs):
+    saved = kwargs["signal"] is post_save
+    previous = getattr(instance, "_saved_tree", None)
+    if saved and kwargs.get("created") and not kwargs.get("raw"):
+        CategoryClosure.add_leaf(instance)
+        _invalidate_category_caches()
+    elif not saved or kwargs.get("raw") or previous is None or previous[:2] != (instance.parent_id, instance.slug):
+        # Moved, re-slugged or deleted: descendants' closure rows and paths change
+        schedule_category_refresh(instance.pk if saved else None)
+    elif previous[2] != instance.title:
+        schedule_category_refresh(instance.pk, rebuild=False)
+    else:
+        # Description, images, flags: only the cached tree shows them
+        invalidate_category_tree()
 
 
 @receiver([post_save, post_delete], sender=CategoryLink)
 def clear_category_link_cache(sender, **kwargs):
-    cache.delete("category_tree")
\ No newline at end of file
+    schedule_category_refresh()
+
+
+@receiver(post_delete, sender=BandOfTheWeek)
+def clear_band_of_the_week_cache(sender, instance, **kwargs):
+    BandOfTheWeek.invalidate_cache(instance.week_start, [instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Gallery)
+def touch_product_on_gallery_change(sender, instance, **kwargs):
+    # Gallery images are part of the cached product card; bump the product timestamp
+    if instance.product_id:
+        Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Cart)
+def clear_cart_nav_count(sender, instance, **kwargs):
+    invalidate_nav_count("cart", cart_id=instance.cart_id)
+
+
+@receiver([post_save, post_delete], sender=Wishlist)
+def clear_wishlist_nav_count(sender, instance, **kwargs):
+    invalidate_nav_count("wishlist", cart_id=instance.wishlist_id)
+    invalidate_nav_count("wishlist", user_id=instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=ProductItem)
+def clear_sku_matrix_on_item_change(sender, instance, **kwargs):
+    ProductItem.invalidate_matrix([instance.product_id])
+    mark_products_changed([instance.product_id])
+    bump_listing_counts()
+
+
+def _sku_matrix_product_ids(instance):
+    if isinstance(instance, Size):
+        items = ProductItem.objects.filter(size=instance)
+    else:
+        items = ProductItem.objects.filter(device_models=instance)
+    return list(items.values_list("product_id", flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=ProductItem.device_models.through)
+def clear_sku_matrix_on_models_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            ProductItem.invalidate_matrix([instance.product_id])
+        return
+    # Reverse side (DeviceModel.product_items): collect products before a clear
+    if action == "pre_clear":
+        instance._sku_matrix_product_ids = _sku_matrix_product_ids(instance)
+    elif action == "post_clear":
+        ProductItem.invalidate_matrix(getattr(instance, "_sku_matrix_product_ids", []))
+    elif action.startswith("post_") and pk_set:
+        ProductItem.invalidate_matrix(
+            ProductItem.objects.filter(pk__in=pk_set).values_list("product_id", flat=True)
+        )
+
+
+@receiver([pre_save, pre_delete], sender=DeviceModel)
+@receiver([pre_save, pre_delete], sender=Size)
+def collect_sku_matrix_products(sender, instance, **kwargs):
+    # Matrices store size/model names, so renames and deletes must drop them
+    instance._sku_matrix_product_ids = _sku_matrix_product_ids(instance) if instance.pk else []
+
+
+@receiver([post_save, post_delete], sender=DeviceModel)
+@receiver([post_save, post_delete], sender=Size)
+def clear_sku_matrix_on_dimension_change(sender, instance, **kwargs):
+    ProductItem.invalidate_matrix(getattr(instance, "_sku_matrix_product_ids", []))
+    if sender is Size:
+        # Size names are facet values
+        invalidate_facets()
+        bump_listing_counts()
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_search_document(sender, instance, **kwargs):
+    refresh_search_documents([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=DeviceModel)
+def clear_search_suggestions(sender, **kwargs):
+    invalidate_suggestions()
+
+
+@receiver(m2m_changed, sender=Product.colors.through)
+def refresh_search_document_on_colors_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            refresh_search_documents([instance.pk])
+        return
+    # Reverse side (Color.products): collect products before a clear
+    if action == "pre_clear":
+        instance._search_product_ids = list(instance.products.values_list("pk", flat=True))
+    elif action == "post_clear":
+        refresh_search_documents(getattr(instance, "_search_product_ids", []))
+    elif action.startswith("post_") and pk_set:
+        refresh_search_documents(pk_set)
+
+
+@receiver(pre_delete, sender=Color)
+def collect_color_search_products(sender, instance, **kwargs):
+    instance._search_product_ids = list(instance.products.values_list("pk", flat=True))
+
+
+@receiver([post_save, post_delete], sender=Color)
+def refresh_search_documents_on_color_change(sender, instance, **kwargs):
+    if kwargs.get("created"):
+        return
+    if "_search_product_ids" in instance.__dict__:
+        refresh_search_documents(instance._search_product_ids)
+    else:
+        refresh_search_documents(instance.products.values_list("pk", flat=True))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def mark_product_facets_changed(sender, instance, **kwargs):
+    mark_products_changed([instance.pk])
+    bump_listing_counts()
+
+
+@receiver(m2m_changed, sender=Product.additional_categories.through)
+@receiver(m2m_changed, sender=Product.colors.through)
+def mark_product_facets_changed_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    bump_listing_counts()
+    if not reverse:
+        mark_products_changed([instance.pk])
+    elif pk_set:
+        mark_products_changed(pk_set)
+    else:
+        # Reverse clear (category.extra_products / color.products): the set is gone
+        invalidate_facets()
+
+
+@receiver([post_save, post_delete], sender=Color)
+@receiver([post_save, post_delete], sender=ColorGroup)
+def clear_facets_on_color_change(sender, instance, **kwargs):
+    # Moving a colour between groups changes many products at once
+    if not kwargs.get("created"):
+        invalidate_facets()
+        bump_listing_counts()
+
+
+@receiver([post_save, post_delete], sender=Review)
+def mark_review_facets_changed(sender, instance, **kwargs):
+    mark_products_changed([instance.product_id])
+    bump_listing_counts()
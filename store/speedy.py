@@ -0,0 +1,312 @@
+"""
+Local Speedy site/office catalogue and shipping quote cache.
+
+sync_speedy_catalogue copies Speedy's nomenclature into SpeedySite and
+SpeedyOffice. Every process keeps an in-memory prefix index over the Cyrillic
+and Latin names, reloaded only when the catalogue version in the cache changes,
+so checkout autocomplete never waits on Speedy's API.
+"""
+import bisect
+import csv
+import io
+import json
+import math
+import re
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from store.models import SpeedyOffice, SpeedySite
+from store.utils import speedy_v1_all_offices, speedy_v1_calculate, speedy_v1_sites_csv
+
+CATALOGUE_VERSION_KEY = "speedy_catalogue_version"
+SITE_TYPE_PREFIX = re.compile(r"^(гр|с|gr|s)\.\s*")
+NON_WORD = re.compile(r"[\W_]+")
+
+# Process-local index: (version, CatalogueIndex)
+_local_index = (None, None)
+
+
+def normalize_name(value):
+    """Lowercase, drop a leading "гр."/"с." and collapse punctuation to single spaces."""
+    value = SITE_TYPE_PREFIX.sub("", (value or "").strip().lower())
+    return " ".join(NON_WORD.sub(" ", value).split())
+
+
+class CatalogueIndex:
+    """
+    Sorted (key, ...) entries for every word suffix of every site name, so a
+    prefix query is one bisect plus a short scan: "търн" finds "велико търново".
+    """
+    MAX_SCAN = 2000
+
+    def __init__(self, sites, offices):
+        self.sites = {}
+        self._type_rank = {}
+        entries = []
+        for site in sites:
+            site_id = site["id"]
+            self.sites[site_id] = site["data"]
+            self._type_rank[site_id] = 0 if (site["type"] or "").startswith("гр") else 1
+            for name in {site["name"], site["name_en"]}:
+                words = normalize_name(name).split(" ")
+                if not words[0]:
+                    continue
+                for pos in range(len(words)):
+                    entries.append((" ".join(words[pos:]), pos, len(name), site_id))
+        entries.sort()
+        self._keys = [entry[0] for entry in entries]
+        self._entries = entries
+
+        self.offices_by_site = {}
+        for office in offices:
+            self.offices_by_site.setdefault(office["site_id"], []).append(office["data"])
+
+    @property
+    def has_sites(self):
+        return bool(self.sites)
+
+    def find_sites(self, query, limit=20):
+        """Sites whose name (or a later word of it) starts with `query`; towns and exact matches first."""
+        key = normalize_name(query)
+        if not key:
+            return []
+        best = {}
+        start = bisect.bisect_left(self._keys, key)
+        for candidate, word_pos, name_len, site_id in self._entries[start:start + self.MAX_SCAN]:
+            if not candidate.startswith(key):
+                break
+            rank = (candidate != key, word_pos > 0, self._type_rank[site_id], name_len)
+            if site_id not in best or rank < best[site_id]:
+                best[site_id] = rank
+        ordered = sorted(best, key=lambda site_id: (best[site_id], site_id))
+        return [self.sites[site_id] for site_id in ordered[:limit]]
+
+    def offices_for_site(self, site_id):
+        return self.offices_by_site.get(site_id, [])
+
+
+def invalidate_catalogue():
+    cache.set(CATALOGUE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def get_catalogue_index():
+    global _local_index
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(CATALOGUE_VERSION_KEY, version, timeout=None):
+            version = cache.get(CATALOGUE_VERSION_KEY)
+
+    local_version, index = _local_index
+    if index is None or local_version != version:
+        index = CatalogueIndex(
+            SpeedySite.objects.values("id", "name", "name_en", "type", "data"),
+            SpeedyOffice.objects.order_by("name").values("site_id", "data"),
+        )
+        _local_index = (version, index)
+    return index
+
+
+def _office_site_id(office):
+    site_id = office.get("siteId") or (office.get("address") or {}).get("siteId")
+    try:
+        return int(site_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_sites_csv(text):
+    """Rows of Speedy's /location/site/csv export as dicts shaped like the JSON API."""
+    sites = []
+    for row in csv.DictReader(io.StringIO(text.lstrip("\ufeff"))):
+        try:
+            row["id"] = int(row["id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        sites.append(row)
+    return sites
+
+
+def fetch_catalogue(country_id=100):
+    sites = parse_sites_csv(speedy_v1_sites_csv(country_id))
+    offices = (speedy_v1_all_offices(country_id) or {}).get("offices") or []
+    return sites, offices
+
+
+def load_catalogue_file(path):
+    """Read a {"sites": [...], "offices": [...]} JSON file (API-shaped entries)."""
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    return data.get("sites") or [], data.get("offices") or []
+
+
+def sync_catalogue(sites, offices):
+    """Replace the local catalogue with the given API-shaped sites/offices."""
+    site_rows = [
+        SpeedySite(
+            id=int(site["id"]),
+            name=site.get("name") or "",
+            name_en=site.get("nameEn") or "",
+            type=site.get("type") or "",
+            municipality=site.get("municipality") or "",
+            region=site.get("region") or "",
+            post_code=str(site.get("postCode") or ""),
+            data=site,
+        )
+        for site in sites
+        if site.get("id")
+    ]
+    office_rows = [
+        SpeedyOffice(
+            id=int(office["id"]),
+            site_id=_office_site_id(office),
+            name=office.get("name") or "",
+            name_en=office.get("nameEn") or "",
+            data=office,
+        )
+        for office in offices
+        if office.get("id") and _office_site_id(office)
+    ]
+    if not site_rows:
+        raise ValueError("Speedy returned an empty site list; keeping the current catalogue")
+    with transaction.atomic():
+        SpeedyOffice.objects.all().delete()
+        SpeedySite.objects.all().delete()
+        SpeedySite.objects.bulk_create(site_rows, batch_size=1000)
+        SpeedyOffice.objects.bulk_create(office_rows, batch_size=1000)
+    invalidate_catalogue()
+    return len(site_rows), len(office_rows)
+
+
+# --- Shipping quotes ---
+QUOTE_TTL = 6 * 3600
+ORDER_QUOTE_TTL = 7 * 86400
+QUOTE_WEIGHT_STEP = 0.5  # kg; quotes are computed for the top of the bucket
+QUOTE_STATS_FIELDS = ("hits", "misses", "order_reuse")
+
+
+def weight_bucket(weight):
+    try:
+        weight = max(float(weight or 0), 0.01)
+    except (TypeError, ValueError):
+        weight = 0.1
+    steps = max(1, math.ceil(round(weight / QUOTE_WEIGHT_STEP, 6)))
+    return round(steps * QUOTE_WEIGHT_STEP, 3)
+
+
+def quote_destination(office_id=None, site_id=None, site_name=None):
+    """Part of the quote key that identifies where the parcel goes."""
+    if office_id and str(office_id).isdigit():
+        return f"office:{int(office_id)}"
+    if site_id and str(site_id).isdigit():
+        return f"site:{int(site_id)}"
+    if site_name and normalize_name(site_name):
+        return f"name:{normalize_name(site_name)}"
+    return None
+
+
+def quote_cache_key(destination, weight, payer, cod_amount=None):
+    # The COD fee is a share of the collected amount, so the amount is part of the key
+    cod = f"{Decimal(str(cod_amount)):.2f}" if cod_amount is not None else "none"
+    return f"speedy_quote:{destination}:{weight_bucket(weight)}:{payer}:{cod}"
+
+
+def record_quote_metric(field):
+    try:
+        redis = cache.client.get_client(write=True)
+        redis.incr(f"speedy_quote_stats:{field}")
+    except Exception:
+        # Stats are best-effort
+        pass
+
+
+def get_quote_stats():
+    try:
+        redis = cache.client.get_client(write=True)
+        values = redis.mget([f"speedy_quote_stats:{field}" for field in QUOTE_STATS_FIELDS])
+    except Exception:
+        values = [0] * len(QUOTE_STATS_FIELDS)
+    stats = {field: int(value or 0) for field, value in zip(QUOTE_STATS_FIELDS, values)}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(100.0 * stats["hits"] / lookups, 1) if lookups else 0
+    # Every hit and every reused order quote is a calculate call not made
+    stats["calls_saved"] = stats["hits"] + stats["order_reuse"]
+    return stats
+
+
+def extract_quote(calc_response):
+    """First calculation of a /v1/calculate reply as {"serviceId", "price", "currency"}."""
+    calcs = (calc_response or {}).get("calculations") or (calc_response or {}).get("services") or []
+    if not calcs:
+        return None
+    first = calcs[0]
+    service_id = first.get("serviceId") or (first.get("service") or {}).get("id") or first.get("id")
+    pricing = first.get("price") or {}
+    # Prefer total; fallback to amount
+    if isinstance(pricing, dict):
+        numeric_price = pricing.get("total") or pricing.get("amount") or pricing.get("totalLocal") or pricing.get("amountLocal")
+        currency = pricing.get("currency") or pricing.get("currencyLocal") or first.get("currency") or "BGN"
+    else:
+        # Some responses might have flat total/amount at the top level
+        numeric_price = first.get("total") or first.get("amount")
+        currency = first.get("currency") or "BGN"
+    return {
+        "serviceId": service_id,
+        "price": float(numeric_price) if isinstance(numeric_price, (int, float)) else None,
+        "currency": currency,
+    }
+
+
+def get_speedy_quote(recipient, destination, weight, payer="RECIPIENT", cod_amount=None):
+    """
+    Quote for (destination, weight bucket, payer, COD), served from the cache when
+    possible. Returns (quote, calc_request, calc_response); the last two are None
+    on a cache hit.
+    """
+    key = quote_cache_key(destination, weight, payer, cod_amount) if destination else None
+    if key:
+        cached = cache.get(key)
+        if cached is not None:
+            record_quote_metric("hits")
+            return cached, None, None
+    record_quote_metric("misses")
+
+    calc_request = {
+        "payer": payer,
+        "documents": False,
+        "palletized": False,
+        "parcels": [{"weight": weight_bucket(weight)}],
+        "recipient": recipient,
+    }
+    if getattr(settings, "SPEEDY_DROPOFF_OFFICE_ID", None):
+        calc_request["sender"] = {"dropoffOfficeId": int(settings.SPEEDY_DROPOFF_OFFICE_ID)}
+    # Add autoAdjustPickupDate so Speedy quotes next valid pickup even when office is closed
+    service_block = {"autoAdjustPickupDate": True}
+    if cod_amount is not None:
+        service_block["additionalServices"] = {
+            "cod": {"amount": float(cod_amount), "processingType": "CASH"}
+        }
+    calc_request["service"] = service_block
+    calc_response = speedy_v1_calculate(calc_request)
+    quote = extract_quote(calc_response)
+    if key and quote and quote.get("serviceId") and quote.get("price") is not None:
+        cache.set(key, quote, QUOTE_TTL)
+    return quote, calc_request, calc_response
+
+
+def remember_order_quote(order_id, destination, quote):
+    """Keep the checkout quote so shipment creation can reuse its serviceId."""
+    if destination and quote and quote.get("serviceId"):
+        cache.set(f"speedy_order_quote:{order_id}", {"destination": destination, **quote}, ORDER_QUOTE_TTL)
+
+
+def order_quote_service_id(order_id, destination):
+    memo = cache.get(f"speedy_order_quote:{order_id}")
+    if memo and destination and memo.get("destination") == destination and memo.get("serviceId"):
+        record_quote_metric("order_reuse")
+        return memo["serviceId"]
+    return None
@@ -45,16 +45,10 @@ def regular_plus_delta(product, size_name=None, model_name=None):
         base = Decimal("0")
 
     try:
-        qs = store_models.ProductItem.objects.filter(product=product)
-        if size_name:
-            qs = qs.filter(size__name=size_name)
-        if model_name:
-            qs = qs.filter(device_models__name=model_name)
-        sku = qs.first()
+        sku = store_models.ProductItem.get_matrix(product).find(size_name, model_name)
         if not sku:
             return base
-        delta = getattr(sku, "price_delta", None) or Decimal("0")
-        return base + Decimal(str(delta))
+        return base + sku["price_delta"]
     except Exception:
         return base
 
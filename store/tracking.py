@@ -0,0 +1,137 @@
+"""
+Courier tracking poller: pulls the status of every open tracking_id from
+Speedy and Econt in batched calls, advances order_status with one conditional
+update per (old, new) status pair and queues the shipped/delivered emails as
+fulfilment jobs for the orders it actually moved.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from store.models import FulfilmentJob, Order
+from store.utils import ECONT_TRACK_BATCH, SPEEDY_TRACK_BATCH, econt_shipment_statuses, speedy_v1_track
+
+SPEEDY_DELIVERED_CODES = {-14}  # "Delivered" tracking operation
+# Pickup, depot arrival/departure and out-for-delivery operations; anything
+# else (label registered, pickup requested, ...) leaves the order as it is
+SPEEDY_IN_TRANSIT_CODES = {1, 2, 4, 11, 12}
+# Econt trackingEvents destinationType values once the courier holds the
+# parcel; "prepared" only means the label exists
+ECONT_IN_TRANSIT_EVENTS = {"courier", "courier_direction", "office", "airport", "post"}
+UPDATE_BATCH = 500
+STATUS_RANK = {"received": 0, "shipped": 1, "delivered": 2}
+
+
+def open_shipments():
+    """Orders with a label that the courier has not delivered yet."""
+    return (
+        Order.objects.filter(order_status__in=["received", "shipped"], shipping_service__in=["speedy", "econt"])
+        .exclude(tracking_id__isnull=True)
+        .exclude(tracking_id="")
+    )
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def speedy_statuses(parcel_ids):
+    """{tracking_id: "shipped" | "delivered"} for one /v1/track batch."""
+    statuses = {}
+    for parcel in (speedy_v1_track(parcel_ids) or {}).get("parcels") or []:
+        parcel_id = str(parcel.get("parcelId") or parcel.get("id") or "")
+        operations = parcel.get("operations") or []
+        if not parcel_id or parcel.get("error") or not operations:
+            continue
+        codes = {operation.get("operationCode") for operation in operations}
+        if codes & SPEEDY_DELIVERED_CODES:
+            statuses[parcel_id] = "delivered"
+        elif codes & SPEEDY_IN_TRANSIT_CODES:
+            statuses[parcel_id] = "shipped"
+    return statuses
+
+
+def econt_statuses(shipment_numbers):
+    """{tracking_id: "shipped" | "delivered"} for one getShipmentStatuses batch."""
+    statuses = {}
+    for entry in (econt_shipment_statuses(shipment_numbers) or {}).get("shipmentStatuses") or []:
+        status = entry.get("status") or {}
+        number = str(status.get("shipmentNumber") or "")
+        if not number:
+            continue
+        events = {event.get("destinationType") for event in status.get("trackingEvents") or []}
+        if status.get("deliveryTime"):
+            statuses[number] = "delivered"
+        elif status.get("sendTime") or events & ECONT_IN_TRANSIT_EVENTS:
+            statuses[number] = "shipped"
+    return statuses
+
+
+def _fetch(task):
+    service, fetch, tracking_ids = task
+    try:
+        return service, fetch(tracking_ids), False
+    except Exception as e:
+        print(f"Tracking poll for {len(tracking_ids)} {service} parcel(s) failed:", e)
+        return service, {}, True
+
+
+def poll_tracking_statuses(max_workers=4):
+    """
+    Advance open orders to shipped/delivered from courier tracking.
+    Returns {"checked", "shipped", "delivered", "failed_batches"} counts.
+    """
+    orders = list(open_shipments().only("id", "order_id", "order_status", "shipping_service", "tracking_id"))
+    tracking_ids = {"speedy": [], "econt": []}
+    for order in orders:
+        tracking_ids[order.shipping_service].append(str(order.tracking_id))
+
+    tasks = [("speedy", speedy_statuses, chunk) for chunk in _chunks(tracking_ids["speedy"], SPEEDY_TRACK_BATCH)]
+    if getattr(settings, "ECONT_USERNAME", None):
+        tasks += [("econt", econt_statuses, chunk) for chunk in _chunks(tracking_ids["econt"], ECONT_TRACK_BATCH)]
+
+    statuses = {}
+    failed_batches = 0
+    if tasks:
+        with ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), len(tasks)))) as pool:
+            for service, batch, failed in pool.map(_fetch, tasks):
+                failed_batches += failed
+                for tracking_id, status in batch.items():
+                    statuses[(service, tracking_id)] = status
+
+    transitions = {}
+    for order in orders:
+        status = statuses.get((order.shipping_service, str(order.tracking_id)))
+        if status and STATUS_RANK[status] > STATUS_RANK[order.order_status]:
+            transitions.setdefault((order.order_status, status), []).append(order.pk)
+
+    moved = {"shipped": 0, "delivered": 0}
+    for (old, new), order_ids in transitions.items():
+        for chunk in _chunks(order_ids, UPDATE_BATCH):
+            moved[new] += _advance(chunk, old, new)
+    return {"checked": len(orders), **moved, "failed_batches": failed_batches}
+
+
+def _advance(order_ids, old, new):
+    """
+    Move the orders of `order_ids` still in `old` to `new` and queue their
+    emails. Orders changed since they were read (by an admin or a parallel
+    poll) are left alone. Returns the number moved.
+    """
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.select_for_update()
+            .filter(pk__in=order_ids, order_status=old)
+            .values_list("pk", flat=True)
+        )
+        if not order_ids:
+            return 0
+        # update() skips order_status_signal; the emails go through the queue
+        Order.objects.filter(pk__in=order_ids, order_status=old).update(order_status=new)
+        FulfilmentJob.objects.bulk_create(
+            [FulfilmentJob(order_id=order_id, kind=f"{new}_email") for order_id in order_ids],
+            ignore_conflicts=True,
+        )
+    return len(order_ids)
@@ -26,6 +26,7 @@ urlpatterns = [
     path("speedy/find-offices/", views.speedy_find_offices, name="speedy_find_offices"),
     path("speedy/quote/<order_id>/", views.speedy_quote, name="speedy_quote"),
     path("filter-products/", views.filter_products, name="filter_products"),
+    path("search/suggest/", views.search_suggest, name="search_suggest"),
     path("add-to-cart/", views.add_to_cart, name="add_to_cart"),
     path("delete-cart-item/", views.delete_cart_item, name="delete_cart_item"),
     path("stripe-payment/<order_id>/", views.stripe_payment, name="stripe_payment"),
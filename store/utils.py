@@ -2,9 +2,11 @@ from django.core.paginator import Paginator
 from django.core.cache import cache
 from django.conf import settings
 from decimal import Decimal, ROUND_FLOOR
-import requests
+from store.integrations import http_client
 import hashlib
+import json
 import time
+import uuid
 
 
 def paginate_queryset(request, queryset, per_page):
@@ -13,34 +15,150 @@ def paginate_queryset(request, queryset, per_page):
     return paginator.get_page(page_number)
 
 
+ERROR_500_HOURLY_RETENTION = 48 * 3600  # seconds
+
+
+def _error_500_hour_prefix(moment):
+    return f"errors_500:{moment.strftime('%Y%m%d%H')}"
+
+
 def increment_500_error_count(is_bot=None, ip=None):
-    # Total 500 errors
-    key_total = "custom_500_error_count"
-    cache.set(key_total, cache.get(key_total, 0) + 1, timeout=None)
-
-    if is_bot is not None and ip is not None:
-        if is_bot:
-            key = "custom_500_bot_error_count"
-            key_unique = "custom_500_bot_error_unique_ips"
-        else:
-            key = "custom_500_user_error_count"
-            key_unique = "custom_500_user_error_unique_ips"
-        cache.set(key, cache.get(key, 0) + 1, timeout=None)
-        ip_set = set(cache.get(key_unique, []))
-        ip_set.add(ip)
-        cache.set(key_unique, list(ip_set), timeout=None)
+    """
+    Record a 500 error atomically: INCR counters and PFADD unique IPs in a
+    single pipelined round trip, both all-time and in hourly buckets.
+    """
+    from django.utils import timezone
+
+    hour_prefix = _error_500_hour_prefix(timezone.localtime())
+    try:
+        redis = cache.client.get_client(write=True)
+        pipe = redis.pipeline(transaction=False)
+        pipe.incr(cache.make_key("custom_500_error_count"))
+        pipe.incr(f"{hour_prefix}:total")
+        pipe.expire(f"{hour_prefix}:total", ERROR_500_HOURLY_RETENTION)
+
+        if is_bot is not None and ip is not None:
+            kind = "bot" if is_bot else "user"
+            pipe.incr(cache.make_key(f"custom_500_{kind}_error_count"))
+            pipe.pfadd(f"custom_500_{kind}_error_ips_hll", ip)
+            pipe.incr(f"{hour_prefix}:{kind}")
+            pipe.expire(f"{hour_prefix}:{kind}", ERROR_500_HOURLY_RETENTION)
+            pipe.pfadd(f"{hour_prefix}:{kind}_ips", ip)
+            pipe.expire(f"{hour_prefix}:{kind}_ips", ERROR_500_HOURLY_RETENTION)
+        pipe.execute()
+    except Exception:
+        # Never let telemetry turn an error page into a second error
+        pass
+
+
+def get_500_error_hourly_stats(hours=24):
+    """Return per-hour 500 error counts for the last `hours` hours, newest first."""
+    from datetime import timedelta
+    from django.utils import timezone
+
+    now = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+    moments = [now - timedelta(hours=offset) for offset in range(hours)]
+    redis = cache.client.get_client(write=True)
+    pipe = redis.pipeline(transaction=False)
+    for moment in moments:
+        prefix = _error_500_hour_prefix(moment)
+        pipe.get(f"{prefix}:total")
+        pipe.get(f"{prefix}:user")
+        pipe.pfcount(f"{prefix}:user_ips")
+        pipe.get(f"{prefix}:bot")
+        pipe.pfcount(f"{prefix}:bot_ips")
+    results = iter(pipe.execute())
+    rows = []
+    for moment in moments:
+        row = {"hour": moment}
+        for field in ("total", "user", "user_unique", "bot", "bot_unique"):
+            row[field] = int(next(results) or 0)
+        rows.append(row)
+    return rows
 
 
 def get_500_error_stats():
+    try:
+        redis = cache.client.get_client(write=True)
+        user_unique = redis.pfcount("custom_500_user_error_ips_hll")
+        bot_unique = redis.pfcount("custom_500_bot_error_ips_hll")
+        hourly = get_500_error_hourly_stats()
+    except Exception:
+        user_unique = bot_unique = 0
+        hourly = []
     return {
         "total": cache.get("custom_500_error_count", 0),
         "user": cache.get("custom_500_user_error_count", 0),
         "bot": cache.get("custom_500_bot_error_count", 0),
-        "user_unique": len(cache.get("custom_500_user_error_unique_ips", [])),
-        "bot_unique": len(cache.get("custom_500_bot_error_unique_ips", [])),
+        "user_unique": user_unique,
+        "bot_unique": bot_unique,
+        "hourly": hourly,
+        # hourly always has a row per hour; this tells the page whether any counted
+        "hourly_has_errors": any(row["total"] for row in hourly),
     }
 
 
+# --- Header cart/wishlist counters ---
+# Small per-cart / per-user Redis hashes so navigation_context does not run
+# COUNT queries on every render. Views write fresh values after they change
+# a cart or wishlist; model signals drop stale fields as a safety net.
+NAV_COUNTS_TIMEOUT = 6 * 3600  # seconds
+
+
+def _nav_counts_key(cart_id=None, user_id=None):
+    if user_id:
+        return f"nav_counts:user:{user_id}"
+    return f"nav_counts:cart:{cart_id}"
+
+
+def get_nav_counts(cart_id=None, user_id=None):
+    """
+    Return {"cart": int|None, "wishlist": int|None} from Redis in one round trip.
+    None means the value is not cached and must be counted by the caller.
+    """
+    counts = {"cart": None, "wishlist": None}
+    if not cart_id and not user_id:
+        return counts
+    try:
+        redis = cache.client.get_client(write=True)
+        pipe = redis.pipeline(transaction=False)
+        pipe.hget(_nav_counts_key(cart_id=cart_id), "cart")
+        pipe.hget(_nav_counts_key(cart_id=cart_id, user_id=user_id), "wishlist")
+        cart_count, wishlist_count = pipe.execute()
+    except Exception:
+        return counts
+    if cart_id and cart_count is not None:
+        counts["cart"] = int(cart_count)
+    if wishlist_count is not None:
+        counts["wishlist"] = int(wishlist_count)
+    return counts
+
+
+def set_nav_count(field, count, cart_id=None, user_id=None):
+    """Store a header counter ("cart" or "wishlist") and return it unchanged."""
+    if cart_id or user_id:
+        key = _nav_counts_key(cart_id=cart_id, user_id=user_id)
+        try:
+            redis = cache.client.get_client(write=True)
+            pipe = redis.pipeline(transaction=False)
+            pipe.hset(key, field, int(count))
+            pipe.expire(key, NAV_COUNTS_TIMEOUT)
+            pipe.execute()
+        except Exception:
+            pass
+    return count
+
+
+def invalidate_nav_count(field, cart_id=None, user_id=None):
+    if not cart_id and not user_id:
+        return
+    try:
+        redis = cache.client.get_client(write=True)
+        redis.hdel(_nav_counts_key(cart_id=cart_id, user_id=user_id), field)
+    except Exception:
+        pass
+
+
 def floor_to_cent(amount):
     """Round down to 2 decimals (e.g., 9.995 -> 9.99). Returns Decimal."""
     try:
@@ -97,11 +215,17 @@ def recalc_cart_group_promos(cart_qs):
     """
     Recalculate sub_total for all Cart items in the queryset by grouping items
     per product and allocating paid units across variants (sizes/models).
+
+    New sub_totals are computed in memory and only changed rows are written,
+    with a single bulk_update. Returns a summary of the cart so callers don't
+    need to query it again:
+    {"items", "total_cart_items", "cart_sub_total", "promo_free_units_by_item"}.
     """
+    items = list(cart_qs.select_related("product"))
     try:
         # Group items by product id
         by_product = {}
-        for ci in cart_qs.select_related("product"):  # ensure product present
+        for ci in items:
             key = getattr(ci.product, "id", None)
             if key is None:
                 # Skip lines without product
@@ -109,6 +233,7 @@ def recalc_cart_group_promos(cart_qs):
             by_product.setdefault(key, {"product": ci.product, "lines": []})
             by_product[key]["lines"].append(ci)
 
+        changed = []
         for _, group in by_product.items():
             product = group["product"]
             lines = group["lines"]
@@ -120,11 +245,34 @@ def recalc_cart_group_promos(cart_qs):
             for line in lines:
                 paid_units = int(allocation.get(line.id, getattr(line, "qty", 0) or 0))
                 unit_price = Decimal(str(getattr(line, "price", 0) or 0))
-                line.sub_total = floor_to_cent(unit_price * Decimal(paid_units))
-                line.save(update_fields=["sub_total"])
+                sub_total = floor_to_cent(unit_price * Decimal(paid_units))
+                if line.sub_total is None or Decimal(str(line.sub_total)) != sub_total:
+                    line.sub_total = sub_total
+                    changed.append(line)
+        if changed:
+            type(changed[0]).objects.bulk_update(changed, ["sub_total"])
     except Exception:
         # Best-effort only; don't crash
-        return
+        pass
+    return summarize_cart_items(items)
+
+
+def summarize_cart_items(items):
+    """Totals and per-line promo info for already loaded Cart items."""
+    cart_sub_total = Decimal("0.00")
+    promo_map = {}
+    for ci in items:
+        cart_sub_total += Decimal(str(ci.sub_total or 0))
+        try:
+            promo_map[str(ci.id)] = int(getattr(ci, "promo_free_units", 0) or 0)
+        except Exception:
+            promo_map[str(ci.id)] = 0
+    return {
+        "items": items,
+        "total_cart_items": len(items),
+        "cart_sub_total": cart_sub_total,
+        "promo_free_units_by_item": promo_map,
+    }
 
 
 # --- Speedy v1 JSON-credential endpoints ---
@@ -136,7 +284,7 @@ def speedy_v1_find_sites(name: str, country_id: int = 100):
         "countryId": country_id,
         "name": name,
     }
-    r = requests.post(url, json=payload, timeout=12, headers={"Content-Type": "application/json", "Accept": "application/json"})
+    r = http_client("speedy").post(url, json=payload, headers={"Content-Type": "application/json", "Accept": "application/json"})
     r.raise_for_status()
     return r.json()
 
@@ -148,11 +296,36 @@ def speedy_v1_find_offices(site_id: int):
         "password": settings.SPEEDY_PASSWORD,
         "siteId": int(site_id),
     }
-    r = requests.post(url, json=payload, timeout=12, headers={"Content-Type": "application/json", "Accept": "application/json"})
+    r = http_client("speedy").post(url, json=payload, headers={"Content-Type": "application/json", "Accept": "application/json"})
+    r.raise_for_status()
+    return r.json()
+
+
+def speedy_v1_all_offices(country_id: int = 100):
+    url = getattr(settings, "SPEEDY_API_BASE", "https://api.speedy.bg") + "/v1/location/office"
+    payload = {
+        "userName": settings.SPEEDY_USERNAME,
+        "password": settings.SPEEDY_PASSWORD,
+        "countryId": int(country_id),
+    }
+    r = http_client("speedy").post(url, json=payload, timeout=(3.05, 60), headers={"Content-Type": "application/json", "Accept": "application/json"})
     r.raise_for_status()
     return r.json()
 
 
+def speedy_v1_sites_csv(country_id: int = 100):
+    """Full site nomenclature for a country as CSV text (header row included)."""
+    url = getattr(settings, "SPEEDY_API_BASE", "https://api.speedy.bg") + f"/v1/location/site/csv/{int(country_id)}"
+    payload = {
+        "userName": settings.SPEEDY_USERNAME,
+        "password": settings.SPEEDY_PASSWORD,
+    }
+    r = http_client("speedy").post(url, json=payload, timeout=(3.05, 60), headers={"Content-Type": "application/json", "Accept": "text/csv"})
+    r.raise_for_status()
+    r.encoding = r.encoding or "utf-8"
+    return r.text
+
+
 def speedy_v1_calculate(calculation_request: dict):
     url = getattr(settings, "SPEEDY_API_BASE", "https://api.speedy.bg") + "/v1/calculate"
     # v1/calculate expects a flat payload (not nested under calculationRequest)
@@ -227,7 +400,7 @@ def speedy_v1_calculate(calculation_request: dict):
     if sender_in:
         payload["sender"] = sender_in
 
-    r = requests.post(url, json=payload, timeout=15, headers={"Content-Type": "application/json", "Accept": "application/json"})
+    r = http_client("speedy").post(url, json=payload, headers={"Content-Type": "application/json", "Accept": "application/json"})
     r.raise_for_status()
     return r.json()
 
@@ -240,7 +413,40 @@ def speedy_v1_create_shipment(shipment_request: dict):
         # v1/shipment expects top-level fields, not nested under 'shipment'
         **shipment_request,
     }
-    r = requests.post(url, json=payload, timeout=15, headers={"Content-Type": "application/json", "Accept": "application/json"})
+    # Not idempotent: only retried if the connection was never established
+    r = http_client("speedy").post(
+        url, json=payload, idempotent=False, headers={"Content-Type": "application/json", "Accept": "application/json"}
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+SPEEDY_TRACK_BATCH = 10  # parcels per /v1/track request
+ECONT_TRACK_BATCH = 100  # shipment numbers per getShipmentStatuses request
+
+
+def speedy_v1_track(parcel_ids):
+    """Tracking operations for up to SPEEDY_TRACK_BATCH parcels in one call."""
+    url = getattr(settings, "SPEEDY_API_BASE", "https://api.speedy.bg") + "/v1/track"
+    payload = {
+        "userName": settings.SPEEDY_USERNAME,
+        "password": settings.SPEEDY_PASSWORD,
+        "language": "BG",
+        "parcels": [{"id": str(parcel_id)} for parcel_id in parcel_ids],
+    }
+    r = http_client("speedy").post(url, json=payload, headers={"Content-Type": "application/json", "Accept": "application/json"})
+    r.raise_for_status()
+    return r.json()
+
+
+def econt_shipment_statuses(shipment_numbers):
+    """Statuses for up to ECONT_TRACK_BATCH shipment numbers in one call."""
+    r = http_client("econt").post(
+        settings.ECONT_TRACKING_ENDPOINT,
+        json={"shipmentNumbers": [str(number) for number in shipment_numbers]},
+        auth=(settings.ECONT_USERNAME, settings.ECONT_PASSWORD),
+        headers={"Content-Type": "application/json", "Accept": "application/json"},
+    )
     r.raise_for_status()
     return r.json()
 
@@ -253,97 +459,235 @@ def _sha256_lower(value: str) -> str:
         return ""
 
 
-def send_meta_purchase_event(order, request=None):
-    """
-    Send a server-side Purchase event to Meta Conversions API.
-    Uses FACEBOOK_PIXEL_ID and FACEBOOK_CAPI_ACCESS_TOKEN from settings.
-    If request is provided, include client_user_agent and client_ip_address.
-    Deduplicate by using order.payment_id as event_id if available, else order.order_id.
-    """
-    pixel_id = getattr(settings, "FACEBOOK_PIXEL_ID", None)
-    token = getattr(settings, "FACEBOOK_CAPI_ACCESS_TOKEN", None)
-    if not pixel_id or not token:
-        return None
+META_GRAPH_URL = "{base}/v20.0/{pixel_id}/events"
+META_EVENT_BUFFER_KEY = "meta_capi:events"
+META_EVENT_MAX_BATCH = 1000  # Graph API limit per request
+META_EVENT_MAX_ATTEMPTS = 5
+META_BOT_SIGNATURES = ("bot", "crawl", "spider", "slurp")
+
+
+def meta_capi_enabled():
+    return bool(getattr(settings, "FACEBOOK_PIXEL_ID", None) and getattr(settings, "FACEBOOK_CAPI_ACCESS_TOKEN", None))
 
+
+def meta_client_data(request):
+    """Serializable subset of the request needed to build a CAPI event later."""
+    if request is None:
+        return {}
+    xff = request.META.get("HTTP_X_FORWARDED_FOR")
+    data = {
+        "client_user_agent": request.META.get("HTTP_USER_AGENT", ""),
+        "client_ip_address": xff.split(",")[0].strip() if xff else request.META.get("REMOTE_ADDR", ""),
+    }
     try:
-        url = f"https://graph.facebook.com/v20.0/{pixel_id}/events"
-        event_id = (getattr(order, "payment_id", None) or order.order_id) and str(getattr(order, "payment_id", None) or order.order_id)
+        data["event_source_url"] = request.build_absolute_uri()
+    except Exception:
+        pass
+    test_code = request.GET.get("fb_test") or request.POST.get("fb_test")
+    if test_code:
+        data["test_event_code"] = test_code
+    return data
+
+
+def _meta_event(event_name, event_id, client_data, custom_data, email=None):
+    user_data = {"em": [_sha256_lower(email)] if email else []}
+    for key in ("client_user_agent", "client_ip_address"):
+        if client_data.get(key):
+            user_data[key] = client_data[key]
+    event = {
+        "event_name": event_name,
+        "event_time": int(time.time()),
+        "action_source": "website",
+        "event_id": event_id,
+        "user_data": user_data,
+        "custom_data": custom_data,
+    }
+    if client_data.get("event_source_url"):
+        event["event_source_url"] = client_data["event_source_url"]
+    return event
+
+
+def meta_test_code(client_data):
+    return client_data.get("test_event_code") or getattr(settings, "FACEBOOK_CAPI_TEST_CODE", None)
+
+
+def meta_purchase_event_id(order):
+    # Same id the browser pixel sends as eventID, so Meta deduplicates the pair
+    return str(getattr(order, "payment_id", None) or order.order_id)
 
-        # Build user_data
-        email = getattr(order.address, "email", None) or (getattr(order.customer, "email", None) if getattr(order, "customer", None) else None)
-        user_data = {
-            "em": [_sha256_lower(email)] if email else [],
-        }
-        if request is not None:
-            user_data["client_user_agent"] = request.META.get("HTTP_USER_AGENT", "")
-            # Prefer XFF if present
-            xff = request.META.get("HTTP_X_FORWARDED_FOR")
-            client_ip = xff.split(",")[0].strip() if xff else request.META.get("REMOTE_ADDR", "")
-            user_data["client_ip_address"] = client_ip
-
-        # Build custom_data
-        try:
-            order_items = list(order.order_items.all())
-        except Exception:
-            order_items = []
-        contents = []
-        content_ids = []
-        for it in order_items:
-            sku = getattr(it.product, "sku", None) or str(it.product_id)
-            content_ids.append(str(sku))
-            try:
-                price_float = float(it.price)
-            except Exception:
-                price_float = None
-            contents.append({
-                "id": str(sku),
-                "quantity": int(getattr(it, "qty", 1) or 1),
-                **({"item_price": price_float} if price_float is not None else {}),
-            })
 
+def build_meta_purchase_event(order, client_data=None):
+    """Purchase event for `order`; client_data comes from meta_client_data()."""
+    client_data = client_data or {}
+    email = getattr(order.address, "email", None) or (getattr(order.customer, "email", None) if getattr(order, "customer", None) else None)
+
+    try:
+        order_items = list(order.order_items.all())
+    except Exception:
+        order_items = []
+    contents = []
+    content_ids = []
+    for it in order_items:
+        sku = getattr(it.product, "sku", None) or str(it.product_id)
+        content_ids.append(str(sku))
         try:
-            total_value = float(order.total)
+            price_float = float(it.price)
         except Exception:
-            total_value = None
-
-        custom_data = {
-            "currency": "BGN",
-            **({"value": total_value} if total_value is not None else {}),
-            **({"content_ids": content_ids} if content_ids else {}),
-            **({"contents": contents} if contents else {}),
-            "content_type": "product",
-            "order_id": str(order.order_id),
-        }
+            price_float = None
+        contents.append({
+            "id": str(sku),
+            "quantity": int(getattr(it, "qty", 1) or 1),
+            **({"item_price": price_float} if price_float is not None else {}),
+        })
 
-        payload = {
-            "data": [
-                {
-                    "event_name": "Purchase",
-                    "event_time": int(time.time()),
-                    "action_source": "website",
-                    "event_id": event_id,
-                    "user_data": user_data,
-                    "custom_data": custom_data,
-                }
-            ]
-        }
+    try:
+        total_value = float(order.total)
+    except Exception:
+        total_value = None
+
+    custom_data = {
+        "currency": "BGN",
+        **({"value": total_value} if total_value is not None else {}),
+        **({"content_ids": content_ids} if content_ids else {}),
+        **({"contents": contents} if contents else {}),
+        "content_type": "product",
+        "order_id": str(order.order_id),
+    }
+    return _meta_event("Purchase", meta_purchase_event_id(order), client_data, custom_data, email=email)
 
-        if request is not None:
-            try:
-                payload["data"][0]["event_source_url"] = request.build_absolute_uri()
-            except Exception:
-                pass
-
-        # Test Events support via env or query param
-        test_code = getattr(settings, "FACEBOOK_CAPI_TEST_CODE", None)
-        if request is not None:
-            override = request.GET.get("fb_test") or request.POST.get("fb_test")
-            if override:
-                test_code = override
+
+def send_meta_events(events, test_code=None):
+    """POST up to META_EVENT_MAX_BATCH events in one Graph API call; returns the JSON reply."""
+    pixel_id = getattr(settings, "FACEBOOK_PIXEL_ID", None)
+    token = getattr(settings, "FACEBOOK_CAPI_ACCESS_TOKEN", None)
+    if not pixel_id or not token or not events:
+        return None
+    try:
+        payload = {"data": list(events)[:META_EVENT_MAX_BATCH]}
         if test_code:
             payload["test_event_code"] = str(test_code)
-
-        resp = requests.post(url, params={"access_token": token}, json=payload, timeout=8)
+        # Retries are safe: Meta deduplicates on event_id
+        resp = http_client("meta").post(
+            META_GRAPH_URL.format(base=getattr(settings, "META_GRAPH_BASE", "https://graph.facebook.com"), pixel_id=pixel_id),
+            params={"access_token": token},
+            json=payload,
+        )
         return resp.json() if hasattr(resp, "json") else None
     except Exception:
         return None
+
+
+def send_meta_purchase_event(order, request=None, client_data=None):
+    """
+    Send a server-side Purchase event to Meta Conversions API right away.
+    Checkout uses buffer_meta_event() via the fulfilment queue instead.
+    """
+    if not meta_capi_enabled():
+        return None
+    if request is not None:
+        client_data = meta_client_data(request)
+    client_data = client_data or {}
+    try:
+        event = build_meta_purchase_event(order, client_data)
+    except Exception:
+        return None
+    return send_meta_events([event], test_code=meta_test_code(client_data))
+
+
+def buffer_meta_event(event, test_code=None):
+    """
+    Append an event to the Redis buffer drained by the flush_meta_events
+    command. Returns False when CAPI is disabled or Redis is unavailable.
+    """
+    if not meta_capi_enabled():
+        return False
+    entry = {"event": event, "test_code": test_code or None, "queued_at": time.time(), "attempts": 0}
+    try:
+        redis = cache.client.get_client(write=True)
+        redis.rpush(META_EVENT_BUFFER_KEY, json.dumps(entry))
+        return True
+    except Exception:
+        return False
+
+
+def track_meta_browser_event(request, event_name, custom_data):
+    """
+    Buffer a funnel event (AddToCart, ViewContent) for the current request and
+    return its event_id, which the page passes to fbq as eventID for dedup.
+    """
+    if not meta_capi_enabled():
+        return None
+    user_agent = request.META.get("HTTP_USER_AGENT", "").lower()
+    if any(sig in user_agent for sig in META_BOT_SIGNATURES):
+        return None
+    client_data = meta_client_data(request)
+    user = getattr(request, "user", None)
+    email = getattr(user, "email", None) if user is not None and user.is_authenticated else None
+    event_id = uuid.uuid4().hex
+    event = _meta_event(event_name, event_id, client_data, custom_data, email=email)
+    if not buffer_meta_event(event, test_code=meta_test_code(client_data)):
+        return None
+    return event_id
+
+
+def meta_events_due(batch_size=META_EVENT_MAX_BATCH, max_wait=10):
+    """True when a full batch is waiting or the oldest event is older than max_wait seconds."""
+    try:
+        redis = cache.client.get_client(write=True)
+        pipe = redis.pipeline(transaction=False)
+        pipe.llen(META_EVENT_BUFFER_KEY)
+        pipe.lindex(META_EVENT_BUFFER_KEY, 0)
+        length, oldest = pipe.execute()
+        if not length:
+            return False
+        if length >= batch_size:
+            return True
+        return time.time() - json.loads(oldest).get("queued_at", 0) >= max_wait
+    except Exception:
+        return False
+
+
+def flush_meta_events(batch_size=META_EVENT_MAX_BATCH):
+    """
+    Send up to batch_size buffered events, one Graph API call per test code.
+    Failed events go back to the buffer until META_EVENT_MAX_ATTEMPTS.
+    Returns (sent, failed) counts.
+    """
+    batch_size = max(1, min(int(batch_size), META_EVENT_MAX_BATCH))
+    try:
+        redis = cache.client.get_client(write=True)
+        pipe = redis.pipeline(transaction=True)
+        pipe.lrange(META_EVENT_BUFFER_KEY, 0, batch_size - 1)
+        pipe.ltrim(META_EVENT_BUFFER_KEY, batch_size, -1)
+        raw_entries, _ = pipe.execute()
+    except Exception as e:
+        print("Meta CAPI buffer unavailable:", e)
+        return 0, 0
+
+    groups = {}
+    for raw in raw_entries:
+        try:
+            entry = json.loads(raw)
+        except Exception:
+            continue
+        groups.setdefault(entry.get("test_code"), []).append(entry)
+
+    sent = failed = 0
+    retry = []
+    for test_code, entries in groups.items():
+        result = send_meta_events([entry["event"] for entry in entries], test_code=test_code)
+        if isinstance(result, dict) and result.get("events_received") is not None and not result.get("error"):
+            sent += len(entries)
+            continue
+        print(f"Meta CAPI batch of {len(entries)} event(s) failed:", result)
+        failed += len(entries)
+        for entry in entries:
+            entry["attempts"] = int(entry.get("attempts") or 0) + 1
+            if entry["attempts"] < META_EVENT_MAX_ATTEMPTS:
+                retry.append(json.dumps(entry))
+    if retry:
+        try:
+            redis.rpush(META_EVENT_BUFFER_KEY, *retry)
+        except Exception:
+            pass
+    return sent, failed
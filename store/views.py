@@ -4,14 +4,14 @@ from django.shortcuts import redirect, render
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.urls import reverse
-from django.template.loader import render_to_string
+from django.template.loader import render_to_string, get_template
 from datetime import date as dt_date, datetime as dt_datetime, timedelta as dt_timedelta
 import calendar as pycal
 from decimal import Decimal, ROUND_HALF_UP
-from .models import Category, Product, BandOfTheWeek, CategoryLink, SpinEntry, Coupon, SpinPrize, SpinMilestone, SpinMilestoneAward
+from .models import Category, CategoryClosure, Product, BandOfTheWeek, CategoryLink, SpinEntry, Coupon, SpinPrize, SpinMilestone, SpinMilestoneAward
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 import random
@@ -21,21 +21,28 @@ from store.utils import (
     floor_to_cent,
     speedy_v1_find_sites,
     speedy_v1_find_offices,
-    speedy_v1_calculate,
     speedy_v1_create_shipment,
-    send_meta_purchase_event,
     recalc_cart_group_promos,
 )
 from store import models as store_models
 from customer import models as customer_models
 from userauths import models as userauths_models
 from customer.utils import get_user_wishlist_products
+from store.context_processors import CATEGORY_TREE_VERSION_KEY
 from store.emails import send_order_notification_email
-from django.db.models import Q
-from store.utils import increment_500_error_count
+from store.utils import increment_500_error_count, set_nav_count, track_meta_browser_event
+from store.fulfilment import enqueue_order_fulfilment
+from store.integrations import http_client
+from store.search import get_suggest_index, search_products, search_terms
+from store.facets import bitmap_of, get_facet_index
+from store.listing import (
+    DEFAULT_SORT, CursorPage, cached_count, count_signature, keyset_page, listing_page, listing_sort,
+)
+from store.speedy import (
+    get_catalogue_index, get_speedy_quote, order_quote_service_id, quote_destination, remember_order_quote,
+)
 from urllib.parse import urlencode
 import json
-import requests
 from django.views.decorators.http import require_POST
 from django.http import HttpResponse
 from django.core.validators import validate_email
@@ -132,7 +139,7 @@ def _generate_valentine_hearts(count: int):
         })
     return hearts
 
-def send_order_to_econt(order):
+def send_order_to_econt(order, save=True):
     url = settings.ECONT_UPDATE_ORDER_ENDPOINT
     headers = {
         "Content-Type": "application/json",
@@ -170,7 +177,7 @@ def send_order_to_econt(order):
         },
         "items": items,
     }
-    response = requests.post(url, headers=headers, json=data, timeout=10)
+    response = http_client("econt").post(url, headers=headers, json=data)
     if response.status_code == 200:
         try:
             resp_json = response.json()
@@ -181,7 +188,8 @@ def send_order_to_econt(order):
         # Now, call the createAWB endpoint to generate the AWB/label
         create_awb_url = url.replace("OrdersService.updateOrder", "OrdersService.createAWB")
         try:
-            awb_response = requests.post(create_awb_url, headers=headers, json=data, timeout=10)
+            # Not idempotent: only retried if the connection was never established
+            awb_response = http_client("econt").post(create_awb_url, headers=headers, json=data, idempotent=False)
             if awb_response.status_code == 200:
                 try:
                     awb_json = awb_response.json()
@@ -191,7 +199,8 @@ def send_order_to_econt(order):
                 shipment_number = awb_json.get("shipmentNumber")
                 if shipment_number:
                     order.tracking_id = shipment_number
-                    order.save(update_fields=["tracking_id"])
+                    if save:
+                        order.save(update_fields=["tracking_id"])
                 else:
                     print("ECONT createAWB: success status but missing shipmentNumber. Payload:", str(awb_json)[:500])
                 return awb_json
@@ -205,7 +214,7 @@ def send_order_to_econt(order):
         return None
 
 
-def send_order_to_speedy(order):
+def send_order_to_speedy(order, save=True):
     address = order.address
     total_weight = 0.0
     for item in order.order_items.all():
@@ -251,48 +260,36 @@ def send_order_to_speedy(order):
         if addr_lines:
             recipient_for_calc["address"] = addr_lines
 
-    # Try to calculate to obtain serviceId
+    custom_contents = cached_opts.get("speedy_contents")
+    # Derive parcels from cart: quantity * 0.1 kg per item, count fixed to 1
+    parcels = [{"weight": max(0.01, round(total_weight, 3) or 0.1)}]
+
+    # Determine payer (free shipping -> SENDER pays, else COD->RECIPIENT, card->SENDER)
     try:
-        custom_contents = cached_opts.get("speedy_contents")
-        # Derive parcels from cart: quantity * 0.1 kg per item, count fixed to 1
-        parcels = [{"weight": max(0.01, round(total_weight, 3) or 0.1)}]
+        free_shipping = (Decimal(str(order.shipping or 0)) == Decimal("0.00"))
+    except Exception:
+        free_shipping = False
+    is_cod = (order.payment_method == "cash_on_delivery")
+    payer_code = "SENDER" if free_shipping else ("RECIPIENT" if is_cod else "SENDER")
 
-        # Determine payer (free shipping -> SENDER pays, else COD->RECIPIENT, card->SENDER)
+    # Reuse the serviceId quoted at checkout; otherwise ask the (cached) calculator
+    destination = quote_destination(
+        office_id=pickup_office_id,
+        site_id=site_id_cached,
+        site_name=getattr(address, "city", "") or "",
+    )
+    service_id = order_quote_service_id(order.order_id, destination)
+    if not service_id:
+        try:
+            quote, _, _ = get_speedy_quote(recipient_for_calc, destination, total_weight, payer=payer_code)
+            service_id = (quote or {}).get("serviceId")
+        except Exception as e:
+            print("Speedy calc exception:", e)
+    if not service_id:
         try:
-            free_shipping = (Decimal(str(order.shipping or 0)) == Decimal("0.00"))
+            service_id = int(getattr(settings, "SPEEDY_DEFAULT_SERVICE_ID", None) or 0) or None
         except Exception:
-            free_shipping = False
-        is_cod = (order.payment_method == "cash_on_delivery")
-        payer_code = "SENDER" if free_shipping else ("RECIPIENT" if is_cod else "SENDER")
-
-        calc_req = {
-            "payer": payer_code,
-            "documents": False,
-            "palletized": False,
-            "parcels": parcels or [{"weight": round(total_weight, 3) or 0.1}],
-            "recipient": recipient_for_calc,
-        }
-        if getattr(settings, "SPEEDY_DROPOFF_OFFICE_ID", None):
-            calc_req["sender"] = {"dropoffOfficeId": int(settings.SPEEDY_DROPOFF_OFFICE_ID)}
-        calc_resp = speedy_v1_calculate(calc_req)
-        # Extract serviceId or fallback to default
-        if isinstance(calc_resp, dict):
-            calcs = calc_resp.get("calculations") or calc_resp.get("services") or []
-            if calcs:
-                first = calcs[0]
-                service_id = first.get("serviceId") or (first.get("service") or {}).get("id") or first.get("id")
-        if not service_id:
-            try:
-                service_id = int(getattr(settings, "SPEEDY_DEFAULT_SERVICE_ID", None) or 0) or None
-            except Exception:
-                service_id = getattr(settings, "SPEEDY_DEFAULT_SERVICE_ID", None)
-    except Exception as e:
-        print("Speedy calc exception:", e)
-        if not service_id:
-            try:
-                service_id = int(getattr(settings, "SPEEDY_DEFAULT_SERVICE_ID", None) or 0) or None
-            except Exception:
-                service_id = getattr(settings, "SPEEDY_DEFAULT_SERVICE_ID", None)
+            service_id = getattr(settings, "SPEEDY_DEFAULT_SERVICE_ID", None)
 
     # Build payload per example structure
     is_cod = (order.payment_method == "cash_on_delivery")
@@ -441,7 +438,8 @@ def send_order_to_speedy(order):
         if shipment_number:
             order.tracking_id = shipment_number
             order.shipping_service = "speedy"
-            order.save(update_fields=["tracking_id", "shipping_service"])
+            if save:
+                order.save(update_fields=["tracking_id", "shipping_service"])
         else:
             print("Speedy create shipment response:", resp_json)
         return resp_json
@@ -450,19 +448,24 @@ def send_order_to_speedy(order):
         return None
 
 
-def _send_shipment(order):
+def _send_shipment(order, save=True):
+    """
+    Create the courier label for `order`. With save=False the tracking_id and
+    shipping_service are only set on the instance (bulk callers write them back).
+    """
     method = (getattr(order.address, "delivery_method", "") or "").split("_", 1)[0]
     if method == "speedy":
         try:
-            send_order_to_speedy(order)
+            send_order_to_speedy(order, save=save)
         except Exception:
             pass
     else:
         try:
-            econt_response = send_order_to_econt(order)
+            econt_response = send_order_to_econt(order, save=save)
             if econt_response:
                 order.shipping_service = "econt"
-                order.save(update_fields=["shipping_service"])
+                if save:
+                    order.save(update_fields=["shipping_service"])
         except Exception:
             pass
 
@@ -610,24 +613,23 @@ def save_speedy_address(request, order_id):
     return JsonResponse({"success": False, "message": "Invalid request"})
 
 
-def apply_coupon_discount(order):
+def apply_coupon_discount(order, update_fields=None):
     """
     Helper to recalculate coupon discount, saved, and total for an order.
     Also updates order item prices.
     """
-    coupons = order.coupons.all()
-    shipping = Decimal(str(order.shipping or 0))
-    if coupons.exists():
-        coupon = coupons.first()
-        total_discount = round2(order.sub_total * coupon.discount / 100)
-        order.saved = round2(total_discount)
-        order.total = round2(order.sub_total + shipping - total_discount)
-        apply_item_discounts(order, coupon)
-    else:
-        order.saved = round2(0)
-        order.total = round2(order.sub_total + shipping)
-        apply_item_discounts(order, None)
-    order.save()
+    with transaction.atomic():
+        coupon = order.coupons.first()
+        shipping = Decimal(str(order.shipping or 0))
+        if coupon:
+            total_discount = round2(order.sub_total * coupon.discount / 100)
+            order.saved = round2(total_discount)
+            order.total = round2(order.sub_total + shipping - total_discount)
+        else:
+            order.saved = round2(0)
+            order.total = round2(order.sub_total + shipping)
+        _reprice_order_items(order, coupon)
+        order.save(update_fields=update_fields)
 
 
 def apply_item_discounts(order, coupon=None):
@@ -635,25 +637,29 @@ def apply_item_discounts(order, coupon=None):
     Apply coupon discounts to each order item if coupon is provided.
     """
     if not coupon:
-        coupons = order.coupons.all()
-        coupon = coupons.first() if coupons.exists() else None
-    for item in order.order_items.all():
+        coupon = order.coupons.first()
+    with transaction.atomic():
+        return _reprice_order_items(order, coupon)
+
+
+def _reprice_order_items(order, coupon):
+    """
+    Re-price all order lines in memory and persist the changed ones with a
+    single bulk_update. Items and SKU matrices are loaded in a fixed number of
+    queries regardless of the number of lines.
+    """
+    items = list(order.order_items.select_related("product"))
+    matrices = store_models.ProductItem.get_matrices([item.product_id for item in items])
+    discount = Decimal(str(coupon.discount)) / Decimal("100") if coupon else None
+
+    changed = []
+    for item in items:
         # Compute base price from the specific SKU (product item) if possible
         try:
-            sku_qs = store_models.ProductItem.objects.filter(product=item.product)
-            if item.size:
-                sku_qs = sku_qs.filter(size__name=item.size)
-            else:
-                sku_qs = sku_qs.filter(size__isnull=True)
-            if item.model:
-                sku_qs = sku_qs.filter(device_models__name=item.model)
-            sku = sku_qs.first()
+            sku_matrix = matrices[item.product_id]
+            sku = sku_matrix.find(item.size, item.model, size_required=True)
+            base_price = Decimal(str(sku_matrix.price_for(item.product, sku) or 0))
         except Exception:
-            sku = None
-
-        if sku:
-            base_price = Decimal(str(sku.effective_price or 0))
-        else:
             base_price = Decimal(str(item.product.effective_price or 0))
         # Determine chargeable (paid) units from current line allocation (not recomputed)
         try:
@@ -661,15 +667,19 @@ def apply_item_discounts(order, coupon=None):
         except Exception:
             paid_units = item.qty
 
-        if coupon:
-            discount = Decimal(str(coupon.discount)) / Decimal("100")
-            discounted_price = round2(base_price * (Decimal("1") - discount))
-            item.price = discounted_price
-            item.sub_total = round2(discounted_price * paid_units)
+        if discount is not None:
+            price = round2(base_price * (Decimal("1") - discount))
         else:
-            item.price = base_price
-            item.sub_total = round2(base_price * paid_units)
-        item.save()
+            price = base_price
+        sub_total = round2(price * paid_units)
+        if item.price != price or item.sub_total != sub_total:
+            item.price = price
+            item.sub_total = sub_total
+            changed.append(item)
+
+    if changed:
+        store_models.OrderItem.objects.bulk_update(changed, ["price", "sub_total"])
+    return items
 
 
 @csrf_exempt
@@ -677,6 +687,9 @@ def speedy_find_sites(request):
     q = request.GET.get("q") or request.POST.get("q")
     if not q:
         return JsonResponse({"sites": []})
+    index = get_catalogue_index()
+    if index.has_sites:
+        return JsonResponse({"sites": index.find_sites(q)})
     try:
         data = speedy_v1_find_sites(q)
         return JsonResponse(data)
@@ -689,6 +702,9 @@ def speedy_find_offices(request):
     site_id = request.GET.get("site_id") or request.POST.get("site_id")
     if not site_id:
         return JsonResponse({"offices": []})
+    index = get_catalogue_index()
+    if str(site_id).isdigit() and int(site_id) in index.sites:
+        return JsonResponse({"offices": index.offices_for_site(int(site_id))})
     try:
         data = speedy_v1_find_offices(int(site_id))
         return JsonResponse(data)
@@ -741,59 +757,31 @@ def speedy_quote(request, order_id):
                 total_weight += 0.1 * float(item.qty)
             except Exception:
                 continue
-        parcels = [{"weight": max(0.01, round(total_weight, 3) or 0.1)}]
-
-        calc_request = {
-            "payer": "RECIPIENT",
-            "documents": False,
-            "palletized": False,
-            "parcels": parcels,
-            "recipient": recipient_party,
-        }
-        if getattr(settings, "SPEEDY_DROPOFF_OFFICE_ID", None):
-            calc_request["sender"] = {"dropoffOfficeId": int(settings.SPEEDY_DROPOFF_OFFICE_ID)}
+
         # Include COD in quote when payment method implies COD
         is_cod = (request.GET.get("payment") == "cod") or (order.payment_method == "cash_on_delivery")
-        # Add autoAdjustPickupDate so Speedy quotes next valid pickup even when office is closed
-        service_block = {"autoAdjustPickupDate": True}
+        cod_amount = None
         if is_cod:
             # Merchandise-only COD amount (exclude shipping): sub_total - saved
             try:
-                goods_total = round2(Decimal(str(order.sub_total or 0)) - Decimal(str(order.saved or 0)))
-                if goods_total < Decimal("0.00"):
-                    goods_total = Decimal("0.00")
+                cod_amount = round2(Decimal(str(order.sub_total or 0)) - Decimal(str(order.saved or 0)))
+                if cod_amount < Decimal("0.00"):
+                    cod_amount = Decimal("0.00")
             except Exception:
-                goods_total = Decimal(str(order.sub_total or 0))
-            service_block["additionalServices"] = {
-                "cod": {"amount": float(goods_total), "processingType": "CASH"}
-            }
-        calc_request["service"] = service_block
-        calc_response = speedy_v1_calculate(calc_request)
-        # Try to extract a single price/total
-        quote = None
-        service_id = None
-        calcs = (calc_response or {}).get("calculations") or (calc_response or {}).get("services") or []
-        if calcs:
-            first = calcs[0]
-            service_id = first.get("serviceId") or (first.get("service") or {}).get("id") or first.get("id")
-            pricing = first.get("price") or {}
-            # Prefer total; fallback to amount
-            numeric_price = None
-            if isinstance(pricing, dict):
-                numeric_price = pricing.get("total") or pricing.get("amount") or pricing.get("totalLocal") or pricing.get("amountLocal")
-                currency = pricing.get("currency") or pricing.get("currencyLocal") or first.get("currency") or "BGN"
-            else:
-                # Some responses might have flat total/amount at the top level
-                numeric_price = first.get("total") or first.get("amount")
-                currency = first.get("currency") or "BGN"
-            quote = {
-                "serviceId": service_id,
-                "price": float(numeric_price) if isinstance(numeric_price, (int, float)) else None,
-                "currency": currency,
-            }
+                cod_amount = Decimal(str(order.sub_total or 0))
+        destination = quote_destination(
+            office_id=office_id,
+            site_id=site_id,
+            site_name=request.GET.get("city") or (order.address.city if order.address else ""),
+        )
+        quote, calc_request, calc_response = get_speedy_quote(
+            recipient_party, destination, total_weight, payer="RECIPIENT", cod_amount=cod_amount
+        )
+        remember_order_quote(order.order_id, destination, quote)
         return JsonResponse({
             "success": True,
             "quote": quote,
+            "cached": calc_response is None,
             "calc_request": calc_request,
             "calc_response": calc_response,
         })
@@ -805,12 +793,16 @@ def round2(val):
     return Decimal(val).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
 
+def get_category_by_path(category_path):
+    """Resolve a "parent/child/leaf" URL path to its category with a single query."""
+    return get_object_or_404(
+        Category.objects.select_related('parent', 'parent__parent'),
+        full_path=category_path.strip("/"),
+    )
+
+
 def get_category_ancestors(category):
-    ancestors = []
-    while category.parent:
-        ancestors.append(category.parent)
-        category = category.parent
-    return ancestors[::-1]
+    return category.get_ancestors()
 
 
 def clear_cart_items(request):
@@ -1234,8 +1226,11 @@ def shop(request):
     products_list = (
         store_models.Product.objects.filter(status="published")
         .select_related('category', 'category__parent', 'category__parent__parent')
+        .prefetch_related('gallery_images')
     )
-    products = paginate_queryset(request, products_list, 20)
+    products = listing_page(request, products_list, count_signature("shop", status="published"), 20)
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        return listing_json(request, products)
 
     categories = (
         store_models.Category.objects.filter(parent__isnull=True)
@@ -1262,6 +1257,8 @@ def shop(request):
     ]
 
     prices = [
+        {"id": "featured", "value": "Препоръчани"},
+        {"id": "newest", "value": "Най-нови"},
         {"id": "lowest", "value": "Най-висока към най-ниска"},
         {"id": "highest", "value": "Най-ниска към най-висока"},
     ]
@@ -1290,8 +1287,11 @@ def sale(request):
     products_list = (
         store_models.Product.objects.filter(status="published", on_sale=True)
         .select_related('category', 'category__parent', 'category__parent__parent')
+        .prefetch_related('gallery_images')
     )
-    products = paginate_queryset(request, products_list, 20)
+    products = listing_page(request, products_list, count_signature("sale", status="published", on_sale=True), 20)
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        return listing_json(request, products)
 
     categories = (
         store_models.Category.objects.filter(parent__isnull=True)
@@ -1317,6 +1317,8 @@ def sale(request):
     ]
 
     prices = [
+        {"id": "featured", "value": "Препоръчани"},
+        {"id": "newest", "value": "Най-нови"},
         {"id": "lowest", "value": "Най-висока към най-ниска"},
         {"id": "highest", "value": "Най-ниска към най-висока"},
     ]
@@ -1364,14 +1366,7 @@ def sale(request):
 
 
 def category(request, category_path):
-    slugs = category_path.strip("/").split("/")
-    category = None
-    parent = None
-    for slug in slugs:
-        category = get_object_or_404(Category, slug=slug, parent=parent)
-        parent = category
-
-    category = Category.objects.select_related('parent', 'parent__parent').get(pk=category.pk)
+    category = get_category_by_path(category_path)
 
     # Direct children
     child_categories_qs = Category.objects.filter(parent=category).select_related('parent', 'parent__parent')
@@ -1393,9 +1388,14 @@ def category(request, category_path):
         Product.objects.filter(status="published")
         .filter(models.Q(category=category) | models.Q(additional_categories=category))
         .select_related('category', 'category__parent', 'category__parent__parent')
+        .prefetch_related('gallery_images')
         .distinct()
     )
-    products = paginate_queryset(request, products_list, 12)
+    products = listing_page(
+        request, products_list, count_signature("category", categories=[category.id], status="published"), 12
+    )
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        return listing_json(request, products)
 
     # Build breadcrumbs using get_category_ancestors
     ancestors = get_category_ancestors(category)
@@ -1413,66 +1413,36 @@ def category(request, category_path):
         "user_wishlist_products": get_user_wishlist_products(request),
         "breadcrumbs": breadcrumbs,
     }
-    querydict = request.GET.copy()
-    if "page" in querydict:
-        del querydict["page"]
-    querystring = querydict.urlencode()
+    querystring = listing_querystring(request)
     context["querystring"] = querystring
     return render(request, "store/category.html", context)
 
 
-# Utility functions for category tree traversal (for zero-query descendant lookup)
-def find_category_node(tree, cat_id):
-    """Find a node in the tree by ID."""
-    for node in tree:
-        if node.id == cat_id:
-            return node
-        found = find_category_node(getattr(node, "children", []), cat_id)
-        if found:
-            return found
-    return None
-
-
-def collect_descendant_ids(node):
-    """Recursively collect all descendant IDs from a tree node."""
-    ids = []
-    for child in getattr(node, "children", []):
-        ids.append(child.id)
-        ids += collect_descendant_ids(child)
-    return ids
-
-
 def category_all_sub(request, category_path):
-    slugs = category_path.strip("/").split("/")
-    category = None
-    parent = None
-    for slug in slugs:
-        category = get_object_or_404(Category, slug=slug, parent=parent)
-        parent = category
-
-    # Get descendant ids from the cached category tree (zero queries)
-    category_tree = cache.get("category_tree")
-    node = find_category_node(category_tree, category.id)
-    if node:
-        descendant_ids = [node.id] + collect_descendant_ids(node)
-    else:
-        descendant_ids = [category.id]
+    category = get_category_by_path(category_path)
+
+    # Descendant ids (including linked subtrees) from the closure table in one query
+    descendant_ids = CategoryClosure.descendant_ids([category.id]) or [category.id]
 
     # Include products whose primary or additional categories are within descendant ids
     products_list = (
         Product.objects.filter(status="published")
         .filter(models.Q(category_id__in=descendant_ids) | models.Q(additional_categories__in=descendant_ids))
         .select_related('category', 'category__parent', 'category__parent__parent')
+        .prefetch_related('gallery_images')
         .distinct()
     )
     query = request.GET.get("q")
-    if query:
-        products_list = products_list.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__title__icontains=query)
-        )
-    products = paginate_queryset(request, products_list, 12)
+    # Punctuation-only queries have no words to search (and no search_rank)
+    searching = bool(search_terms(query or ""))
+    if searching:
+        products_list = search_products(products_list, query, order=False)
+    signature = count_signature("category_all", categories=descendant_ids, search=query, status="published")
+    products = listing_page(
+        request, products_list, signature, 12, default_sort="relevance" if searching else DEFAULT_SORT
+    )
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        return listing_json(request, products)
     ancestors = get_category_ancestors(category) if category else []
 
     # Build breadcrumbs
@@ -1491,22 +1461,13 @@ def category_all_sub(request, category_path):
         "breadcrumbs": breadcrumbs,
         "all_sub_mode": True,
     }
-    querydict = request.GET.copy()
-    if "page" in querydict:
-        del querydict["page"]
-    querystring = querydict.urlencode()
+    querystring = listing_querystring(request)
     context["querystring"] = querystring
     return render(request, "store/category.html", context)
 
 
 def product_detail(request, category_path, product_slug):
-    # Traverse the category path to resolve the correct category
-    slugs = category_path.strip("/").split("/")
-    category = None
-    parent = None
-    for slug in slugs:
-        category = get_object_or_404(Category, slug=slug, parent=parent)
-        parent = category
+    category = get_category_by_path(category_path)
 
     # Fetch the product with all related data to minimize queries
     product = get_object_or_404(
@@ -1610,6 +1571,14 @@ def product_detail(request, category_path, product_slug):
         "device_models": model_list,
         "sku_data_json": json.dumps(sku_data),
         "total_stock": total_stock,
+        "meta_view_event_id": track_meta_browser_event(request, "ViewContent", {
+            "currency": "BGN",
+            "value": float(product.effective_price or 0),
+            "content_ids": [str(product.id)],
+            "content_name": product.name,
+            "content_category": product.category.title if product.category else "",
+            "content_type": "product",
+        }),
     }
     # For mystery box, provide only the product's model groups as-is
     if getattr(product, "is_mystery_box", False):
@@ -1636,6 +1605,32 @@ def product_detail(request, category_path, product_slug):
     return render(request, "store/product_detail.html", context)
 
 
+def cart_state_response(cart_id, message, item_id=None, extra=None):
+    """
+    JSON payload shared by all cart AJAX endpoints.
+
+    The cart is loaded once (with products) by recalc_cart_group_promos; count,
+    sub_total, per-line sub_totals and promo free units are computed in memory.
+    """
+    summary = recalc_cart_group_promos(store_models.Cart.objects.filter(cart_id=cart_id))
+    payload = {
+        "message": message,
+        "total_cart_items": set_nav_count("cart", summary["total_cart_items"], cart_id=cart_id),
+        "cart_sub_total": "{:,.2f}".format(summary["cart_sub_total"]),
+        "promo_free_units_by_item": summary["promo_free_units_by_item"],
+        "item_sub_totals_by_item": {
+            str(ci.id): "{:,.2f}".format(ci.sub_total or 0) for ci in summary["items"]
+        },
+    }
+    if item_id is not None:
+        line = next((ci for ci in summary["items"] if ci.id == item_id), None)
+        payload["item_sub_total"] = "{:,.2f}".format(line.sub_total or 0) if line else "0.00"
+        payload["current_qty"] = line.qty if line else 0
+    if extra:
+        payload.update(extra)
+    return JsonResponse(payload)
+
+
 def add_to_cart(request):
     # Get parameters from the request (ID, model, size, quantity, cart_id)
     id = request.GET.get("id")
@@ -1647,35 +1642,22 @@ def add_to_cart(request):
     note = request.GET.get("note")
     # Support both mystery_devices and mystery_devices[] param keys
     devices_list = request.GET.getlist("mystery_devices") or request.GET.getlist("mystery_devices[]")
-    request.session["cart_id"] = cart_id
+    # Only touch the session when the id changes, to avoid a session write per request
+    if request.session.get("cart_id") != cart_id:
+        request.session["cart_id"] = cart_id
 
     # If item_id is provided, update cart item directly (from cart page +/- buttons)
     if item_id:
         cart_item = store_models.Cart.objects.filter(
             id=item_id, cart_id=cart_id
-        ).first()
+        ).select_related("product").first()
         if not cart_item:
             return JsonResponse({"error": "Cart item not found"}, status=404)
         new_qty = cart_item.qty + int(qty)
         if new_qty < 1:
+            removed_id = cart_item.id
             cart_item.delete()
-            message = "Продуктът е изтрит от количката"
-            total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-            cart_sub_total = (
-                store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-                    sub_total=models.Sum("sub_total")
-                )["sub_total"]
-                or 0.00
-            )
-            return JsonResponse(
-                {
-                    "message": message,
-                    "total_cart_items": total_cart_items.count(),
-                    "cart_sub_total": "{:,.2f}".format(cart_sub_total),
-                    "item_sub_total": "0.00",
-                    "current_qty": 0,
-                }
-            )
+            return cart_state_response(cart_id, "Продуктът е изтрит от количката", item_id=removed_id)
         cart_item.qty = new_qty
         cart_item.price = cart_item.product.effective_price
         # Apply product-level promo: charge only for paid units
@@ -1688,32 +1670,7 @@ def add_to_cart(request):
         cart_item.cart_id = cart_id
         cart_item.save()
         # After saving the change, normalize promos across product variants in this cart
-        try:
-            recalc_cart_group_promos(store_models.Cart.objects.filter(cart_id=cart_id))
-        except Exception:
-            pass
-        message = "Koличката е обновена"
-        total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-        cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-            sub_total=models.Sum("sub_total")
-        )["sub_total"]
-        # Build promo map for dynamic UI update
-        promo_map = {}
-        try:
-            for ci in store_models.Cart.objects.filter(cart_id=cart_id):
-                promo_map[str(ci.id)] = int(getattr(ci, "promo_free_units", 0) or 0)
-        except Exception:
-            pass
-        return JsonResponse(
-            {
-                "message": message,
-                "total_cart_items": total_cart_items.count(),
-                "cart_sub_total": "{:,.2f}".format(cart_sub_total),
-                "item_sub_total": "{:,.2f}".format(cart_item.sub_total),
-                "current_qty": cart_item.qty,
-                "promo_free_units_by_item": promo_map,
-            }
-        )
+        return cart_state_response(cart_id, "Koличката е обновена", item_id=cart_item.id)
 
     # Validate required fields for product detail add-to-cart
     if not id or not qty or not cart_id:
@@ -1727,48 +1684,32 @@ def add_to_cart(request):
 
     # For mystery box, device selection is optional
 
-    # Check if product has any SKU items at all
-    has_any_skus = store_models.ProductItem.objects.filter(product=product).exists()
+    # Resolve SKU dimensions, price and stock from the cached per-product matrix
+    sku_matrix = store_models.ProductItem.get_matrix(product)
 
     sku = None
     unit_price = None
 
-    if has_any_skus:
+    if sku_matrix.has_skus:
         # If product has ProductItems with size/model, require corresponding selection when relevant
-        has_size_dimension = store_models.ProductItem.objects.filter(product=product, size__isnull=False).exists()
-        has_model_dimension = store_models.ProductItem.objects.filter(product=product, device_models__isnull=False).exists()
-        if has_size_dimension and not (request.GET.get("size")):
+        if sku_matrix.has_size and not (request.GET.get("size")):
             return JsonResponse({"error": "Моля, изберете размер."}, status=400)
-        if has_model_dimension and not (request.GET.get("model")):
+        if sku_matrix.has_model and not (request.GET.get("model")):
             return JsonResponse({"error": "Моля, изберете модел."}, status=400)
 
         # Resolve SKU by size/model selection and validate stock per SKU
-        selected_size = None
-        if size:
-            selected_size = store_models.Size.objects.filter(name=size).first()
-            if not selected_size:
-                return JsonResponse({"error": "Невалиден размер."}, status=400)
-
-        selected_model = None
-        if model:
-            selected_model = store_models.DeviceModel.objects.filter(name=model).first()
-            if not selected_model:
-                return JsonResponse({"error": "Невалиден модел."}, status=400)
-
-        # Find SKU candidates
-        sku_qs = store_models.ProductItem.objects.filter(product=product)
-        if selected_size:
-            sku_qs = sku_qs.filter(size=selected_size)
-        if selected_model:
-            sku_qs = sku_qs.filter(device_models=selected_model)
-
-        sku = sku_qs.first()
+        if size and size not in sku_matrix.size_names:
+            return JsonResponse({"error": "Невалиден размер."}, status=400)
+        if model and model not in sku_matrix.model_names:
+            return JsonResponse({"error": "Невалиден модел."}, status=400)
+
+        sku = sku_matrix.find(size, model)
         if not sku:
             return JsonResponse({"error": "Избраната комбинация не е налична."}, status=400)
 
-        if int(qty) > int(getattr(sku, "quantity", 0)):
+        if int(qty) > int(sku["quantity"]):
             return JsonResponse({"error": "Недостатъчна наличност."}, status=404)
-        unit_price = sku.effective_price
+        unit_price = sku_matrix.price_for(product, sku)
     else:
         # No SKU items: use product-level stock and price
         if int(qty) > int(product.stock or 0):
@@ -1780,7 +1721,7 @@ def add_to_cart(request):
         product=product,
         model=model,
         size=size,
-    ).first()
+    ).select_related("product").first()
     # Do not merge mystery box lines (custom selections should be separate)
     if getattr(product, "is_mystery_box", False):
         cart_item = None
@@ -1788,43 +1729,17 @@ def add_to_cart(request):
     if cart_item:
         new_qty = cart_item.qty + int(qty)
         if new_qty < 1:
+            removed_id = cart_item.id
             cart_item.delete()
-            message = "Продуктът е изтрит от количката"
-            # recalculate cart_sub_total after deletion
-            total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-            cart_sub_total = (
-                store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-                    sub_total=models.Sum("sub_total")
-                )["sub_total"]
-                or 0.00
-            )
-            return JsonResponse(
-                {
-                    "message": message,
-                    "total_cart_items": total_cart_items.count(),
-                    "cart_sub_total": "{:,.2f}".format(cart_sub_total),
-                    "item_sub_total": "0.00",
-                    "current_qty": 0,
-                }
-            )
+            return cart_state_response(cart_id, "Продуктът е изтрит от количката", item_id=removed_id)
         cart_item.qty = new_qty
         # Resolve price from current cart line selection when possible
         if not sku:
             # Try to resolve SKU based on stored size/model on cart item
-            try:
-                sku_try = store_models.ProductItem.objects.filter(product=cart_item.product)
-                if cart_item.size:
-                    sku_try = sku_try.filter(size__name=cart_item.size)
-                else:
-                    sku_try = sku_try.filter(size__isnull=True)
-                if cart_item.model:
-                    sku_try = sku_try.filter(device_models__name=cart_item.model)
-                sku_resolved = sku_try.first()
-                line_price = sku_resolved.effective_price if sku_resolved else cart_item.product.effective_price
-            except Exception:
-                line_price = cart_item.product.effective_price
+            sku_resolved = sku_matrix.find(cart_item.size, cart_item.model, size_required=True)
+            line_price = sku_matrix.price_for(cart_item.product, sku_resolved)
         else:
-            line_price = sku.effective_price
+            line_price = sku_matrix.price_for(product, sku)
         cart_item.price = line_price
         try:
             paid_units = cart_item.product.compute_promo_paid_units(cart_item.qty)
@@ -1864,36 +1779,23 @@ def add_to_cart(request):
             except Exception:
                 cart.mystery_device_models = devices_list or []
         cart.save()
-        # After adding a new line, normalize promos across product variants in this cart
-        try:
-            recalc_cart_group_promos(store_models.Cart.objects.filter(cart_id=cart_id))
-        except Exception:
-            pass
         cart_item = cart
         message = "Продуктът е добавен в количката"
 
-    # Count the total number of items in the cart
-    total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-        sub_total=models.Sum("sub_total")
-    )["sub_total"]
-
-    # Return the response with the cart update message and total cart items
-    promo_map = {}
-    try:
-        for ci in store_models.Cart.objects.filter(cart_id=cart_id):
-            promo_map[str(ci.id)] = int(getattr(ci, "promo_free_units", 0) or 0)
-    except Exception:
-        pass
-    return JsonResponse(
-        {
-            "message": message,
-            "total_cart_items": total_cart_items.count(),
-            "cart_sub_total": "{:,.2f}".format(cart_sub_total),
-            "item_sub_total": "{:,.2f}".format(cart_item.sub_total),
-            "current_qty": cart_item.qty,
-            "promo_free_units_by_item": promo_map,
-        }
+    meta_event_id = None
+    if int(qty) > 0:
+        meta_event_id = track_meta_browser_event(request, "AddToCart", {
+            "currency": "BGN",
+            "value": float(Decimal(unit_price) * int(qty)),
+            "content_ids": [str(product.id)],
+            "content_name": product.name,
+            "contents": [{"id": str(product.id), "quantity": int(qty)}],
+            "content_type": "product",
+        })
+    # Normalize promos across product variants and return the cart state
+    return cart_state_response(
+        cart_id, message, item_id=cart_item.id,
+        extra={"meta_event_id": meta_event_id} if meta_event_id else None,
     )
 
 
@@ -1904,20 +1806,16 @@ def cart(request):
         cart_id = None
 
     # Normalize promos across variants before rendering
-    try:
-        recalc_cart_group_promos(store_models.Cart.objects.filter(cart_id=cart_id))
-    except Exception:
-        pass
-
-    items = store_models.Cart.objects.filter(cart_id=cart_id).select_related(
-        "product",
-        "product__category",
-        "product__category__parent",
-        "product__category__parent__parent"
+    summary = recalc_cart_group_promos(
+        store_models.Cart.objects.filter(cart_id=cart_id).select_related(
+            "product",
+            "product__category",
+            "product__category__parent",
+            "product__category__parent__parent"
+        )
     )
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-        sub_total=models.Sum("sub_total")
-    )["sub_total"]
+    items = summary["items"]
+    cart_sub_total = summary["cart_sub_total"]
 
     if not items:
         messages.warning(request, "Количката е празна")
@@ -1954,34 +1852,8 @@ def delete_cart_item(request):
     # Check if the item is already in the cart
     item = store_models.Cart.objects.get(product=product, id=item_id)
     item.delete()
-    # Normalize promos after deletion
-    try:
-        recalc_cart_group_promos(store_models.Cart.objects.filter(cart_id=cart_id))
-    except Exception:
-        pass
-
-    # Count the total number of items in the cart
-    total_cart_items = store_models.Cart.objects.filter(cart_id=cart_id)
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-        sub_total=models.Sum("sub_total")
-    )["sub_total"]
-
-    promo_map = {}
-    try:
-        for ci in store_models.Cart.objects.filter(cart_id=cart_id):
-            promo_map[str(ci.id)] = int(getattr(ci, "promo_free_units", 0) or 0)
-    except Exception:
-        pass
-    return JsonResponse(
-        {
-            "message": "Продуктът е изтрит",
-            "total_cart_items": total_cart_items.count(),
-            "cart_sub_total": (
-                "{:,.2f}".format(cart_sub_total) if cart_sub_total else 0.00
-            ),
-            "promo_free_units_by_item": promo_map,
-        }
-    )
+    # Normalize promos after deletion and return the cart state
+    return cart_state_response(cart_id, "Продуктът е изтрит")
 
 
 def create_order(request):
@@ -1991,46 +1863,41 @@ def create_order(request):
         return redirect("store:cart")
 
     cart_id = request.session.get("cart_id")
-    items = store_models.Cart.objects.filter(cart_id=cart_id)
 
-    # Guard: empty cart
-    if not items.exists():
-        messages.error(request, "Количката е празна.")
-        return redirect("store:cart")
-
-    cart_sub_total = store_models.Cart.objects.filter(cart_id=cart_id).aggregate(
-        sub_total=models.Sum("sub_total")
-    )["sub_total"] or 0
-
-    shipping = 0.00
-    order = store_models.Order()
-    order.sub_total = cart_sub_total
-    order.customer = request.user if request.user.is_authenticated else None
-    order.shipping = shipping
-    order.total = (order.sub_total or 0) + (order.shipping or 0)
-    order.save()
-
-    # Before snapshotting items to the order, recalc promos at cart level to ensure correct sub_totals
-    try:
-        recalc_cart_group_promos(items)
-    except Exception:
-        pass
+    with transaction.atomic():
+        # One query for the cart lines with their products; promos are normalized
+        # in memory so the order is written from the same snapshot
+        summary = recalc_cart_group_promos(store_models.Cart.objects.filter(cart_id=cart_id))
+        cart_items = summary["items"]
+
+        # Guard: empty cart
+        if not cart_items:
+            messages.error(request, "Количката е празна.")
+            return redirect("store:cart")
+
+        shipping = Decimal("0.00")
+        order = store_models.Order()
+        order.sub_total = summary["cart_sub_total"]
+        order.customer = request.user if request.user.is_authenticated else None
+        order.shipping = shipping
+        order.total = order.sub_total + shipping
+        order.save()
 
-    for i in items:
         # Snapshot price and sub_total exactly as in cart to avoid rounding/alloc mismatch
-        line_price = Decimal(str(i.price or 0))
-        sub_total_snapshot = Decimal(str(i.sub_total or 0))
-        store_models.OrderItem.objects.create(
-            order=order,
-            product=i.product,
-            qty=i.qty,
-            model=i.model,
-            size=i.size,
-            price=line_price,
-            sub_total=sub_total_snapshot,
-            note=getattr(i, "note", None),
-            mystery_device_models=getattr(i, "mystery_device_models", None),
-        )
+        store_models.OrderItem.objects.bulk_create([
+            store_models.OrderItem(
+                order=order,
+                product=i.product,
+                qty=i.qty,
+                model=i.model,
+                size=i.size,
+                price=Decimal(str(i.price or 0)),
+                sub_total=Decimal(str(i.sub_total or 0)),
+                note=getattr(i, "note", None),
+                mystery_device_models=getattr(i, "mystery_device_models", None),
+            )
+            for i in cart_items
+        ])
 
     return redirect("store:checkout", order.order_id)
 
@@ -2088,14 +1955,15 @@ def coupon_apply(request, order_id):
                 messages.error(request, msg)
                 return redirect("store:checkout", order.order_id)
 
-        # Always clear any existing coupons and reset saved and total
-        order.coupons.clear()
-        order.saved = round2(0)
-        order.total = round2(order.sub_total + (order.shipping or 0))
+        with transaction.atomic():
+            # Always clear any existing coupons and reset saved and total
+            order.coupons.clear()
+            order.saved = round2(0)
+            order.total = round2(order.sub_total + (order.shipping or 0))
 
-        # Apply coupon, recalculate everything in one place!
-        order.coupons.add(coupon)
-        apply_coupon_discount(order)
+            # Apply coupon, recalculate everything in one place!
+            order.coupons.add(coupon)
+            apply_coupon_discount(order, update_fields=["saved", "total"])
 
         msg = "Купонът е активиран."
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -2186,24 +2054,10 @@ def cod_payment(request, order_id):
         order.payment_status = "cash_on_delivery"
         # Mark order as received when customer confirms COD
         order.order_status = "received"
-        _send_shipment(order)
-        try:
-            send_meta_purchase_event(order, request)
-        except Exception:
-            pass
-        order.save()
-        send_order_notification_email(
-            order=order,
-            email_heading=f"Потвърдена поръчка #{order.order_id}",
-            email_title="iBands: Приета поръчка",
-            to_email=order.address.email,
-        )
-        send_order_notification_email(
-            order=order,
-            email_heading=f"Потвърдена поръчка #{order.order_id}",
-            email_title="iBands: Приета поръчка",
-            to_email=settings.ORDER_NOTIFICATION_EMAIL,
-        )
+        with transaction.atomic():
+            order.save()
+            # Shipment, CAPI event and emails run in the fulfilment worker
+            enqueue_order_fulfilment(order, request)
 
         if request.user.is_authenticated:
             customer_models.Notifications.objects.create(
@@ -2505,24 +2359,10 @@ def stripe_payment_verify(request, order_id):
             order.payment_method = "card"
             # Mark order as received upon successful payment
             order.order_status = "received"
-            _send_shipment(order)
-            try:
-                send_meta_purchase_event(order, request)
-            except Exception:
-                pass
-            order.save()
-            send_order_notification_email(
-                order=order,
-                email_heading=f"Потвърдена поръчка #{order.order_id}",
-                email_title="iBands: Приета поръчка",
-                to_email=order.address.email,
-            )
-            send_order_notification_email(
-                order=order,
-                email_heading=f"Потвърдена поръчка #{order.order_id}",
-                email_title="iBands: Приета поръчка",
-                to_email=settings.ORDER_NOTIFICATION_EMAIL,
-            )
+            with transaction.atomic():
+                order.save()
+                # Shipment, CAPI event and emails run in the fulfilment worker
+                enqueue_order_fulfilment(order, request)
             if request.user.is_authenticated:
                 customer_models.Notifications.objects.create(
                     type="New Order", user=request.user
@@ -2588,124 +2428,189 @@ def set_payment_method(request, order_id):
     return JsonResponse({"success": True, "payment_method": order.payment_method})
 
 
-def filter_products(request):
-    products = store_models.Product.objects.all()
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60
+
+
+def _product_card_cache_key(product, in_wishlist, band_product_id=None, category_version=""):
+    updated = product.updated_at.timestamp() if product.updated_at else 0
+    # Band of the Week prices change without touching updated_at, and category
+    # renames/moves change the card's links without touching the product
+    band = int(product.id == band_product_id)
+    return f"product_card:{product.id}:{updated}:{int(bool(in_wishlist))}:{band}:{category_version}"
+
+
+def render_product_cards(products, user_wishlist_products):
+    """
+    Render product cards for a page of products in one pass.
+
+    Cards are cached per product (keyed on id, updated_at, wishlist state, Band
+    of the Week and the category tree version) and fetched with a single
+    get_many. Only the misses get their gallery images prefetched (one query)
+    and are rendered with the same compiled template.
+    """
+    band_product_id = BandOfTheWeek.get_current_product_id()
+    try:
+        category_version = cache.get(CATEGORY_TREE_VERSION_KEY) or ""
+    except Exception:
+        category_version = ""
+    keys = {
+        product.id: _product_card_cache_key(
+            product, product.id in user_wishlist_products, band_product_id, category_version
+        )
+        for product in products
+    }
+    try:
+        cached = cache.get_many(list(keys.values()))
+    except Exception:
+        cached = {}
+
+    missing = [product for product in products if keys[product.id] not in cached]
+    if missing:
+        models.prefetch_related_objects(missing, "gallery_images")
+        template = get_template("partials/_product_list.html")
+        rendered = {}
+        for product in missing:
+            context = {"product": product, "user_wishlist_products": user_wishlist_products}
+            if product.id == band_product_id and product.price:
+                # Same badge and half price as the homepage band card
+                context.update({
+                    "band_of_the_week": product,
+                    "band_price": product.compute_effective_price(band_product_id),
+                    "band_discount_percent": 50,
+                })
+            rendered[keys[product.id]] = template.render(context)
+        cached.update(rendered)
+        try:
+            cache.set_many(rendered, timeout=PRODUCT_CARD_CACHE_TIMEOUT)
+        except Exception:
+            pass
+
+    return "".join(cached[keys[product.id]] for product in products)
+
+
+def listing_querystring(request):
+    """Current listing filters without the page/cursor, for "load more" links."""
+    querydict = request.GET.copy()
+    for key in ("page", "cursor"):
+        querydict.pop(key, None)
+    return querydict.urlencode()
 
-    # Get filters from the AJAX request
-    categories = request.GET.getlist("categories[]")
-    rating = request.GET.getlist("rating[]")
-    sizes = request.GET.getlist("sizes[]")
-    colors = request.GET.getlist("colors[]")
-    price_order = request.GET.get("prices")
-    search_filter = request.GET.get("searchFilter")
-    display = request.GET.get("display")
-    page = request.GET.get("page", 1)
 
-    # Apply category filtering
+def listing_json(request, products, is_shop=False, extra=None):
+    """Next keyset page of a listing for infinite scroll."""
+    html = render_product_cards(products.object_list, get_user_wishlist_products(request))
+    pagination_html = render_to_string(
+        "partials/_load_more.html",
+        {"products": products, "is_shop": is_shop, "querystring": listing_querystring(request)},
+    )
+    return JsonResponse(
+        {"html": html, "pagination_html": pagination_html, "product_count": products.count, **(extra or {})}
+    )
+
+
+def _filter_products_in_db(products, categories, rating, sizes, colors):
+    """The shop filters as joins, for when the facet index cannot be loaded."""
     if categories:
-        # Use the cached category tree for descendant lookup
-        category_tree = cache.get("category_tree")
-        all_category_ids = []
+        # Expand selected categories to their descendants via the closure table
+        category_ids = []
         for cid in categories:
             try:
-                cid_int = int(cid)
-                node = find_category_node(category_tree, cid_int)
-                if node:
-                    all_category_ids.append(node.id)
-                    all_category_ids.extend(collect_descendant_ids(node))
+                category_ids.append(int(cid))
             except Exception:
                 continue
+        all_category_ids = CategoryClosure.descendant_ids(category_ids) if category_ids else []
         products = products.filter(
             models.Q(category__id__in=all_category_ids) |
             models.Q(additional_categories__id__in=all_category_ids)
-        ).distinct()
-
-    # Apply rating filtering
+        )
     if rating:
-        products = products.filter(reviews__rating__in=rating).distinct()
-
-    # Apply size filtering (by ProductItem sizes)
+        products = products.filter(reviews__rating__in=rating)
     if sizes:
-        products = products.filter(items__size__name__in=sizes).distinct()
-
-    # Apply color filtering by selected color group ids
+        products = products.filter(items__size__name__in=sizes)
     if colors:
         try:
             color_group_ids = [int(cid) for cid in colors]
         except Exception:
             color_group_ids = []
         if color_group_ids:
-            products = products.filter(
-                colors__group__id__in=color_group_ids
-            ).distinct()
-
-    # Apply price ordering (by effective price: sale_price if lower, else price)
-    if price_order in {"lowest", "highest"}:
-        products = products.annotate(
-            sort_price=models.Case(
-                models.When(
-                    models.Q(sale_price__isnull=False) & models.Q(sale_price__lt=models.F("price")),
-                    then=models.F("sale_price"),
-                ),
-                default=models.F("price"),
-                output_field=models.DecimalField(max_digits=12, decimal_places=2),
-            )
-        )
-        if price_order == "lowest":
-            products = products.order_by("-sort_price")
-        else:
-            products = products.order_by("sort_price")
+            products = products.filter(colors__group__id__in=color_group_ids)
+    return products.distinct() if any((categories, rating, sizes, colors)) else products
 
-    # Apply search filter
-    if search_filter:
-        products = products.filter(
-            Q(name__icontains=search_filter) |
-            Q(description__icontains=search_filter) |
-            Q(category__title__icontains=search_filter)
-        )
+
+def filter_products(request):
+    products = store_models.Product.objects.select_related(
+        'category', 'category__parent', 'category__parent__parent'
+    ).filter(status="published")
+
+    # Get filters from the AJAX request
+    categories = request.GET.getlist("categories[]")
+    rating = request.GET.getlist("rating[]")
+    sizes = request.GET.getlist("sizes[]")
+    colors = request.GET.getlist("colors[]")
+    search_filter = request.GET.get("searchFilter")
+    if not search_terms(search_filter or ""):
+        search_filter = None  # punctuation only: nothing to search or rank by
+    display = request.GET.get("display")
+
+    # Search results are ranked best-first unless a sort was chosen
+    sort = listing_sort(request.GET, default="relevance" if search_filter else DEFAULT_SORT)
+    cursor = request.GET.get("cursor")
 
     # Determine items per page
     try:
-        per_page = int(display) if display else 20
+        per_page = max(1, min(int(display), 100)) if display else 20
     except Exception:
         per_page = 20
 
-    # Paginate filtered queryset
-    from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-
-    paginator = Paginator(products, per_page)
+    selected = {"categories": categories, "rating": rating, "sizes": sizes, "colors": colors}
     try:
-        products_page = paginator.page(page)
-    except PageNotAnInteger:
-        products_page = paginator.page(1)
-    except EmptyPage:
-        products_page = paginator.page(paginator.num_pages)
-
-    user_wishlist_products = get_user_wishlist_products(request)
-    product_html_list = [
-        render_to_string(
-            "partials/_product_list.html",
-            {
-                "product": product,
-                "user_wishlist_products": user_wishlist_products,
-            }
+        facet_index = get_facet_index()
+    except Exception as e:
+        print("Facet index unavailable, filtering in the database:", e)
+        products = _filter_products_in_db(products, categories, rating, sizes, colors)
+        if search_filter:
+            products = search_products(products, search_filter, order=False)
+        products_page = keyset_page(products, sort, cursor, per_page)
+        products_page.count = cached_count(products, count_signature(
+            "shop_filter", categories=categories, rating=rating, sizes=sizes, colors=colors,
+            search=search_filter, status="published",
+        ))
+        return listing_json(request, products_page, is_shop=True)
+
+    # Category/rating/size/colour selections are bitmap operations on the
+    # in-memory facet index; the search filter narrows the same bitmap. The
+    # page is ordered and cut from the index, so only its ids hit the database.
+    ranks = None
+    search_ids = None
+    if search_filter:
+        ranks = dict(
+            search_products(store_models.Product.objects.all(), search_filter, order=False)
+            .values_list("pk", "search_rank")
         )
-        for product in products_page
-    ]
-    html = ''.join(product_html_list)
-    pagination_html = render_to_string(
-        "partials/_pagination.html", {"products": products_page, "is_shop": True}
+        search_ids = bitmap_of(ranks)
+    matched = facet_index.match(selected, base=search_ids)
+    page_ids, next_cursor = facet_index.page(matched, sort, cursor, per_page, ranks)
+    rows = products.in_bulk(page_ids)
+    products_page = CursorPage(
+        [rows[pk] for pk in page_ids if pk in rows], sort, next_cursor, count=matched.bit_count()
     )
-
-    return JsonResponse(
-        {
-            "html": html,
-            "pagination_html": pagination_html,
-            "product_count": paginator.count,
-        }
+    return listing_json(
+        request, products_page, is_shop=True,
+        extra={"facets": facet_index.counts(selected, base=search_ids)},
     )
 
 
+def search_suggest(request):
+    query = (request.GET.get("q") or "").strip()
+    try:
+        limit = max(1, min(int(request.GET.get("limit", 8)), 20))
+    except (TypeError, ValueError):
+        limit = 8
+    if not query:
+        return JsonResponse({"query": query, "suggestions": []})
+    return JsonResponse({"query": query, "suggestions": get_suggest_index().suggest(query, limit)})
+
+
 def order_tracker_page(request):
     if request.method == "POST":
         key = request.POST.get("item_id", "").strip()
@@ -10,6 +10,7 @@ from store import models as store_models
 from customer import models as customer_models
 from decimal import Decimal
 from store.emails import send_welcome_email
+from store.utils import invalidate_nav_count
 
 
 def register_view(request):
@@ -166,6 +167,7 @@ def login_view(request):
                             try:
                                 # Attach session wishlist rows to this user
                                 customer_models.Wishlist.objects.filter(wishlist_id=current_cart_id).update(user=user_authenticate)
+                                invalidate_nav_count("wishlist", user_id=user_authenticate.pk)
                                 # Deduplicate same product for this user (keep a single row per product)
                                 user_wishlist = (
                                     customer_models.Wishlist.objects